@@ -0,0 +1,62 @@
+# compare the bulk (raw DBAPI executemany) and ORM paths of CrSqliteSyncStore.apply_changes
+# usage: python -m benchmarks.apply_changes_benchmark [n_changes ...]
+
+import sys
+import time
+
+from sqlalchemy import text
+
+from sqlite_setup import get_engine, remove_db_file
+from syncstore.crsqlite_syncstore import CrSqliteSyncStore
+from syncstore.versioned_changes_syncstore import Changes, ChangesQuery, Tables
+
+BENCH_DB_DIR = "./db"
+DEFAULT_SIZES = [1_000, 100_000, 1_000_000]
+
+
+def create_store(name: str) -> CrSqliteSyncStore:
+    db_file = f"{BENCH_DB_DIR}/bench_apply_{name}.db"
+    remove_db_file(db_file)
+    engine = get_engine(db_file=db_file)
+    with engine.connect() as c:
+        c.execute(text("CREATE TABLE item (id TEXT PRIMARY KEY NOT NULL, v TEXT)"))
+        c.commit()
+    store = CrSqliteSyncStore(name, None, engine)
+    store.setup_table_change_tracking(Tables(["item"]))
+    return store
+
+
+def generate_changes(n: int) -> Changes:
+    source = create_store("source")
+    with source.engine.connect() as c:
+        c.execute(
+            text("INSERT INTO item VALUES (:id, :v)"),
+            [{"id": f"item_{i}", "v": f"value_{i}"} for i in range(n)],
+        )
+        c.commit()
+    changes = source.get_changes(ChangesQuery(from_site_id=source.get_site_id()))
+    source.engine.dispose()
+    return changes
+
+
+def time_apply(changes: Changes, bulk_apply: bool) -> float:
+    target = create_store("bulk" if bulk_apply else "orm")
+    target.bulk_apply = bulk_apply
+    start = time.perf_counter()
+    target.apply_changes(changes)
+    duration = time.perf_counter() - start
+    target.engine.dispose()
+    return duration
+
+
+def main(sizes: list[int]) -> None:
+    print(f"{'n_changes':>10} {'orm [s]':>10} {'bulk [s]':>10} {'speedup':>8}")
+    for n in sizes:
+        changes = generate_changes(n)
+        orm = time_apply(changes, bulk_apply=False)
+        bulk = time_apply(changes, bulk_apply=True)
+        print(f"{n:>10} {orm:>10.3f} {bulk:>10.3f} {orm / bulk:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or DEFAULT_SIZES)
@@ -0,0 +1,110 @@
+# duration of EntityChangeCheckerImpl.check_all with many tracked lists of which few changed:
+# full (reload + compare all tracked lists) vs. incremental (only lists with rows in crsql_changes),
+# each reloading the lists one by one or in batches (load_many)
+# usage: python -m benchmarks.change_checking_benchmark [n_lists] [churn]
+
+import sys
+import time
+
+from sqlalchemy import text
+
+from crsqlite_todo_sync_store import CrSqliteTodoSyncStore
+from sqlite_setup import get_engine, remove_db_file
+from todostore.todostore import TodoList
+
+BENCH_DB_DIR = "./db"
+N_ITEMS_PER_LIST = 3
+N_ROUNDS = 3
+
+
+def create_store(
+    name: str, n_lists: int, incremental: bool, batch: bool
+) -> CrSqliteTodoSyncStore:
+    db_file = f"{BENCH_DB_DIR}/bench_change_checking_{name}.db"
+    remove_db_file(db_file)
+    store = CrSqliteTodoSyncStore(
+        name,
+        get_engine(db_file=db_file),
+        None,
+        incremental_change_checking=incremental,
+        batch_change_checking=batch,
+    )
+    with store.engine.connect() as c:  # single transaction, instead of a save per list
+        c.execute(
+            text("INSERT INTO todo_list VALUES (:id, :title)"),
+            [{"id": f"list_{i}", "title": f"title_{i}"} for i in range(n_lists)],
+        )
+        c.execute(
+            text("INSERT INTO todo_item VALUES (:id, :content, :list_id)"),
+            [
+                {"id": f"item_{i}_{j}", "content": "content", "list_id": f"list_{i}"}
+                for i in range(n_lists)
+                for j in range(N_ITEMS_PER_LIST)
+            ],
+        )
+        c.commit()
+    return store
+
+
+def run(
+    n_lists: int, churn: float, incremental: bool, batch: bool
+) -> tuple[float, float, int]:
+    # returns the duration of the first check, the mean of the following ones, and the changes seen
+    store = create_store(mode_name(incremental, batch), n_lists, incremental, batch)
+    tracked: list[TodoList] = []
+    n_changed = 0
+
+    def on_change(tracked_list: TodoList, current: TodoList | None) -> None:
+        # the application takes over the current value
+        nonlocal n_changed
+        n_changed += 1
+        if current is not None:
+            tracked_list.title, tracked_list.todos = current.title, current.todos
+
+    for todo_list in store.load_many(f"list_{i}" for i in range(n_lists)).values():
+        tracked.append(todo_list)
+        store.track(
+            todo_list,
+            lambda tl: tl.list_id,
+            lambda list_id=todo_list.list_id: store.load(list_id),  # type: ignore
+            lambda current, tl=todo_list: on_change(tl, current),  # type: ignore
+        )
+
+    start = time.perf_counter()
+    store.check_all()
+    first = time.perf_counter() - start
+
+    n_churn = max(1, int(n_lists * churn))
+    durations = []
+    for r in range(N_ROUNDS):
+        for i in range(r * n_churn, (r + 1) * n_churn):
+            changed = TodoList(tracked[i].list_id, f"round_{r}", tracked[i].todos)
+            store.save(changed)
+        start = time.perf_counter()
+        store.check_all()
+        durations.append(time.perf_counter() - start)
+    store.engine.dispose()
+    return first, sum(durations) / len(durations), n_changed
+
+
+def mode_name(incremental: bool, batch: bool) -> str:
+    return ("incremental" if incremental else "full") + ("-batch" if batch else "")
+
+
+def main(n_lists: int, churn: float) -> None:
+    print(f"{n_lists} tracked lists, {churn:.1%} changed between checks")
+    print(f"{'mode':>18} {'first [ms]':>11} {'check [ms]':>11} {'changes':>8}")
+    for incremental in [False, True]:
+        for batch in [False, True]:
+            first, check, n_changed = run(n_lists, churn, incremental, batch)
+            print(
+                f"{mode_name(incremental, batch):>18} {first * 1000:>11.1f}"
+                f" {check * 1000:>11.1f} {n_changed:>8}"
+            )
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 10_000,
+        float(sys.argv[2]) if len(sys.argv) > 2 else 0.01,
+    )
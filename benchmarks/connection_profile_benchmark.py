@@ -0,0 +1,68 @@
+# compare the sqlite connection profiles of get_engine on save and sync workloads
+# usage: python -m benchmarks.connection_profile_benchmark [n_saves] [n_items]
+
+import sys
+import time
+
+from crsqlite_todo_sync_store import CrSqliteTodoSyncStore
+from sqlite_setup import PROFILES, ConnectionProfile, get_engine, remove_db_file
+from todostore.todostore import TodoItem, TodoList
+
+BENCH_DB_DIR = "./db"
+
+
+def create_store(
+    name: str, profile: ConnectionProfile | None, remote: CrSqliteTodoSyncStore | None
+) -> CrSqliteTodoSyncStore:
+    db_file = f"{BENCH_DB_DIR}/bench_profile_{name}.db"
+    remove_db_file(db_file)
+    engine = get_engine(db_file=db_file, profile=profile)
+    return CrSqliteTodoSyncStore(
+        name, engine, remote.syncstore if remote is not None else None
+    )
+
+
+def run(profile: ConnectionProfile | None, n_saves: int, n_items: int) -> list[float]:
+    source = create_store("source", profile, None)
+
+    # many small transactions: one save per added item
+    todo_list = TodoList("small_saves", "title")
+    start = time.perf_counter()
+    for i in range(n_saves):
+        todo_list.todos.append(TodoItem(f"item_{i}", f"content {i}"))
+        source.save(todo_list)
+    t_small_saves = time.perf_counter() - start
+
+    # one large transaction
+    large_list = TodoList("large_save", "title")
+    large_list.todos = [TodoItem(f"l_item_{i}", f"content {i}") for i in range(n_items)]
+    start = time.perf_counter()
+    source.save(large_list)
+    t_large_save = time.perf_counter() - start
+
+    # initial sync of a new replica (in-process)
+    replica = create_store("replica", profile, source)
+    start = time.perf_counter()
+    replica.sync()
+    t_sync = time.perf_counter() - start
+
+    source.engine.dispose()
+    replica.engine.dispose()
+    return [t_small_saves, t_large_save, t_sync]
+
+
+def main(n_saves: int, n_items: int) -> None:
+    print(f"{n_saves} small saves, 1 save of {n_items} items, sync of all changes")
+    print(f"{'profile':>12} {'saves [s]':>10} {'large [s]':>10} {'sync [s]':>10}")
+    profiles: list[ConnectionProfile | None] = [None, *PROFILES.values()]
+    for profile in profiles:
+        durations = run(profile, n_saves, n_items)
+        name = "none" if profile is None else profile.name
+        print(f"{name:>12} " + " ".join(f"{d:>10.3f}" for d in durations))
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 200,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 10_000,
+    )
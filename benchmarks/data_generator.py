@@ -0,0 +1,70 @@
+# seeded synthetic todo data for the benchmarks: the same seed always generates the same lists and edits
+
+import random
+from copy import deepcopy
+from dataclasses import dataclass, field
+
+from todostore.todostore import TodoItem, TodoList
+
+WORDS = (
+    "buy milk bread call mom fix bike book flight pay rent clean kitchen water plants"
+    " send report review code plan trip walk dog renew passport order pizza"
+).split()
+
+
+@dataclass
+class DataGenerator:
+    seed: int = 0
+    n_words: tuple[int, int] = (2, 8)  # words per item content
+    rng: random.Random = field(init=False, repr=False)
+    n_generated_items: int = field(default=0, init=False)
+
+    def __post_init__(self) -> None:
+        self.rng = random.Random(self.seed)
+
+    def text(self) -> str:
+        return " ".join(self.rng.choices(WORDS, k=self.rng.randint(*self.n_words)))
+
+    def item(self, prefix: str = "item") -> TodoItem:
+        self.n_generated_items += 1
+        return TodoItem(f"{prefix}_{self.n_generated_items:08}", self.text())
+
+    def lists(self, n_lists: int, n_items: int, prefix: str = "list") -> list[TodoList]:
+        # n_items per list on average (uniformly 0..2*n_items)
+        return [
+            TodoList(
+                f"{prefix}_{i:08}",
+                self.text(),
+                [
+                    self.item(f"{prefix}_{i:08}_item")
+                    for _ in range(self.rng.randint(0, 2 * n_items))
+                ],
+            )
+            for i in range(n_lists)
+        ]
+
+    def edit(self, todo_list: TodoList) -> TodoList:
+        # a copy with a typical edit: content changed (most often), item added or removed, retitled
+        edited = deepcopy(todo_list)
+        kind = self.rng.choices(["content", "add", "remove", "title"], [6, 2, 1, 1])[0]
+        if kind == "content" and edited.todos:
+            self.rng.choice(edited.todos).content = self.text()
+        elif kind == "remove" and edited.todos:
+            edited.todos.pop(self.rng.randrange(len(edited.todos)))
+        elif kind == "title":
+            edited.title = self.text()
+        else:
+            edited.todos.append(self.item(f"{edited.list_id}_item"))
+        return edited
+
+    def edits(self, todo_lists: list[TodoList], fraction: float) -> list[TodoList]:
+        # edited copies of a random fraction of the lists
+        n = max(1, int(len(todo_lists) * fraction))
+        return [self.edit(t) for t in self.rng.sample(todo_lists, n)]
+
+    def conflicting_edits(
+        self, todo_lists: list[TodoList], fraction: float
+    ) -> tuple[list[TodoList], list[TodoList]]:
+        # two replicas editing the same lists concurrently, crsqlite has to merge them
+        targets = self.rng.sample(todo_lists, max(1, int(len(todo_lists) * fraction)))
+        return [self.edit(t) for t in targets], [self.edit(t) for t in targets]
@@ -0,0 +1,88 @@
+# latency of repeated small syncs over http:
+# new connection per request + site_id lookup per sync, vs. pooled keep-alive connections + cached site_id
+# usage: python -m benchmarks.repeated_sync_benchmark [n_syncs]
+
+import logging
+import statistics
+import sys
+import time
+from multiprocessing import Process
+
+import requests
+
+from crsqlite_todo_sync_store import CrSqliteTodoSyncStore
+from sqlite_setup import get_engine, remove_db_file
+from syncstore.network.client_sync_store import HttpClientVersionedChangesSyncstore
+from syncstore.network.server_sync_store import run_sync_store_server_callable
+from syncstore.versioned_changes_syncstore import VersionedChangesSyncStore
+from todostore.todostore import TodoItem, TodoList
+
+BENCH_DB_DIR = "./db"
+HOST = "127.0.0.1"
+PORT = 5001
+
+
+def db_file(name: str) -> str:
+    path = f"{BENCH_DB_DIR}/bench_repeated_sync_{name}.db"
+    remove_db_file(path)
+    return path
+
+
+def server_store() -> VersionedChangesSyncStore:
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)  # no per-request log lines
+    engine = get_engine(db_file=f"{BENCH_DB_DIR}/bench_repeated_sync_server.db")
+    return CrSqliteTodoSyncStore("server", engine, None).syncstore
+
+
+def start_server() -> Process:
+    db_file("server")
+    process = Process(
+        target=run_sync_store_server_callable(server_store, HOST, PORT), daemon=True
+    )
+    process.start()
+    for _ in range(100):
+        try:
+            requests.get(f"http://{HOST}:{PORT}/", timeout=1)
+            return process
+        except requests.ConnectionError:
+            time.sleep(0.05)
+    raise Exception("server did not start")
+
+
+def run(name: str, n_syncs: int, keep_alive: bool) -> list[float]:
+    client = HttpClientVersionedChangesSyncstore(f"{name}_client", None, HOST, PORT)
+    if not keep_alive:
+        client.session.headers["Connection"] = "close"
+    store = CrSqliteTodoSyncStore(name, get_engine(db_file=db_file(name)), client)
+    todo_list = TodoList(f"list_{name}", "title")
+    durations = []
+    for i in range(n_syncs):
+        todo_list.todos.append(TodoItem(f"{name}_item_{i}", f"content {i}"))
+        store.save(todo_list)
+        if not keep_alive:
+            store.syncstore.remote_site_ids.clear()  # looked up on every sync
+        start = time.perf_counter()
+        store.sync()
+        durations.append(time.perf_counter() - start)
+    client.close()
+    return durations
+
+
+def main(n_syncs: int) -> None:
+    server = start_server()
+    try:
+        print(f"{'mode':>22} {'mean [ms]':>10} {'p50 [ms]':>9} {'p95 [ms]':>9}")
+        for name, keep_alive in [("per_request", False), ("keep_alive", True)]:
+            durations = [d * 1000 for d in run(name, n_syncs, keep_alive)]
+            p95 = statistics.quantiles(durations, n=20)[-1]
+            print(
+                f"{name:>22} {statistics.mean(durations):>10.2f}"
+                f" {statistics.median(durations):>9.2f} {p95:>9.2f}"
+            )
+    finally:
+        server.terminate()
+        server.join()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,66 @@
+# latency of saving a large list after small modifications, and the changes it records for sync:
+# merge of the whole list (SqlTodoStore.save) vs. diff against the previously loaded state
+# usage: python -m benchmarks.save_benchmark [n_items] [n_saves]
+
+import statistics
+import sys
+import time
+from copy import deepcopy
+
+from crsqlite_todo_sync_store import CrSqliteTodoSyncStore
+from sqlite_setup import get_engine, remove_db_file
+from syncstore.versioned_changes_syncstore import ChangesQuery
+from todostore.todostore import TodoItem, TodoList
+
+BENCH_DB_DIR = "./db"
+
+
+def run(n_items: int, n_saves: int, diff: bool) -> tuple[list[float], int]:
+    # returns the save durations, and the number of changes recorded by them
+    name = "diff" if diff else "merge"
+    db_file = f"{BENCH_DB_DIR}/bench_save_{name}.db"
+    remove_db_file(db_file)
+    store = CrSqliteTodoSyncStore(name, get_engine(db_file=db_file), None)
+    todo_list = TodoList("list", "title")
+    todo_list.todos = [TodoItem(f"item_{i:05}", f"content {i}") for i in range(n_items)]
+    store.save(todo_list)
+    version_before = store.syncstore.get_current_version()
+
+    durations = []
+    for i in range(n_saves):
+        previous = deepcopy(todo_list)
+        # a typical edit: one item changed, one added, one removed
+        todo_list.todos[i % n_items].content = f"edit {i}"
+        todo_list.todos.append(TodoItem(f"new_item_{i:05}", "new"))
+        del todo_list.todos[(i * 7 + 3) % len(todo_list.todos)]
+        start = time.perf_counter()
+        store.save(todo_list, previous if diff else None)
+        durations.append(time.perf_counter() - start)
+
+    assert store.load("list") == TodoList(
+        "list", "title", sorted(todo_list.todos, key=lambda t: t.item_id)
+    )
+    changes = store.syncstore.get_changes(
+        ChangesQuery(version_before, from_site_id=store.syncstore.get_site_id())
+    )
+    store.engine.dispose()
+    return durations, len(changes.changes)
+
+
+def main(n_items: int, n_saves: int) -> None:
+    print(f"list of {n_items} items, {n_saves} saves (1 item changed, added, removed)")
+    print(f"{'mode':>6} {'p50 [ms]':>9} {'max [ms]':>9} {'changes':>8}")
+    for diff in [False, True]:
+        durations, n_changes = run(n_items, n_saves, diff)
+        ms = [d * 1000 for d in durations]
+        print(
+            f"{'diff' if diff else 'merge':>6} {statistics.median(ms):>9.2f}"
+            f" {max(ms):>9.2f} {n_changes:>8}"
+        )
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 1_000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 50,
+    )
@@ -0,0 +1,120 @@
+# throughput of the sync server under concurrent clients, depending on the number of workers:
+# readers (GET /changes) run concurrently, writers (POST /changes) are serialized
+# usage: python -m benchmarks.server_load_benchmark [n_clients] [duration_s]
+
+import logging
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Process
+
+import requests
+
+from crsqlite_todo_sync_store import CrSqliteTodoSyncStore
+from sqlite_setup import get_engine, remove_db_file
+from syncstore.network.client_sync_store import HttpClientVersionedChangesSyncstore
+from syncstore.network.server_sync_store import run_sync_store_server_callable
+from syncstore.versioned_changes_syncstore import (
+    Changes,
+    ChangesQuery,
+    VersionedChangesSyncStore,
+)
+from todostore.todostore import TodoItem, TodoList
+
+BENCH_DB_DIR = "./db"
+SERVER_DB_FILE = f"{BENCH_DB_DIR}/bench_server_load_server.db"
+HOST = "127.0.0.1"
+PORT = 5002
+N_ITEMS = 500
+WRITE_RATIO = 0.1  # every 10th request of a client is a write
+
+
+def server_store() -> VersionedChangesSyncStore:
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)  # no per-request log lines
+    return CrSqliteTodoSyncStore(
+        "server", get_engine(db_file=SERVER_DB_FILE), None
+    ).syncstore
+
+
+def seed_server_db() -> None:
+    remove_db_file(SERVER_DB_FILE)
+    engine = get_engine(db_file=SERVER_DB_FILE)
+    store = CrSqliteTodoSyncStore("server", engine, None)
+    todo_list = TodoList("list", "title")
+    todo_list.todos = [TodoItem(f"item_{i}", f"content {i}") for i in range(N_ITEMS)]
+    store.save(todo_list)
+    engine.dispose()
+
+
+def start_server(workers: int | None) -> Process:
+    process = Process(
+        target=run_sync_store_server_callable(
+            server_store, HOST, PORT, workers=workers
+        ),
+        daemon=True,
+    )
+    process.start()
+    for _ in range(100):
+        try:
+            requests.get(f"http://{HOST}:{PORT}/", timeout=1)
+            return process
+        except requests.ConnectionError:
+            time.sleep(0.05)
+    raise Exception("server did not start")
+
+
+def client_changes(n: int, version: int) -> Changes:
+    # acknowledges a new version of a (fake) client site: a small write transaction
+    return Changes([], version, f"{n + 1:032x}")
+
+
+def run_client(n: int, duration: float) -> list[float]:
+    client = HttpClientVersionedChangesSyncstore(f"client_{n}", None, HOST, PORT)
+    query = ChangesQuery(not_from_site_id=f"{n + 1:032x}")
+    write_every = int(1 / WRITE_RATIO)
+    latencies = []
+    deadline = time.perf_counter() + duration
+    i = 0
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        if i % write_every == write_every - 1:
+            client.apply_changes(client_changes(n, i))
+        else:
+            client.get_changes(query)
+        latencies.append(time.perf_counter() - start)
+        i += 1
+    client.close()
+    return latencies
+
+
+def run(workers: int | None, n_clients: int, duration: float) -> list[float]:
+    server = start_server(workers)
+    try:
+        with ThreadPoolExecutor(max_workers=n_clients) as executor:
+            results = executor.map(run_client, range(n_clients), [duration] * n_clients)
+            return [latency for latencies in results for latency in latencies]
+    finally:
+        server.terminate()
+        server.join()
+
+
+def main(n_clients: int, duration: float) -> None:
+    seed_server_db()
+    print(f"{n_clients} clients, {duration}s each, {2 * N_ITEMS + 1} changes per read")
+    print(f"{'workers':>16} {'req/s':>8} {'p50 [ms]':>9} {'p95 [ms]':>9}")
+    for workers in [None, 1, 2, 4, 8]:
+        latencies = [latency * 1000 for latency in run(workers, n_clients, duration)]
+        p95 = statistics.quantiles(latencies, n=20)[-1]
+        name = "per-connection" if workers is None else str(workers)
+        print(
+            f"{name:>16} {len(latencies) / duration:>8.1f}"
+            f" {statistics.median(latencies):>9.2f} {p95:>9.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 8,
+        float(sys.argv[2]) if len(sys.argv) > 2 else 5.0,
+    )
@@ -0,0 +1,320 @@
+# micro-benchmark suite over storage, change exchange and sync, across data sizes,
+# with results written as json to compare runs (and catch regressions)
+# usage: python -m benchmarks.suite [--sizes 1000,10000] [--output results.json]
+#                                   [--baseline previous.json] [--tolerance 0.2] [--no-http]
+#                                   [--profile-sql 20]
+
+import argparse
+import json
+import logging
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from dataclasses import asdict, dataclass, field
+from multiprocessing import Process
+from typing import Callable, Iterator
+
+import requests
+
+from benchmarks.data_generator import DataGenerator
+from crsqlite_todo_sync_store import CrSqliteTodoSyncStore
+from sqlite_setup import SqlProfiler, get_engine, remove_db_file
+from syncstore.network.changes_codec import decode_changes, encode_changes
+from syncstore.network.client_sync_store import HttpClientVersionedChangesSyncstore
+from syncstore.network.server_sync_store import (
+    changes_schema,
+    run_sync_store_server_callable,
+)
+from syncstore.versioned_changes_syncstore import (
+    Changes,
+    ChangesQuery,
+    VersionedChangesSyncStore,
+)
+from todostore.todostore import TodoList
+
+BENCH_DB_DIR = "./db"
+HOST = "127.0.0.1"
+PORT = 5003
+DEFAULT_SIZES = [1_000, 10_000]  # items in total
+ITEMS_PER_LIST = 20
+EDIT_FRACTION = 0.1  # of the lists, edited on both replicas before a conflicting sync
+SEED = 42
+# statements of the local stores (not of the server process), see --profile-sql
+sql_profiler: SqlProfiler | None = None
+
+
+@dataclass
+class Measurement:
+    name: str
+    size: int
+    n_ops: int
+    total_s: float
+    mean_ms: float
+    p50_ms: float
+    max_ms: float
+    extra: dict = field(default_factory=dict)  # e.g. number of changes, bytes
+
+
+def measure(name: str, size: int, durations: list[float], **extra) -> Measurement:
+    ms = [d * 1000 for d in durations]
+    return Measurement(
+        name,
+        size,
+        len(durations),
+        sum(durations),
+        statistics.mean(ms),
+        statistics.median(ms),
+        max(ms),
+        extra,
+    )
+
+
+def timed(fn: Callable[[], object]) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def create_store(
+    name: str, remote: VersionedChangesSyncStore | None = None
+) -> CrSqliteTodoSyncStore:
+    db_file = f"{BENCH_DB_DIR}/bench_suite_{name}.db"
+    remove_db_file(db_file)
+    engine = get_engine(db_file=db_file, profiler=sql_profiler)
+    return CrSqliteTodoSyncStore(name, engine, remote)
+
+
+def own_changes(store: CrSqliteTodoSyncStore) -> Changes:
+    site_id = store.syncstore.get_site_id()
+    return store.syncstore.get_changes(ChangesQuery(from_site_id=site_id))
+
+
+def storage_cases(size: int, lists: list[TodoList]) -> Iterator[Measurement]:
+    store = create_store("storage")
+    yield measure("save", size, [timed(lambda: store.save(t)) for t in lists])
+    yield measure("load", size, [timed(lambda: store.load(t.list_id)) for t in lists])
+    ids = [t.list_id for t in lists]
+    yield measure("load_many", size, [timed(lambda: store.load_many(ids))])
+
+    changes = own_changes(store)
+    n_changes = len(changes.changes)
+    yield measure(
+        "get_changes",
+        size,
+        [timed(lambda: own_changes(store)) for _ in range(3)],
+        n_changes=n_changes,
+    )
+    target = create_store("storage_target")
+    yield measure(
+        "apply_changes",
+        size,
+        [timed(lambda: target.syncstore.apply_changes(changes))],
+        n_changes=n_changes,
+    )
+
+    # schema serialization (json) vs. the binary codec, encode + decode
+    json_data = changes_schema.dumps(changes).encode()
+    binary_data = encode_changes(changes)
+    yield measure(
+        "serialize_json",
+        size,
+        [timed(lambda: changes_schema.loads(changes_schema.dumps(changes)))],
+        n_changes=n_changes,
+        n_bytes=len(json_data),
+    )
+    yield measure(
+        "serialize_binary",
+        size,
+        [timed(lambda: decode_changes(encode_changes(changes)))],
+        n_changes=n_changes,
+        n_bytes=len(binary_data),
+    )
+    for s in [store, target]:
+        s.engine.dispose()
+
+
+def sync_cases(
+    size: int, lists: list[TodoList], generator: DataGenerator
+) -> Iterator[Measurement]:
+    # in-process: b syncs with a directly
+    a = create_store("sync_a")
+    b = create_store("sync_b", a.syncstore)
+    for t in lists:
+        a.save(t)
+    results = []
+    duration = timed(lambda: results.append(b.sync()))
+    yield measure(
+        "sync_initial", size, [duration], n_changes=results[0].n_pulled_changes
+    )
+
+    edits_a, edits_b = generator.conflicting_edits(lists, EDIT_FRACTION)
+    for t in edits_a:
+        a.save(t)
+    for t in edits_b:
+        b.save(t)
+    results.clear()
+    duration = timed(lambda: results.append(b.sync()))
+    yield measure(
+        "sync_conflicts",
+        size,
+        [duration],
+        n_changes=results[0].n_pulled_changes + results[0].n_pushed_changes,
+    )
+    for s in [a, b]:
+        s.engine.dispose()
+
+
+def server_store() -> VersionedChangesSyncStore:
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    engine = get_engine(db_file=f"{BENCH_DB_DIR}/bench_suite_server.db")
+    return CrSqliteTodoSyncStore("server", engine, None).syncstore
+
+
+def start_server() -> Process:
+    remove_db_file(f"{BENCH_DB_DIR}/bench_suite_server.db")
+    process = Process(
+        target=run_sync_store_server_callable(server_store, HOST, PORT), daemon=True
+    )
+    process.start()
+    for _ in range(100):
+        try:
+            requests.get(f"http://{HOST}:{PORT}/", timeout=1)
+            return process
+        except requests.ConnectionError:
+            time.sleep(0.05)
+    raise Exception("server did not start")
+
+
+def http_sync_cases(size: int, lists: list[TodoList]) -> Iterator[Measurement]:
+    # c pushes everything to the server, d pulls everything from it
+    server = start_server()
+    try:
+        clients = [
+            HttpClientVersionedChangesSyncstore(f"{n}_client", None, HOST, PORT)
+            for n in ["c", "d"]
+        ]
+        c = create_store("http_c", clients[0])
+        d = create_store("http_d", clients[1])
+        for t in lists:
+            c.save(t)
+        for name, store in [("sync_http_push", c), ("sync_http_pull", d)]:
+            results = []
+            duration = timed(lambda: results.append(store.sync()))
+            r = results[0]
+            yield measure(
+                name,
+                size,
+                [duration],
+                n_changes=r.n_pulled_changes + r.n_pushed_changes,
+                n_bytes=r.transfer_stats.n_bytes_sent
+                + r.transfer_stats.n_bytes_received,
+            )
+        for client in clients:
+            client.close()
+        for s in [c, d]:
+            s.engine.dispose()
+    finally:
+        server.terminate()
+        server.join()
+
+
+def run(sizes: list[int], http: bool) -> list[Measurement]:
+    measurements = []
+    for size in sizes:
+        generator = DataGenerator(SEED)
+        lists = generator.lists(max(1, size // ITEMS_PER_LIST), ITEMS_PER_LIST)
+        cases = [storage_cases(size, lists), sync_cases(size, lists, generator)]
+        if http:
+            cases.append(http_sync_cases(size, lists))
+        for case in cases:
+            for m in case:
+                print(
+                    f"{m.name:>18} {m.size:>8} {m.n_ops:>6} {m.total_s:>9.3f}"
+                    f" {m.mean_ms:>9.2f} {m.p50_ms:>9.2f}",
+                    flush=True,
+                )
+                measurements.append(m)
+    return measurements
+
+
+def run_info() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "seed": SEED,
+    }
+
+
+def compare(
+    measurements: list[Measurement], baseline: dict, tolerance: float
+) -> list[str]:
+    # regressions: mean duration more than tolerance above the one of the baseline
+    previous = {(m["name"], m["size"]): m for m in baseline["results"]}
+    regressions = []
+    for m in measurements:
+        p = previous.get((m.name, m.size))
+        if p is None or p["mean_ms"] <= 0:
+            continue
+        ratio = m.mean_ms / p["mean_ms"]
+        flag = " REGRESSION" if ratio > 1 + tolerance else ""
+        print(f"{m.name:>18} {m.size:>8} {ratio:>8.2f}x{flag}")
+        if flag:
+            regressions.append(f"{m.name} ({m.size}): {ratio:.2f}x")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.suite")
+    parser.add_argument(
+        "--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="items in total"
+    )
+    parser.add_argument("--output", default=f"{BENCH_DB_DIR}/bench_suite.json")
+    parser.add_argument("--baseline", help="results of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--no-http", action="store_true", help="skip the http syncs")
+    parser.add_argument(
+        "--profile-sql",
+        type=int,
+        metavar="N",
+        help="report the N statements taking the most time (adds overhead)",
+    )
+    args = parser.parse_args()
+    if args.profile_sql:
+        global sql_profiler
+        sql_profiler = SqlProfiler(slow_threshold=None)
+
+    print(
+        f"{'name':>18} {'size':>8} {'n_ops':>6} {'total [s]':>9}"
+        f" {'mean [ms]':>9} {'p50 [ms]':>9}"
+    )
+    measurements = run([int(s) for s in args.sizes.split(",")], not args.no_http)
+    with open(args.output, "w") as f:
+        json.dump(
+            {"run": run_info(), "results": [asdict(m) for m in measurements]},
+            f,
+            indent=2,
+        )
+    print(f"results written to {args.output}")
+    if sql_profiler is not None:
+        print(sql_profiler.report(args.profile_sql))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(measurements, json.load(f), args.tolerance)
+        if regressions:
+            print("regressions: " + ", ".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# compare encode/decode throughput and payload size of the json (marshmallow) and binary wire formats
+# usage: python -m benchmarks.wire_format_benchmark [n_changes ...]
+
+import sys
+import time
+from typing import Callable
+
+from syncstore.network.changes_codec import decode_changes, encode_changes
+from syncstore.network.server_sync_store import changes_schema
+from syncstore.versioned_changes_syncstore import Change, Changes, Value, ValueType
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+
+SITE_IDS = [
+    "7c2bcd0e45e04373849a07868dedb337",
+    "2b1560fbee8f45c5b251d5c9b2646eeb",
+]
+
+
+def generate_changes(n: int) -> Changes:
+    # todo_item rows with a content and a list_id column each
+    changes = []
+    for i in range(n):
+        item = i // 2
+        changes.append(
+            Change(
+                table="todo_item",
+                pk=Value(
+                    ValueType.BYTES, b"\x01\x0b".hex() + f"item_{item}".encode().hex()
+                ),
+                cid="content" if i % 2 == 0 else "list_id",
+                val=Value(
+                    ValueType.STRING,
+                    f"content of item {item}" if i % 2 == 0 else f"list_{item // 100}",
+                ),
+                col_version=1,
+                db_version=item + 1,
+                site_id=Value(ValueType.BYTES, SITE_IDS[item % 2]),
+                cl=1,
+                seq=i % 2,
+            )
+        )
+    return Changes(changes, n, SITE_IDS[0])
+
+
+def encode_json(changes: Changes) -> bytes:
+    return changes_schema.dumps(changes).encode()
+
+
+def decode_json(data: bytes) -> Changes:
+    return changes_schema.loads(data)  # type: ignore
+
+
+FORMATS: list[tuple[str, Callable[[Changes], bytes], Callable[[bytes], Changes]]] = [
+    ("json", encode_json, decode_json),
+    ("binary", encode_changes, decode_changes),
+]
+
+
+def timed(fn: Callable[[], object]) -> tuple[float, object]:
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def main(sizes: list[int]) -> None:
+    print(
+        f"{'n_changes':>10} {'format':>7} {'size [kB]':>10} {'B/change':>9}"
+        f" {'encode [changes/s]':>19} {'decode [changes/s]':>19}"
+    )
+    for n in sizes:
+        changes = generate_changes(n)
+        for name, encode, decode in FORMATS:
+            encode_duration, payload = timed(lambda: encode(changes))
+            assert isinstance(payload, bytes)
+            decode_duration, decoded = timed(lambda: decode(payload))
+            assert decoded == changes
+            print(
+                f"{n:>10} {name:>7} {len(payload) / 1000:>10.1f} {len(payload) / n:>9.1f}"
+                f" {n / encode_duration:>19.0f} {n / decode_duration:>19.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or DEFAULT_SIZES)
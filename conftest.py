@@ -9,5 +9,5 @@ from todo_sync_test import TEST_DB_DIR
 def clean_test_db_dir() -> None:
     for file in os.listdir(TEST_DB_DIR):
         path = os.path.join(TEST_DB_DIR, file)
-        if os.path.isfile(path) and path.endswith(".db"):
+        if os.path.isfile(path) and path.endswith((".db", ".db-wal", ".db-shm")):
             os.remove(path)
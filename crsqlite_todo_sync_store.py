@@ -1,5 +1,6 @@
-from dataclasses import dataclass, field
-from typing import Any, Callable
+from dataclasses import dataclass, field, replace
+from typing import Any, Callable, Iterable, Iterator
+from weakref import finalize
 
 from sqlalchemy import Engine
 
@@ -7,11 +8,34 @@ from entity_change_checking.entity_change_checker import (
     EntityChangeChecker,
     EntityChangeCheckerImpl,
 )
-from syncstore.crsqlite_syncstore import CrSqliteSyncStore
+from syncstore.auto_sync import AutoSync
+from syncstore.crsqlite_syncstore import CrSqliteSyncStore, from_value, unpack_pk
+from syncstore.fan_out_sync import FanOutSync
 from syncstore.syncstore import SyncResult, SyncStore
-from syncstore.versioned_changes_syncstore import Tables, VersionedChangesSyncStore
-from todostore.sql_todostore import SqlTodoStore
-from todostore.todostore import TodoList, TodoStore
+from syncstore.versioned_changes_syncstore import (
+    Changes,
+    Tables,
+    ValueType,
+    VersionedChangesSyncStore,
+)
+from todostore.sql_todostore import PTodoItem, PTodoList, SqlTodoStore
+from todostore.todo_list_cache import TodoListCache, TodoListCacheStats
+from todostore.todostore import SearchHit, TodoList, TodoListFilter, TodoStore
+
+
+def changed_todo_rows(changes: Changes) -> tuple[set[str], set[str]]:
+    # ids of the lists and items with changed rows, including the lists items were moved to
+    list_ids: set[str] = set()
+    item_ids: set[str] = set()
+    for c in changes.changes:
+        (row_id,) = unpack_pk(from_value(c.pk))
+        if c.table == PTodoList.__tablename__:
+            list_ids.add(row_id)
+        elif c.table == PTodoItem.__tablename__:
+            item_ids.add(row_id)
+            if c.cid == "list_id" and c.val.value_type == ValueType.STRING:
+                list_ids.add(c.val.value)
+    return list_ids, item_ids
 
 
 @dataclass
@@ -22,31 +46,158 @@ class CrSqliteTodoSyncStore(TodoStore, SyncStore, EntityChangeChecker[TodoList,
     engine: Engine
     remote_syncstore: VersionedChangesSyncStore | None
 
-    todostore: TodoStore = field(init=False)
-    syncstore: VersionedChangesSyncStore = field(init=False)
+    todostore: SqlTodoStore = field(init=False)
+    syncstore: CrSqliteSyncStore = field(init=False)
     change_checker: EntityChangeCheckerImpl[TodoList, str] = field(
         default_factory=EntityChangeCheckerImpl[TodoList, str]
     )
+    # check_all only reloads the tracked lists with rows changed since the previous check
+    # (crsql_changes), instead of all of them
+    incremental_change_checking: bool = field(default=False, kw_only=True)
+    # check_all reloads the tracked lists with load_many, instead of their value retrievers
+    batch_change_checking: bool = field(default=False, kw_only=True)
+    checked_version: int | None = field(default=None, init=False)
+    # items of the tracked lists, as tracked or saved since: the lists of deleted (or moved)
+    # items are not found in the database anymore, see get_changed_list_ids
+    tracked_list_ids_by_item_id: dict[str, set[str]] = field(
+        default_factory=dict, init=False, repr=False
+    )
+    tracked_item_ids_by_list_id: dict[str, set[str]] = field(
+        default_factory=dict, init=False, repr=False
+    )
+    # opt-in, see start_auto_sync
+    auto_sync: AutoSync | None = field(default=None, init=False)
+    # byte budget of the loaded lists kept in memory, 0 disables the cache;
+    # entries are invalidated by saves and applied changes, not by writes bypassing the store
+    cache_size: int = field(default=0, kw_only=True)
+    cache: TodoListCache | None = field(default=None, init=False)
+    # full-text search over titles and contents, also of merged changes
+    search_index: bool = field(default=False, kw_only=True)
+    # synced concurrently with remote_syncstore (e.g. a backup hub), see FanOutSync
+    additional_remotes: list[VersionedChangesSyncStore] = field(
+        default_factory=list, kw_only=True
+    )
+    fan_out: FanOutSync | None = field(default=None, init=False)
 
     def __post_init__(self) -> None:
-        self.todostore = SqlTodoStore(self.name, self.engine)
+        self.todostore = SqlTodoStore(
+            self.name, self.engine, search_index=self.search_index
+        )
         self.syncstore = CrSqliteSyncStore(
             self.name, self.remote_syncstore, self.engine
         )
         self.syncstore.setup_table_change_tracking(Tables(self.get_tables()))
+        if self.incremental_change_checking:
+            self.change_checker.changed_ids_fn = self.get_changed_list_ids
+        if self.batch_change_checking:
+            self.change_checker.batch_retriever_fn = self.load_many
+        if self.cache_size > 0:
+            self.cache = TodoListCache(self.cache_size)
+            self.syncstore.changes_applied_listeners.append(self.invalidate_cache)
+        if self.additional_remotes:
+            if self.remote_syncstore is None:
+                raise ValueError("additional_remotes require a remote_syncstore")
+            remotes = [self.remote_syncstore, *self.additional_remotes]
+            self.fan_out = FanOutSync(self.syncstore, remotes)
 
-    def save(self, entity: TodoList) -> None:
-        self.todostore.save(entity)
+    def save(self, entity: TodoList, previous: TodoList | None = None) -> None:
+        # previous: see SqlTodoStore.save
+        self.todostore.save(entity, previous)
+        if entity.list_id in self.change_checker.tracked_instances:
+            self.index_tracked_items(entity)
+        if self.cache is not None:
+            # items may have been moved from another (cached) list
+            item_ids = [i.item_id for i in entity.todos]
+            self.cache.invalidate([entity.list_id], item_ids)
+        if self.auto_sync is not None:
+            self.auto_sync.notify_write()
 
     def load(self, entity_id: str) -> TodoList | None:
-        return self.todostore.load(entity_id)
+        if self.cache is None:
+            return self.todostore.load(entity_id)
+        todo_list = self.cache.get(entity_id)
+        if todo_list is None:
+            generation = self.cache.generation
+            todo_list = self.todostore.load(entity_id)
+            if todo_list is not None:
+                self.cache.put(todo_list, generation)
+        return todo_list
+
+    def load_many(self, entity_ids: Iterable[str]) -> dict[str, TodoList]:
+        if self.cache is None:
+            return self.todostore.load_many(entity_ids)
+        todo_lists: dict[str, TodoList] = {}
+        missing: list[str] = []
+        for entity_id in entity_ids:
+            todo_list = self.cache.get(entity_id)
+            if todo_list is None:
+                missing.append(entity_id)
+            else:
+                todo_lists[entity_id] = todo_list
+        if missing:
+            generation = self.cache.generation
+            loaded = self.todostore.load_many(missing)
+            for todo_list in loaded.values():
+                self.cache.put(todo_list, generation)
+            todo_lists.update(loaded)
+        return todo_lists
+
+    def iter_lists(
+        self,
+        page_size: int = 1000,
+        after: str | None = None,
+        list_filter: TodoListFilter | None = None,
+    ) -> Iterator[TodoList]:
+        # scans are not cached, they would evict the hot lists
+        return self.todostore.iter_lists(page_size, after, list_filter)
+
+    def search(self, query: str, limit: int = 20) -> list[SearchHit]:
+        return self.todostore.search(query, limit)
+
+    def invalidate_cache(self, changes: Changes) -> None:
+        if self.cache is not None:
+            self.cache.invalidate(*changed_todo_rows(changes))
+
+    def get_cache_stats(self) -> TodoListCacheStats | None:
+        if self.cache is None:
+            return None
+        with self.cache.lock:
+            return replace(self.cache.stats)
 
     def get_tables(self) -> list[str]:
         return self.todostore.get_tables()
 
     def sync(self) -> SyncResult:
+        if self.auto_sync is not None:
+            return self.auto_sync.sync_now()  # does not overlap with a background sync
+        return self.sync_remotes()
+
+    def sync_remotes(self) -> SyncResult:
+        # with additional_remotes: a FanOutSyncResult, with the results per remote
+        if self.fan_out is not None:
+            return self.fan_out.sync()
         return self.syncstore.sync()
 
+    def start_auto_sync(self, **options) -> AutoSync:
+        # sync in the background after saves, options: see AutoSync
+        if self.auto_sync is None:
+            self.auto_sync = AutoSync(self.sync_remotes, **options)
+        self.auto_sync.start()
+        return self.auto_sync
+
+    def stop_auto_sync(self, flush: bool = True) -> None:
+        if self.auto_sync is not None:
+            self.auto_sync.stop(flush)
+            self.auto_sync = None
+
+    def close(self) -> None:
+        # stops the background sync and the fan-out threads, closes the pooled connections;
+        # the remote syncstores are owned by the caller
+        self.stop_auto_sync()
+        if self.fan_out is not None:
+            self.fan_out.close()
+        self.syncstore.close()
+
     # tbd: do not expose, but use internally on save / load / sync
     def track(
         self,
@@ -56,6 +207,40 @@ class CrSqliteTodoSyncStore(TodoStore, SyncStore, EntityChangeChecker[TodoList,
         on_change_callback: Callable[[TodoList | None], None],
     ) -> None:
         self.change_checker.track(entity, id_fn, value_retriever_fn, on_change_callback)
+        self.index_tracked_items(entity)
+        finalize(entity, self.unindex_tracked_items, entity.list_id)
+
+    def index_tracked_items(self, todo_list: TodoList) -> None:
+        item_ids = self.tracked_item_ids_by_list_id.setdefault(todo_list.list_id, set())
+        for item in todo_list.todos:
+            item_ids.add(item.item_id)
+            self.tracked_list_ids_by_item_id.setdefault(item.item_id, set()).add(
+                todo_list.list_id
+            )
+
+    def unindex_tracked_items(self, list_id: str) -> None:
+        if list_id in self.change_checker.tracked_instances:
+            return  # tracked again, by another instance
+        for item_id in self.tracked_item_ids_by_list_id.pop(list_id, ()):
+            list_ids = self.tracked_list_ids_by_item_id[item_id]
+            list_ids.discard(list_id)
+            if not list_ids:
+                del self.tracked_list_ids_by_item_id[item_id]
 
     def check_all(self) -> None:
         self.change_checker.check_all()
+
+    def get_changed_list_ids(self) -> set[str] | None:
+        # None on the first check, which has to compare all tracked lists
+        if self.checked_version is None:
+            self.checked_version = self.syncstore.get_current_version()
+            return None
+        self.checked_version, rows = self.syncstore.get_changed_rows(
+            self.checked_version
+        )
+        # lists of the changed rows as stored (sql), and of deleted or moved items as tracked
+        list_ids = self.todostore.get_list_ids(rows)
+        for table, pk in rows:
+            if table == PTodoItem.__tablename__:
+                list_ids.update(self.tracked_list_ids_by_item_id.get(pk[0], ()))
+        return list_ids
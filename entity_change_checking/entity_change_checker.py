@@ -1,6 +1,14 @@
 from abc import ABCMeta, abstractmethod
 from dataclasses import dataclass, field
-from typing import Any, Callable, Generic, MutableMapping, TypeVar
+from typing import (
+    Any,
+    Callable,
+    Generic,
+    Iterable,
+    Mapping,
+    MutableMapping,
+    TypeVar,
+)
 from weakref import WeakValueDictionary, finalize
 
 E = TypeVar("E")
@@ -31,6 +39,15 @@ class EntityChangeCheckerImpl(EntityChangeChecker[E, EID]):
     on_change_callbacks: MutableMapping[EID, Callable[[E | None], None]] = field(
         default_factory=dict
     )
+    # incremental mode: ids of the entities changed in the store since the previous call,
+    # None if unknown (then all are checked); only those are retrieved and compared,
+    # so changes to the tracked instances themselves are no longer detected
+    changed_ids_fn: Callable[[], Iterable[EID] | None] | None = None
+    # retrieves the current values of many entities at once (missing ones left out),
+    # instead of the value_retriever_fn of each one
+    batch_retriever_fn: Callable[[list[EID]], Mapping[EID, E]] | None = None
+    # tracked since the previous check, their retrieved values may predate it
+    newly_tracked_ids: set[EID] = field(default_factory=set)
 
     def track(
         self,
@@ -43,11 +60,30 @@ class EntityChangeCheckerImpl(EntityChangeChecker[E, EID]):
         self.tracked_instances[eid] = entity
         self.value_retrieval_fns[eid] = value_retriever_fn
         self.on_change_callbacks[eid] = on_change_callback
+        self.newly_tracked_ids.add(eid)
         finalize(entity, lambda: self.value_retrieval_fns.pop(eid))
         finalize(entity, lambda: self.on_change_callbacks.pop(eid))
 
     def check_all(self) -> None:
-        for eid, tracked_instance in self.tracked_instances.items():
-            current_value = self.value_retrieval_fns[eid]()
+        changed_ids = None if self.changed_ids_fn is None else self.changed_ids_fn()
+        if changed_ids is None:
+            eids: Iterable[EID] = list(self.tracked_instances.keys())
+        else:
+            eids = self.newly_tracked_ids.union(changed_ids)
+        self.newly_tracked_ids = set()
+        # strong references, so that the instances stay tracked during the check
+        tracked = {
+            eid: instance
+            for eid in eids
+            if (instance := self.tracked_instances.get(eid)) is not None
+        }
+        current_values = None
+        if self.batch_retriever_fn is not None:
+            current_values = self.batch_retriever_fn(list(tracked))
+        for eid, tracked_instance in tracked.items():
+            if current_values is not None:
+                current_value = current_values.get(eid)
+            else:
+                current_value = self.value_retrieval_fns[eid]()
             if tracked_instance != current_value:
                 self.on_change_callbacks[eid](current_value)
@@ -1,8 +1,80 @@
-from sqlite3 import Connection
+import logging
+import os
+import re
+import time
+from dataclasses import dataclass, field, replace
+from sqlite3 import Connection, Cursor
+from threading import Lock
 
 from sqlalchemy import Engine, create_engine
 from sqlalchemy.event import listen
 
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ConnectionProfile:
+    # pragmas set on every new connection, and the sizing of the connection pool
+    name: str
+    journal_mode: str
+    synchronous: str
+    mmap_size: int  # bytes, 0 disables memory-mapped i/o
+    cache_size: int  # pages if positive, KiB if negative
+    busy_timeout: int  # ms to wait for a lock before failing with "database is locked"
+    temp_store: str
+    # concurrent connections: readers run in parallel (wal), writers are not serialized
+    # by the engine, they wait for the database's write lock (up to busy_timeout)
+    pool_size: int
+    max_overflow: int
+    pool_timeout: float  # seconds to wait for a connection while all of them are in use
+
+
+# every commit is synced to disk, also survives a power loss
+DURABLE = ConnectionProfile(
+    name="durable",
+    journal_mode="WAL",
+    synchronous="FULL",
+    mmap_size=0,
+    cache_size=-16_384,
+    busy_timeout=10_000,
+    temp_store="DEFAULT",
+    pool_size=5,
+    max_overflow=5,
+    pool_timeout=30.0,
+)
+
+# wal is only synced on checkpoints: a power loss may roll back the latest commits,
+# but cannot corrupt the database
+BALANCED = ConnectionProfile(
+    name="balanced",
+    journal_mode="WAL",
+    synchronous="NORMAL",
+    mmap_size=256 * 1024 * 1024,
+    cache_size=-65_536,
+    busy_timeout=5_000,
+    temp_store="MEMORY",
+    pool_size=8,
+    max_overflow=8,
+    pool_timeout=30.0,
+)
+
+# initial loading of large data sets, e.g. the first sync of a new replica:
+# never waits for the disk, an os crash may corrupt the database
+BULK_IMPORT = ConnectionProfile(
+    name="bulk-import",
+    journal_mode="WAL",
+    synchronous="OFF",
+    mmap_size=1024 * 1024 * 1024,
+    cache_size=-262_144,
+    busy_timeout=30_000,
+    temp_store="MEMORY",
+    pool_size=2,  # e.g. a single importing writer and a reader
+    max_overflow=2,
+    pool_timeout=30.0,
+)
+
+PROFILES = {p.name: p for p in [DURABLE, BALANCED, BULK_IMPORT]}
+
 
 def set_foreign_keys_pragma(dbapi_connection: Connection, connection_record):
     cursor = dbapi_connection.cursor()
@@ -10,14 +82,14 @@ def set_foreign_keys_pragma(dbapi_connection: Connection, connection_record):
     cursor.execute("PRAGMA foreign_keys = OFF")
     # crsqlite is not supporting foreign keys
     cursor.close()
-    print("foreign_keys pragma set")
+    logger.debug("foreign_keys pragma set")
 
 
 def load_crsqlite_extension(dbapi_connection: Connection, connection_record) -> None:
     dbapi_connection.enable_load_extension(True)
     dbapi_connection.load_extension("./crsqlite/crsqlite.so")
     dbapi_connection.enable_load_extension(False)
-    print("crsqlite extension loaded")
+    logger.debug("crsqlite extension loaded")
 
 
 def finalize_crsqlite(dbapi_connection: Connection, connection_record) -> None:
@@ -26,10 +98,211 @@ def finalize_crsqlite(dbapi_connection: Connection, connection_record) -> None:
     cursor.close()
 
 
-def get_engine(db_file: str = "./sqlite_test.db", echo=False) -> Engine:
-    engine: Engine = create_engine("sqlite:///" + db_file, echo=echo)
+def connection_profile_pragmas(profile: ConnectionProfile) -> list[str]:
+    return [
+        f"PRAGMA journal_mode = {profile.journal_mode}",
+        f"PRAGMA synchronous = {profile.synchronous}",
+        f"PRAGMA mmap_size = {profile.mmap_size}",
+        f"PRAGMA cache_size = {profile.cache_size}",
+        f"PRAGMA busy_timeout = {profile.busy_timeout}",
+        f"PRAGMA temp_store = {profile.temp_store}",
+    ]
+
+
+def set_connection_profile_pragmas(profile: ConnectionProfile):
+    pragmas = connection_profile_pragmas(profile)
+
+    def set_pragmas(dbapi_connection: Connection, connection_record) -> None:
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+        logger.debug("connection profile %s set", profile.name)
+
+    return set_pragmas
+
+
+@dataclass
+class StatementStats:
+    statement: str  # normalized, see normalize_statement
+    n_calls: int = 0
+    n_rows: int = 0  # fetched from queries, affected by writes
+    # executing a query only computes its first row (sqlite steps through the rest
+    # while they are fetched), the time spent fetching is not included
+    total_duration: float = 0.0  # seconds
+    max_duration: float = 0.0
+
+    @property
+    def mean_duration(self) -> float:
+        return self.total_duration / self.n_calls if self.n_calls else 0.0
+
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+PARAMETER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_statement(statement: str) -> str:
+    # statements differing only in literals, or in the length of IN (?, ?, ..) lists,
+    # are aggregated together
+    statement = STRING_LITERAL.sub("?", statement)
+    statement = NUMBER_LITERAL.sub("?", statement)
+    statement = PARAMETER_LIST.sub("(?, ...)", statement)
+    return WHITESPACE.sub(" ", statement).strip()
+
+
+class RowCountingCursor(Cursor):
+    # counts the rows fetched from a query for the profiler, without buffering them
+    profiled: "tuple[SqlProfiler, str] | None" = None  # profiler, normalized statement
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            self.count_rows(1)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self.count_rows(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        self.count_rows(len(rows))
+        return rows
+
+    def count_rows(self, n_rows: int) -> None:
+        if self.profiled is not None and n_rows:
+            profiler, statement = self.profiled
+            profiler.count_rows(statement, n_rows)
+
+
+class RowCountingConnection(Connection):
+    def cursor(self, factory=RowCountingCursor):  # type: ignore[override]
+        return super().cursor(factory)
+
+
+@dataclass
+class SqlProfiler:
+    # aggregates duration, calls and rows per normalized statement, of the engines it is
+    # attached to (see get_engine), and logs the statements slower than slow_threshold
+    slow_threshold: float | None = 0.1  # seconds, None disables the slow statement log
+    stats: dict[str, StatementStats] = field(default_factory=dict, init=False)
+    lock: Lock = field(default_factory=Lock, init=False, repr=False, compare=False)
+
+    def attach(self, engine: Engine) -> None:
+        # the rows of queries are only counted on connections made by get_engine
+        # (RowCountingConnection), otherwise just the rows affected by writes
+        listen(engine, "before_cursor_execute", self.before_cursor_execute)
+        listen(engine, "after_cursor_execute", self.after_cursor_execute)
+
+    def before_cursor_execute(
+        self, conn, cursor, statement, parameters, context, executemany
+    ) -> None:
+        # replaced by the next statement if this one fails: failed ones are not recorded
+        conn.info["profiler_start"] = time.perf_counter()
+
+    def after_cursor_execute(
+        self, conn, cursor, statement, parameters, context, executemany
+    ) -> None:
+        duration = time.perf_counter() - conn.info.pop("profiler_start")
+        # sqlite's rowcount: rows affected by writes (also by executemany), -1 for queries
+        normalized = self.record(statement, duration, max(cursor.rowcount, 0))
+        if isinstance(cursor, RowCountingCursor):
+            cursor.profiled = (
+                (self, normalized) if cursor.description is not None else None
+            )
+        if self.slow_threshold is not None and duration >= self.slow_threshold:
+            logger.warning(
+                "slow statement (%.1f ms): %s",
+                duration * 1000,
+                WHITESPACE.sub(" ", statement).strip()[:1000],
+            )
+
+    def record(self, statement: str, duration: float, n_rows: int) -> str:
+        normalized = normalize_statement(statement)
+        with self.lock:
+            stats = self.stats.get(normalized)
+            if stats is None:
+                stats = self.stats[normalized] = StatementStats(normalized)
+            stats.n_calls += 1
+            stats.n_rows += n_rows
+            stats.total_duration += duration
+            stats.max_duration = max(stats.max_duration, duration)
+        return normalized
+
+    def count_rows(self, normalized: str, n_rows: int) -> None:
+        with self.lock:
+            stats = self.stats.get(normalized)
+            if stats is not None:  # unless reset in the meantime
+                stats.n_rows += n_rows
+
+    def top(self, n: int = 10, key: str = "total_duration") -> list[StatementStats]:
+        # key: attribute of StatementStats, e.g. n_calls or max_duration
+        with self.lock:
+            stats = [replace(s) for s in self.stats.values()]
+        return sorted(stats, key=lambda s: getattr(s, key), reverse=True)[:n]
+
+    def reset(self) -> None:
+        with self.lock:
+            self.stats.clear()
+
+    def report(self, n: int = 10, key: str = "total_duration") -> str:
+        lines = [
+            f"{'total [ms]':>11} {'calls':>7} {'mean [ms]':>10} {'max [ms]':>9}"
+            f" {'rows':>9}  statement"
+        ]
+        for s in self.top(n, key):
+            lines.append(
+                f"{s.total_duration * 1000:>11.1f} {s.n_calls:>7}"
+                f" {s.mean_duration * 1000:>10.2f} {s.max_duration * 1000:>9.2f}"
+                f" {s.n_rows:>9}  {s.statement[:200]}"
+            )
+        return "\n".join(lines)
+
+
+def get_engine(
+    db_file: str = "./sqlite_test.db",
+    echo=False,
+    profile: ConnectionProfile | str | None = None,
+    profiler: SqlProfiler | None = None,
+) -> Engine:
+    # profile=None: plain sqlite defaults (rollback journal, synchronous FULL, default pool)
+    # profile: opt-in, switches the database file to wal for good (-wal and -shm files next
+    # to it, which read-only or copied files need as well); BALANCED or BULK_IMPORT also
+    # trade durability for speed
+    # profiler: opt-in statement profiling, may be shared by several engines
+    if isinstance(profile, str):
+        profile = PROFILES[profile]
+    # counts the rows fetched from queries, see SqlProfiler
+    connect_args = {} if profiler is None else {"factory": RowCountingConnection}
+    if profile is None:
+        engine: Engine = create_engine(
+            "sqlite:///" + db_file, echo=echo, connect_args=connect_args
+        )
+    else:
+        engine = create_engine(
+            "sqlite:///" + db_file,
+            echo=echo,
+            connect_args=connect_args,
+            pool_size=profile.pool_size,
+            max_overflow=profile.max_overflow,
+            pool_timeout=profile.pool_timeout,
+        )
     listen(engine, "connect", load_crsqlite_extension)
+    if profile is not None:
+        listen(engine, "connect", set_connection_profile_pragmas(profile))
     listen(engine, "close", finalize_crsqlite)
     listen(engine, "close_detached", finalize_crsqlite)
     # listen(engine, "connect", set_foreign_keys_pragma)
+    if profiler is not None:
+        profiler.attach(engine)
     return engine
+
+
+def remove_db_file(db_file: str) -> None:
+    # including the write-ahead log and its index (journal_mode wal)
+    for path in [db_file, db_file + "-wal", db_file + "-shm"]:
+        if os.path.exists(path):
+            os.remove(path)
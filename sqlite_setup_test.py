@@ -0,0 +1,61 @@
+from sqlalchemy import bindparam, text
+
+from sqlite_setup import BULK_IMPORT, DURABLE, SqlProfiler, get_engine
+
+
+def pragma(engine, name: str):
+    with engine.connect() as c:
+        return c.execute(text(f"PRAGMA {name}")).scalar()
+
+
+def test_connection_profiles():
+    engine = get_engine(db_file="./db/sqlite_setup_test_durable.db", profile=DURABLE)
+    assert pragma(engine, "journal_mode") == "wal"
+    assert pragma(engine, "synchronous") == 2  # FULL
+    assert pragma(engine, "busy_timeout") == DURABLE.busy_timeout
+    assert engine.pool.size() == DURABLE.pool_size  # type: ignore
+    assert engine.pool.timeout() == DURABLE.pool_timeout  # type: ignore
+
+    engine = get_engine(db_file="./db/sqlite_setup_test_bulk.db", profile="bulk-import")
+    assert pragma(engine, "synchronous") == 0  # OFF
+    assert pragma(engine, "cache_size") == BULK_IMPORT.cache_size
+    assert pragma(engine, "temp_store") == 2  # MEMORY
+
+    engine = get_engine(db_file="./db/sqlite_setup_test_plain.db")  # the default
+    assert pragma(engine, "journal_mode") == "delete"
+    assert pragma(engine, "synchronous") == 2  # FULL
+
+
+def test_sql_profiler(caplog):
+    profiler = SqlProfiler(slow_threshold=0)
+    engine = get_engine(db_file="./db/sqlite_setup_test_profiler.db", profiler=profiler)
+    with engine.connect() as c:
+        c.execute(text("CREATE TABLE t (id INTEGER PRIMARY KEY, v TEXT)"))
+        c.execute(
+            text("INSERT INTO t VALUES (:id, :v)"),
+            [{"id": i, "v": "x"} for i in range(10)],
+        )
+        for i in range(3):
+            result = c.execute(text(f"SELECT * FROM t WHERE id > {i} AND v = 'x'"))
+            assert len(result.all()) == 9 - i
+        # only the fetched rows are counted
+        assert c.execute(text("SELECT v FROM t ORDER BY id")).first() == ("x",)
+        c.exec_driver_sql("DELETE FROM t WHERE id >= ?", [(8,), (9,)])
+        in_ids = text("SELECT * FROM t WHERE id IN :ids")
+        c.execute(in_ids.bindparams(bindparam("ids", expanding=True)), {"ids": [1, 2]})
+        c.exec_driver_sql("SELECT * FROM t WHERE id IN (?, ?, ?)", (1, 2, 3))
+        c.commit()
+
+    stats = {s.statement: s for s in profiler.top(n=100, key="n_calls")}
+    select = stats["SELECT * FROM t WHERE id > ? AND v = ?"]
+    assert (select.n_calls, select.n_rows) == (3, 9 + 8 + 7)
+    insert = stats["INSERT INTO t VALUES (?, ...)"]
+    assert (insert.n_calls, insert.n_rows) == (1, 10)
+    assert stats["SELECT v FROM t ORDER BY id"].n_rows == 1
+    assert stats["DELETE FROM t WHERE id >= ?"].n_rows == 2  # driver-level executemany
+    assert stats["SELECT * FROM t WHERE id IN (?, ...)"].n_calls == 2
+    assert "slow statement" in caplog.text  # every statement, with a threshold of 0
+    assert "SELECT * FROM t WHERE id > ? AND v = ?" in profiler.report()
+
+    profiler.reset()
+    assert profiler.top() == []
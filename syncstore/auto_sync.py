@@ -0,0 +1,139 @@
+import logging
+import time
+from dataclasses import dataclass, field, replace
+from threading import Condition, Lock, Thread
+from typing import Callable
+
+from syncstore.syncstore import SyncResult
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class AutoSyncStats:
+    n_writes: int = 0  # local writes notified
+    n_syncs: int = 0  # successful syncs, background and manual
+    n_failed_syncs: int = 0
+    n_synced_writes: int = 0  # writes covered by successful syncs
+    max_writes_per_sync: int = 0
+    last_writes_per_sync: int = 0
+
+
+@dataclass
+class AutoSync:
+    # background sync after local writes: bursts of writes are coalesced into a single sync,
+    # which starts once no write happened for debounce seconds,
+    # but at the latest max_latency seconds after the first unsynced write;
+    # failed syncs are retried with exponential backoff, syncs never overlap
+
+    sync: Callable[[], SyncResult]
+    debounce: float = 0.5  # seconds
+    max_latency: float = 5.0
+    min_backoff: float = 1.0
+    max_backoff: float = 60.0
+    stats: AutoSyncStats = field(default_factory=AutoSyncStats, init=False)
+    n_pending_writes: int = field(default=0, init=False)
+    first_write_at: float | None = field(default=None, init=False)
+    last_write_at: float = field(default=0.0, init=False)
+    n_failures: int = field(default=0, init=False)  # consecutive
+    retry_at: float = field(default=0.0, init=False)
+    stopped: bool = field(default=True, init=False)
+    condition: Condition = field(
+        default_factory=Condition, init=False, repr=False, compare=False
+    )
+    sync_lock: Lock = field(default_factory=Lock, init=False, repr=False, compare=False)
+    thread: Thread | None = field(default=None, init=False, repr=False, compare=False)
+
+    def start(self) -> None:
+        with self.condition:
+            if not self.stopped:
+                return
+            self.stopped = False
+        self.thread = Thread(target=self.run, name="auto-sync", daemon=True)
+        self.thread.start()
+
+    def stop(self, flush: bool = True) -> None:
+        # flush: sync the pending writes before returning (failures are logged, not raised)
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if flush and self.n_pending_writes > 0:
+            try:
+                self.sync_now()
+            except Exception:
+                logger.exception("final sync failed")
+
+    def notify_write(self) -> None:
+        with self.condition:
+            now = time.monotonic()
+            self.stats.n_writes += 1
+            self.n_pending_writes += 1
+            self.last_write_at = now
+            if self.first_write_at is None:
+                self.first_write_at = now
+            self.condition.notify_all()
+
+    def get_stats(self) -> AutoSyncStats:
+        with self.condition:
+            return replace(self.stats)
+
+    def next_sync_at(self) -> float | None:
+        # None: nothing to sync
+        if self.n_pending_writes == 0 or self.first_write_at is None:
+            return None
+        due = min(
+            self.last_write_at + self.debounce, self.first_write_at + self.max_latency
+        )
+        return max(due, self.retry_at)
+
+    def run(self) -> None:
+        while True:
+            with self.condition:
+                while not self.stopped:
+                    due = self.next_sync_at()
+                    if due is not None and due <= time.monotonic():
+                        break
+                    self.condition.wait(None if due is None else due - time.monotonic())
+                if self.stopped:
+                    return
+            try:
+                self.sync_now()
+            except Exception:
+                logger.warning("auto sync failed", exc_info=True)
+
+    def sync_now(self) -> SyncResult:
+        # also used for manual syncs, which then cover the pending writes as well
+        with self.sync_lock:
+            with self.condition:
+                n_writes = self.n_pending_writes
+                first_write_at = self.first_write_at
+                self.n_pending_writes = 0
+                self.first_write_at = None
+            try:
+                result = self.sync()
+            except Exception:
+                with self.condition:
+                    # writes are still unsynced, retry after a backoff
+                    self.n_pending_writes += n_writes
+                    if first_write_at is not None:
+                        self.first_write_at = min(
+                            first_write_at, self.first_write_at or first_write_at
+                        )
+                    backoff = self.min_backoff * 2**self.n_failures
+                    self.retry_at = time.monotonic() + min(backoff, self.max_backoff)
+                    self.n_failures += 1
+                    self.stats.n_failed_syncs += 1
+                raise
+            with self.condition:
+                self.n_failures = 0
+                self.retry_at = 0.0
+                self.stats.n_syncs += 1
+                self.stats.n_synced_writes += n_writes
+                self.stats.last_writes_per_sync = n_writes
+                self.stats.max_writes_per_sync = max(
+                    self.stats.max_writes_per_sync, n_writes
+                )
+            return result
@@ -0,0 +1,68 @@
+import time
+
+from syncstore.auto_sync import AutoSync
+from syncstore.syncstore import SyncResult
+
+
+class FakeSync:
+    def __init__(self, n_failures: int = 0) -> None:
+        self.n_failures = n_failures  # first calls which fail
+        self.calls: list[float] = []
+
+    def __call__(self) -> SyncResult:
+        self.calls.append(time.monotonic())
+        if len(self.calls) <= self.n_failures:
+            raise ConnectionError("remote unavailable")
+        return SyncResult(n_pulled_changes=0, n_pushed_changes=1)
+
+
+def wait_until(condition, timeout: float = 2.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_burst_of_writes_is_coalesced():
+    sync = FakeSync()
+    auto_sync = AutoSync(sync, debounce=0.1, max_latency=1.0)
+    auto_sync.start()
+    for _ in range(10):
+        auto_sync.notify_write()
+    wait_until(lambda: auto_sync.get_stats().n_syncs == 1)
+    time.sleep(0.2)
+    auto_sync.stop()
+
+    stats = auto_sync.get_stats()
+    assert len(sync.calls) == 1
+    assert (stats.n_writes, stats.n_syncs, stats.n_synced_writes) == (10, 1, 10)
+    assert stats.max_writes_per_sync == stats.last_writes_per_sync == 10
+
+
+def test_continuous_writes_are_synced_within_max_latency():
+    sync = FakeSync()
+    auto_sync = AutoSync(sync, debounce=0.1, max_latency=0.2)
+    auto_sync.start()
+    started = time.monotonic()
+    while time.monotonic() - started < 0.5:  # never quiet for the debounce time
+        auto_sync.notify_write()
+        time.sleep(0.02)
+    auto_sync.stop()
+
+    assert len(sync.calls) >= 3  # 2 in between, and the final flush
+    assert sync.calls[0] - started < 0.3
+    assert auto_sync.get_stats().n_synced_writes == auto_sync.get_stats().n_writes
+
+
+def test_failed_syncs_are_retried_with_backoff():
+    sync = FakeSync(n_failures=2)
+    auto_sync = AutoSync(sync, debounce=0.01, min_backoff=0.05)
+    auto_sync.start()
+    auto_sync.notify_write()
+    wait_until(lambda: auto_sync.get_stats().n_syncs == 1)
+    auto_sync.stop()
+
+    stats = auto_sync.get_stats()
+    assert (stats.n_failed_syncs, stats.n_syncs, stats.n_synced_writes) == (2, 1, 1)
+    first_retry, second_retry = (b - a for a, b in zip(sync.calls, sync.calls[1:]))
+    assert 0.05 <= first_retry < second_retry
+    assert second_retry >= 0.1
@@ -1,9 +1,11 @@
-from dataclasses import dataclass
-from typing import Any
+import json
+import struct
+from dataclasses import dataclass, field
+from typing import Any, Callable, Sequence
 
-from sqlalchemy import TEXT
+from sqlalchemy import TEXT, ColumnElement, Row
 from sqlalchemy import Engine, text
-from sqlalchemy import select
+from sqlalchemy import case, func, select
 from sqlalchemy.orm import (
     DeclarativeBase,
     Mapped,
@@ -20,6 +22,8 @@ from syncstore.versioned_changes_syncstore import (
     Value,
     ValueType,
     VersionedChangesSyncStore,
+    VersionVector,
+    merge_version_vectors,
 )
 
 
@@ -31,8 +35,17 @@ class PTrackedPeer(PCrsqliteBase):
     __tablename__ = "crsql_tracked_peers"
     site_id: Mapped[bytes] = mapped_column(primary_key=True)
     version: Mapped[int]
-    tag: Mapped[int] = mapped_column(primary_key=True, default=0)  # 0=WHOLE_DB
-    event: Mapped[int] = mapped_column(primary_key=True, default=0)  # 0=RECEIVED
+    # 0=WHOLE_DB, ALL_ORIGINS_TAG: versions of the version vector sync
+    tag: Mapped[int] = mapped_column(primary_key=True, default=0)
+    event: Mapped[int] = mapped_column(
+        primary_key=True, default=0
+    )  # 0=RECEIVED, 1=SENT
+
+
+# tracked versions up to which a peer's changes of any origin were received, or ours were
+# sent (version vectors are in use, see VersionedChangesSyncStore.get_vector_sync_versions);
+# kept apart from the versions of a single origin (tag 0), which only cover its own changes
+ALL_ORIGINS_TAG = 1
 
 
 class PChange(PCrsqliteBase):
@@ -61,6 +74,25 @@ class PChange(PCrsqliteBase):
     seq: Mapped[int]
 
 
+class PVersionVectorEntry(PCrsqliteBase):
+    # origin versions known by this site (not tracked by crsqlite)
+    __tablename__ = "sync_version_vector"
+    site_id: Mapped[bytes] = mapped_column(primary_key=True)
+    version: Mapped[int]
+
+
+class PChangeOrigin(PCrsqliteBase):
+    # db_version at the origin of merged changes, which crsqlite replaces by the local one
+    __tablename__ = "sync_change_origin"
+    table: Mapped[str] = mapped_column(primary_key=True)
+    pk: Mapped[bytes] = mapped_column(primary_key=True)
+    cid: Mapped[str] = mapped_column(primary_key=True)
+    site_id: Mapped[bytes] = mapped_column(primary_key=True)
+    col_version: Mapped[int]
+    cl: Mapped[int]
+    origin_version: Mapped[int]
+
+
 def from_value(val: Value) -> Any:
     if ValueType.NONE == val.value_type:
         return None
@@ -95,7 +127,35 @@ def to_pchange(c: Change) -> PChange:
     )
 
 
-def to_change(pc: PChange) -> Change:
+def unpack_pk(packed: bytes) -> tuple:
+    # primary key values of a row, as packed by crsqlite (crsql_changes.pk):
+    # number of columns, then per column a header byte (size of the length/int << 3 | type)
+    values: list[Any] = []
+    offset = 1
+    for _ in range(packed[0]):
+        header = packed[offset]
+        value_type, int_len = header & 0x07, header >> 3
+        offset += 1
+        if value_type == 5:  # NULL
+            values.append(None)
+            continue
+        n = int.from_bytes(packed[offset : offset + int_len], "big", signed=True)
+        offset += int_len
+        if value_type == 1:  # INTEGER
+            values.append(n)
+        elif value_type == 2:  # FLOAT
+            values.append(struct.unpack(">d", packed[offset : offset + 8])[0])
+            offset += 8
+        elif value_type in (3, 4):  # TEXT, BLOB: n is the length
+            data = packed[offset : offset + n]
+            values.append(data.decode() if value_type == 3 else data)
+            offset += n
+        else:
+            raise ValueError(f"unknown column type in packed pk: {value_type}")
+    return tuple(values)
+
+
+def to_change(pc: PChange | Row) -> Change:
     return Change(
         table=pc.table,
         pk=to_value(pc.pk),
@@ -106,21 +166,133 @@ def to_change(pc: PChange) -> Change:
         site_id=to_value(pc.site_id),
         cl=pc.cl,
         seq=pc.seq,
+        origin_version=getattr(pc, "origin_version", None),
+    )
+
+
+def to_change_row(c: Change) -> tuple:
+    # positional parameters for INSERT_CHANGE_SQL
+    return (
+        c.table,
+        from_value(c.pk),
+        c.cid,
+        from_value(c.val),
+        c.col_version,
+        c.db_version,
+        from_value(c.site_id),
+        c.cl,
+        c.seq,
     )
 
 
+INSERT_CHANGE_SQL = (
+    'INSERT INTO crsql_changes ("table", pk, cid, val, col_version, db_version, site_id, cl, seq)'
+    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+UPSERT_TRACKED_PEER_SQL = (
+    "INSERT INTO crsql_tracked_peers (site_id, version, tag, event) VALUES (?, ?, ?, 0)"
+    " ON CONFLICT (site_id, tag, event) DO UPDATE SET version = excluded.version"
+)
+# the latest change of each origin per column (later changes have a higher (cl, col_version))
+UPSERT_CHANGE_ORIGIN_SQL = (
+    'INSERT INTO sync_change_origin ("table", pk, cid, site_id, col_version, cl, origin_version)'
+    " VALUES (?, ?, ?, ?, ?, ?, ?)"
+    ' ON CONFLICT ("table", pk, cid, site_id) DO UPDATE SET col_version = excluded.col_version,'
+    " cl = excluded.cl, origin_version = excluded.origin_version"
+    " WHERE (excluded.cl, excluded.col_version) > (sync_change_origin.cl, sync_change_origin.col_version)"
+)
+# only advanced if the changes continue the known ones (the version vector they were selected by)
+ADVANCE_VERSION_VECTOR_SQL = (
+    "INSERT INTO sync_version_vector (site_id, version) SELECT ?, ?"
+    " WHERE coalesce((SELECT version FROM sync_version_vector WHERE site_id = ?), -1) >= ?"
+    " ON CONFLICT (site_id) DO UPDATE SET version = max(version, excluded.version)"
+)
+
+
+def changes_after(since_version: int, since_seq: int | None) -> ColumnElement[bool]:
+    # keyset condition: (db_version, seq) > (since_version, since_seq)
+    if since_seq is None:
+        return PChange.db_version > since_version
+    return (PChange.db_version >= since_version) & ~(
+        (PChange.db_version == since_version) & (PChange.seq <= since_seq)
+    )
+
+
+def claimed_version_vector(rows: Sequence[Row], complete_up_to: int) -> VersionVector:
+    # per origin, the latest change of the db_versions which are completely contained:
+    # changes of an origin are merged in the order of their origin versions,
+    # so all earlier changes of that origin are contained as well (or were known before)
+    version_vector: VersionVector = {}
+    for r in rows:
+        if r.origin_version is not None and r.db_version <= complete_up_to:
+            site_id = r.site_id.hex()
+            version_vector[site_id] = max(
+                version_vector.get(site_id, -1), r.origin_version
+            )
+    return version_vector
+
+
+def received_tag(changes: Changes) -> int:
+    # changes selected by a version vector are of any origin
+    return 0 if changes.version_vector is None else ALL_ORIGINS_TAG
+
+
+def change_origin_rows(changes: Changes, local_site_id: str) -> list[tuple]:
+    # positional parameters for UPSERT_CHANGE_ORIGIN_SQL
+    return [
+        (
+            c.table,
+            from_value(c.pk),
+            c.cid,
+            from_value(c.site_id),
+            c.col_version,
+            c.cl,
+            c.origin_version,
+        )
+        for c in changes.changes
+        if c.origin_version is not None and c.site_id.value != local_site_id
+    ]
+
+
+def version_vector_rows(changes: Changes, local_site_id: str) -> list[tuple]:
+    # positional parameters for ADVANCE_VERSION_VECTOR_SQL
+    since = changes.since_version_vector or {}
+    return [
+        (bytes.fromhex(s), v, bytes.fromhex(s), since.get(s, -1))
+        for s, v in (changes.version_vector or {}).items()
+        if s != local_site_id
+    ]
+
+
 @dataclass
 class CrSqliteSyncStore(VersionedChangesSyncStore):
     # crsqlite for change tracking + sync operations
 
     engine: Engine
+    # apply changes via executemany on the raw DBAPI connection instead of the ORM
+    bulk_apply: bool = field(default=True, kw_only=True)
+    apply_batch_size: int = field(default=10_000, kw_only=True)
+    # track the origin versions of merged changes, see VersionedChangesSyncStore.sync_steps
+    use_version_vectors: bool = field(default=True, kw_only=True)
+    # called after changes were applied (committed), e.g. to invalidate caches of their rows
+    changes_applied_listeners: list[Callable[[Changes], None]] = field(
+        default_factory=list, kw_only=True, repr=False, compare=False
+    )
 
     def setup_table_change_tracking(self, tables: Tables) -> None:
+        PCrsqliteBase.metadata.create_all(
+            self.engine,
+            tables=[PVersionVectorEntry.__table__, PChangeOrigin.__table__],  # type: ignore
+        )
         with self.engine.connect() as c:
             for t in tables.table_names:
                 c.execute(text(f"SELECT crsql_as_crr('{t}');"))
             c.commit()
 
+    def close(self) -> None:
+        # closes the pooled connections (finalizing crsqlite on each of them)
+        self.engine.dispose()
+
     def get_site_id(self) -> str:
         with self.engine.connect() as c:
             site_id_bytes: bytes = (
@@ -132,54 +304,252 @@ class CrSqliteSyncStore(VersionedChangesSyncStore):
         with self.engine.connect() as c:
             return c.execute(text("SELECT crsql_db_version()")).all()[0]._tuple()[0]
 
-    def get_last_received_version(self, from_site_id: str) -> int:
+    def get_changed_rows(
+        self, since_version: int
+    ) -> tuple[int, set[tuple[str, tuple]]]:
+        # (table, primary key) of the rows changed after since_version, local or merged,
+        # and the version to pass next time (rows changed concurrently may be reported twice)
+        version = self.get_current_version()
         with Session(self.engine) as session:
-            tp: PTrackedPeer | None = session.scalar(
-                select(PTrackedPeer).where(
-                    (PTrackedPeer.site_id == bytes.fromhex(from_site_id))
-                    & (PTrackedPeer.tag == 0)
-                    & (PTrackedPeer.event == 0)
+            rows = session.execute(
+                select(PChange.table, PChange.pk)
+                .where(PChange.db_version > since_version)
+                .distinct()
+            ).all()
+        return version, {(table, unpack_pk(pk)) for table, pk in rows}
+
+    def get_version_vector(self) -> VersionVector | None:
+        if not self.use_version_vectors:
+            return None
+        # read before the own version: a concurrent merge can only make it more conservative
+        with Session(self.engine) as session:
+            version_vector = {
+                e.site_id.hex(): e.version
+                for e in session.scalars(select(PVersionVectorEntry))
+            }
+        version_vector[self.get_site_id()] = self.get_current_version()
+        return version_vector
+
+    def get_tracked_peer_version(
+        self, site_id: str, tag: int, event: int
+    ) -> int | None:
+        with Session(self.engine) as session:
+            return session.scalar(
+                select(PTrackedPeer.version).where(
+                    (PTrackedPeer.site_id == bytes.fromhex(site_id))
+                    & (PTrackedPeer.tag == tag)
+                    & (PTrackedPeer.event == event)
                 )
             )
-            if tp is not None:
-                return tp.version
-            else:
-                tp = PTrackedPeer(
-                    site_id=bytes.fromhex(from_site_id), version=-1, tag=0, event=0
-                )
-                session.merge(tp)
-                session.commit()
-                return -1
+
+    def set_tracked_peer_version(
+        self, site_id: str, tag: int, event: int, version: int
+    ) -> None:
+        with Session(self.engine) as session:
+            ptp = PTrackedPeer(
+                site_id=bytes.fromhex(site_id), version=version, tag=tag, event=event
+            )
+            session.merge(ptp)
+            session.commit()
+
+    def get_last_received_version(self, from_site_id: str) -> int:
+        version = self.get_tracked_peer_version(from_site_id, 0, 0)
+        if version is None:
+            self.set_tracked_peer_version(from_site_id, 0, 0, -1)
+            return -1
+        return version
+
+    def get_last_sent_version(self, to_site_id: str) -> int | None:
+        return self.get_tracked_peer_version(to_site_id, 0, 1)  # 1=SENT
+
+    def set_last_sent_version(self, to_site_id: str, version: int) -> None:
+        self.set_tracked_peer_version(to_site_id, 0, 1, version)
+
+    def get_vector_sync_versions(self, peer_site_id: str) -> tuple[int, int]:
+        sent = self.get_tracked_peer_version(peer_site_id, ALL_ORIGINS_TAG, 1)
+        received = self.get_tracked_peer_version(peer_site_id, ALL_ORIGINS_TAG, 0)
+        return (
+            -1 if sent is None else sent,
+            -1 if received is None else received,
+        )
+
+    def set_vector_sync_sent_version(self, peer_site_id: str, version: int) -> None:
+        self.set_tracked_peer_version(peer_site_id, ALL_ORIGINS_TAG, 1, version)
+
+    def has_changes(self, changes_query: ChangesQuery) -> bool:
+        if changes_query.version_vector is not None:
+            return super().has_changes(changes_query)
+        stmt = select(PChange.db_version).where(
+            changes_after(changes_query.since_version, changes_query.since_seq)
+        )
+        if changes_query.from_site_id:
+            stmt = stmt.where(
+                PChange.site_id == bytes.fromhex(changes_query.from_site_id)
+            )
+        if changes_query.not_from_site_id:
+            stmt = stmt.where(
+                PChange.site_id != bytes.fromhex(changes_query.not_from_site_id)
+            )
+        with Session(self.engine) as session:
+            return session.execute(stmt.limit(1)).first() is not None
 
     def get_changes(self, changes_query: ChangesQuery) -> Changes:
-        since_version = changes_query.since_version
         from_site_id = changes_query.from_site_id
         not_from_site_id = changes_query.not_from_site_id
-        if not (bool(from_site_id) ^ bool(not_from_site_id)):
+        version_vector = changes_query.version_vector
+        if version_vector is None and not (bool(from_site_id) ^ bool(not_from_site_id)):
             raise Exception("exactly one of the site_id params must be set")
+        if version_vector is not None and (from_site_id or not_from_site_id):
+            raise Exception("site_id params are not supported with a version_vector")
+        # read the versions first: changes committed in between are re-sent at worst, never lost
+        known_version_vector = self.get_version_vector()
+        current_version = self.get_current_version()
+        site_id = self.get_site_id()
         with Session(self.engine) as session:
             # all reads within a read-tx are guaranteed to only see writes commited before the begin of the read-tx
             # (snapshot-isolation) https://www.sqlite.org/isolation.html
-            stmt = select(PChange).where((PChange.db_version > since_version))
+            origin_version = case(
+                (PChange.site_id == bytes.fromhex(site_id), PChange.db_version),
+                else_=PChangeOrigin.origin_version,
+            )
+            stmt = (
+                select(
+                    *PChange.__table__.columns, origin_version.label("origin_version")
+                )
+                .outerjoin(
+                    PChangeOrigin,
+                    (PChangeOrigin.table == PChange.table)
+                    & (PChangeOrigin.pk == PChange.pk)
+                    & (PChangeOrigin.cid == PChange.cid)
+                    & (PChangeOrigin.site_id == PChange.site_id)
+                    & (PChangeOrigin.col_version == PChange.col_version)
+                    & (PChangeOrigin.cl == PChange.cl),
+                )
+                .where(
+                    changes_after(changes_query.since_version, changes_query.since_seq)
+                )
+            )
             if from_site_id:
                 stmt = stmt.where(PChange.site_id == bytes.fromhex(from_site_id))
             elif not_from_site_id:
                 stmt = stmt.where(PChange.site_id != bytes.fromhex(not_from_site_id))
             else:
-                raise Exception()
-            pchanges = session.scalars(stmt).all()
-            changes = [to_change(pc) for pc in pchanges]
-            return Changes(changes, self.get_current_version(), self.get_site_id())
+                # changes of an unknown origin (version) are always included
+                known = (
+                    func.json_each(json.dumps(version_vector))
+                    .table_valued("key", "value")
+                    .alias("known")
+                )
+                stmt = stmt.outerjoin(
+                    known, known.c.key == func.lower(func.hex(PChange.site_id))
+                ).where(
+                    known.c.value.is_(None)
+                    | origin_version.is_(None)
+                    | (origin_version > known.c.value)
+                )
+            stmt = stmt.order_by(PChange.db_version, PChange.seq)
+            limit = changes_query.limit
+            rows: Sequence[Row] = session.execute(
+                stmt if limit is None else stmt.limit(limit + 1)
+            ).all()
+            if limit is None or len(rows) <= limit:
+                changes = Changes(
+                    [to_change(r) for r in rows], current_version, site_id
+                )
+            else:
+                # page is full: complete the group of the last (db_version, seq) instead of splitting it
+                last = rows[limit - 1]
+                rows = [
+                    r
+                    for r in rows[:limit]
+                    if (r.db_version, r.seq) != (last.db_version, last.seq)
+                ]
+                rows += session.execute(
+                    stmt.where(
+                        (PChange.db_version == last.db_version)
+                        & (PChange.seq == last.seq)
+                    )
+                ).all()
+                # the last db_version may be incomplete, so only the one before is fully contained
+                changes = Changes(
+                    [to_change(r) for r in rows],
+                    last.db_version - 1,
+                    site_id,
+                    has_more=True,
+                )
+        if version_vector is not None:
+            changes.since_version_vector = version_vector
+            changes.version_vector = claimed_version_vector(rows, changes.version)
+            if (
+                not changes.has_more
+                and changes_query.since_seq is None
+                and known_version_vector is not None
+            ):
+                # all unknown changes after the ones the receiver already has (since_version):
+                # the receiver knows everything we know
+                changes.version_vector = merge_version_vectors(
+                    changes.version_vector, known_version_vector
+                )
+        return changes
 
     def apply_changes(self, changes: Changes) -> None:
+        if self.bulk_apply:
+            self.apply_changes_bulk(changes)
+        else:
+            self.apply_changes_orm(changes)
+        for listener in self.changes_applied_listeners:
+            listener(changes)
+
+    def apply_changes_bulk(self, changes: Changes) -> None:
+        # all batches and the tracked peer version are committed in a single transaction;
+        # driver-level executemany skips the ORM but still goes through the engine events
+        with self.engine.begin() as connection:
+            for i in range(0, len(changes.changes), self.apply_batch_size):
+                batch = changes.changes[i : i + self.apply_batch_size]
+                connection.exec_driver_sql(
+                    INSERT_CHANGE_SQL, [to_change_row(c) for c in batch]
+                )
+            connection.exec_driver_sql(
+                UPSERT_TRACKED_PEER_SQL,
+                (
+                    bytes.fromhex(changes.from_site_id),
+                    changes.version,
+                    received_tag(changes),
+                ),
+            )
+            if self.use_version_vectors:
+                # on the same connection, the pool may have no other one to spare
+                site_id = (
+                    connection.exec_driver_sql("SELECT crsql_site_id()")
+                    .scalar_one()
+                    .hex()
+                )
+                for sql, rows in [
+                    (UPSERT_CHANGE_ORIGIN_SQL, change_origin_rows(changes, site_id)),
+                    (ADVANCE_VERSION_VECTOR_SQL, version_vector_rows(changes, site_id)),
+                ]:
+                    if rows:
+                        connection.exec_driver_sql(sql, rows)
+
+    def apply_changes_orm(self, changes: Changes) -> None:
         with Session(self.engine) as session:
             pchanges = [to_pchange(c) for c in changes.changes]
             session.add_all(pchanges)
             ptp = PTrackedPeer(
                 site_id=bytes.fromhex(changes.from_site_id),
                 version=changes.version,
-                tag=0,
+                tag=received_tag(changes),
                 event=0,
             )
             session.merge(ptp)
+            if self.use_version_vectors:
+                site_id = (
+                    session.execute(text("SELECT crsql_site_id()")).scalar_one().hex()
+                )
+                for sql, rows in [
+                    (UPSERT_CHANGE_ORIGIN_SQL, change_origin_rows(changes, site_id)),
+                    (ADVANCE_VERSION_VECTOR_SQL, version_vector_rows(changes, site_id)),
+                ]:
+                    if rows:
+                        session.connection().exec_driver_sql(sql, rows)
             session.commit()
@@ -0,0 +1,265 @@
+from dataclasses import replace
+
+import pytest
+from sqlalchemy import text
+
+from sqlite_setup import DURABLE, ConnectionProfile, get_engine
+from syncstore.crsqlite_syncstore import CrSqliteSyncStore
+from syncstore.syncstore import SyncResult
+from syncstore.versioned_changes_syncstore import ChangesQuery, Tables, covers
+
+OTHER_SITE_ID = "00" * 16
+
+
+def create_store(name: str, profile: ConnectionProfile = DURABLE) -> CrSqliteSyncStore:
+    engine = get_engine(
+        db_file=f"./db/crsqlite_syncstore_test_{name}.db", profile=profile
+    )
+    with engine.connect() as c:
+        c.execute(text("CREATE TABLE item (id TEXT PRIMARY KEY NOT NULL, v TEXT)"))
+        c.commit()
+    store = CrSqliteSyncStore(name, None, engine)
+    store.setup_table_change_tracking(Tables(["item"]))
+    return store
+
+
+def insert_items(store: CrSqliteSyncStore, ids: list[str]) -> None:
+    for i in ids:  # one transaction per item
+        with store.engine.connect() as c:
+            c.execute(text("INSERT INTO item VALUES (:id, 'v')"), {"id": i})
+            c.commit()
+
+
+@pytest.fixture
+def a(clean_test_db_dir) -> CrSqliteSyncStore:
+    return create_store("a")
+
+
+@pytest.fixture
+def b(clean_test_db_dir) -> CrSqliteSyncStore:
+    return create_store("b")
+
+
+def test_paginated_changes(a: CrSqliteSyncStore, b: CrSqliteSyncStore):
+    insert_items(a, [f"a{i}" for i in range(3)])
+    insert_items(b, [f"b{i}" for i in range(5)])
+    # merged within one transaction, b's changes share the same (db_version, seq)
+    a.apply_changes(b.get_changes(ChangesQuery(from_site_id=b.get_site_id())))
+    insert_items(a, [f"a{i}" for i in range(3, 6)])
+
+    query = ChangesQuery(not_from_site_id=OTHER_SITE_ID)
+    all_changes = a.get_changes(query)
+    assert len(all_changes.changes) == 11
+    assert not all_changes.has_more
+
+    a.changes_page_size = 2
+    pages = list(a.iter_changes(query))
+    assert [len(p.changes) for p in pages] == [2, 5, 2, 2]
+    assert [c for p in pages for c in p.changes] == all_changes.changes
+    assert all(p.has_more for p in pages[:-1])
+    assert pages[-1].version == all_changes.version == a.get_current_version()
+    # intermediate pages only claim the versions they completely contain
+    versions = [p.version for p in pages]
+    assert versions == sorted(versions)
+    assert all(p.version < p.changes[-1].db_version for p in pages[:-1])
+
+    # resume from the cursor of an interrupted walk
+    resumed = list(a.iter_changes(query.next_page(pages[1])))
+    assert [c for p in resumed for c in p.changes] == [
+        c for p in pages[2:] for c in p.changes
+    ]
+
+
+def test_bulk_apply_matches_orm_apply(a: CrSqliteSyncStore, b: CrSqliteSyncStore):
+    c = create_store("c")
+    insert_items(a, [f"a{i}" for i in range(5)])
+    changes = a.get_changes(ChangesQuery(from_site_id=a.get_site_id()))
+
+    b.apply_batch_size = 2
+    b.apply_changes(changes)
+    c.bulk_apply = False
+    c.apply_changes(changes)
+
+    query = ChangesQuery(not_from_site_id=OTHER_SITE_ID)
+    assert b.get_changes(query).changes == c.get_changes(query).changes
+    assert len(b.get_changes(query).changes) == 5
+    assert b.get_last_received_version(a.get_site_id()) == changes.version
+    assert c.get_last_received_version(a.get_site_id()) == changes.version
+
+
+def test_apply_needs_a_single_connection(a: CrSqliteSyncStore):
+    insert_items(a, [f"a{i}" for i in range(3)])
+    changes = a.get_changes(ChangesQuery(from_site_id=a.get_site_id()))
+    # waits at most 1s for a second connection, which is never returned
+    single_connection = replace(DURABLE, pool_size=1, max_overflow=0, pool_timeout=1.0)
+    for bulk_apply in [True, False]:
+        b = create_store(f"b_{bulk_apply}", single_connection)
+        b.bulk_apply = bulk_apply
+        b.apply_changes(changes)
+        assert b.get_last_received_version(a.get_site_id()) == changes.version
+
+
+@pytest.mark.parametrize("use_version_vectors", [False, True])
+def test_sync_repushes_when_remote_is_behind_acknowledged_version(
+    a: CrSqliteSyncStore, b: CrSqliteSyncStore, monkeypatch, use_version_vectors
+):
+    a.use_version_vectors = b.use_version_vectors = use_version_vectors
+    a.remote_syncstore = b
+    insert_items(a, ["a0"])
+    assert a.sync() == SyncResult(n_pulled_changes=0, n_pushed_changes=1)
+    if not use_version_vectors:
+        assert a.get_last_sent_version(b.get_site_id()) == a.get_current_version()
+
+    # e.g. remote restored from an older backup: what we pushed against is ahead of it
+    if use_version_vectors:
+        a.remote_version_vectors["b"] = {a.get_site_id(): a.get_current_version() + 10}
+    else:
+        a.set_last_sent_version(b.get_site_id(), a.get_current_version() + 10)
+    insert_items(a, ["a1", "a2"])
+    a.push_chunk_size = 1
+    pushed: list[int] = []
+    push_changes = b.push_changes
+
+    def counting_push_changes(changes, pushed_since_version):
+        pushed.append(len(changes.changes))
+        return push_changes(changes, pushed_since_version)
+
+    monkeypatch.setattr(b, "push_changes", counting_push_changes)
+    result = a.sync()
+    assert result == SyncResult(n_pulled_changes=0, n_pushed_changes=2)
+    assert "repush" in result.phase_durations
+    assert pushed == [1, 1]  # the gap, in acknowledged chunks
+    if use_version_vectors:
+        assert covers(b.get_version_vector(), a.get_version_vector())
+    else:
+        assert b.get_last_received_version(a.get_site_id()) == a.get_current_version()
+    query = ChangesQuery(not_from_site_id=OTHER_SITE_ID)
+    assert len(b.get_changes(query).changes) == 3
+
+
+@pytest.mark.parametrize("use_version_vectors", [False, True])
+def test_interrupted_chunked_push_resumes(
+    a: CrSqliteSyncStore, b: CrSqliteSyncStore, monkeypatch, use_version_vectors
+):
+    a.use_version_vectors = b.use_version_vectors = use_version_vectors
+    a.remote_syncstore = b
+    a.push_chunk_size = 2
+    insert_items(a, [f"a{i}" for i in range(5)])
+
+    # connection lost while pushing the third chunk (the first one is part of the exchange)
+    push_changes = b.push_changes
+    n_pushes = 0
+
+    def interrupted_push_changes(changes, pushed_since_version):
+        nonlocal n_pushes
+        n_pushes += 1
+        if n_pushes == 2:
+            raise ConnectionError()
+        return push_changes(changes, pushed_since_version)
+
+    monkeypatch.setattr(b, "push_changes", interrupted_push_changes)
+    with pytest.raises(ConnectionError):
+        a.sync()
+    query = ChangesQuery(not_from_site_id=OTHER_SITE_ID)
+    assert len(b.get_changes(query).changes) == 4
+
+    # resumes after the last acknowledged chunk (which only claims complete versions)
+    monkeypatch.setattr(b, "push_changes", push_changes)
+    assert a.sync() == SyncResult(n_pulled_changes=0, n_pushed_changes=2)
+    assert len(b.get_changes(query).changes) == 5
+    assert a.sync() == SyncResult(n_pulled_changes=0, n_pushed_changes=0)
+
+
+def test_sync_caches_remote_site_id(a: CrSqliteSyncStore, b: CrSqliteSyncStore):
+    a.remote_syncstore = b
+    insert_items(a, ["a0"])
+    a.sync()
+    assert a.remote_site_ids["b"] == b.get_site_id()
+
+    # remote replaced by a different database, detected by the site_id of its response
+    c = create_store("c")
+    c.name = "b"
+    a.remote_syncstore = c
+    insert_items(a, ["a1"])
+    assert a.sync() == SyncResult(n_pulled_changes=0, n_pushed_changes=2)
+    assert a.remote_site_ids["b"] == c.get_site_id()
+
+
+def sync_three_nodes(
+    use_version_vectors: bool, pairs: list[tuple[int, int]]
+) -> tuple[int, list[int]]:
+    # syncs the given (local, remote) pairs of nodes a, b, c a few times:
+    # returns the number of sent changes, and the number of changes each node ends up with
+    mode = ("vv" if use_version_vectors else "single") + str(len(pairs))
+    nodes = [create_store(f"{name}_{mode}") for name in ["a", "b", "c"]]
+    for node in nodes:
+        node.use_version_vectors = use_version_vectors
+        insert_items(node, [f"{node.name}{i}" for i in range(2)])
+    n_sent = 0
+    for _ in range(3):
+        for local, remote in pairs:
+            nodes[local].remote_syncstore = nodes[remote]
+            result = nodes[local].sync()
+            n_sent += result.n_pulled_changes + result.n_pushed_changes
+    query = ChangesQuery(not_from_site_id=OTHER_SITE_ID)
+    return n_sent, [len(node.get_changes(query).changes) for node in nodes]
+
+
+def test_version_vector_sync_of_three_nodes(clean_test_db_dir):
+    # each of the 6 changes (2 per node) has to reach 2 other nodes: 12 changes sent at least
+    a, b, c = 0, 1, 2
+
+    # b relays between a and c
+    n_sent, n_changes = sync_three_nodes(False, [(b, a), (b, c)])
+    assert n_changes == [4, 6, 4]  # b only pushes its own changes
+    n_sent, n_changes = sync_three_nodes(True, [(b, a), (b, c)])
+    assert n_changes == [6, 6, 6]
+    assert n_sent == 12
+
+    # all connected: third-party changes are pulled again via the other node
+    n_sent, n_changes = sync_three_nodes(False, [(b, a), (b, c), (a, c)])
+    assert n_changes == [6, 6, 6]
+    assert n_sent - 12 == 6
+    n_sent, n_changes = sync_three_nodes(True, [(b, a), (b, c), (a, c)])
+    assert n_changes == [6, 6, 6]
+    # pushes are filtered by the version vector of the remote as of the last sync:
+    # c's changes reached a via a's sync with c, which b only learns after pushing them again
+    assert n_sent - 12 == 2
+
+
+def test_version_vector_sync_only_queries_unsynced_versions(
+    a: CrSqliteSyncStore, b: CrSqliteSyncStore, monkeypatch
+):
+    a.remote_syncstore = b
+    insert_items(a, ["a0", "a1"])
+    insert_items(b, ["b0"])
+    assert a.sync() == SyncResult(n_pulled_changes=1, n_pushed_changes=2)
+    sent, received = a.get_vector_sync_versions(b.get_site_id())
+    assert sent > -1 and received > -1
+
+    queries: list[tuple[str, ChangesQuery]] = []
+    for store in [a, b]:
+
+        def get_changes(query, store=store, get_changes=store.get_changes):
+            queries.append((store.name, query))
+            return get_changes(query)
+
+        monkeypatch.setattr(store, "get_changes", get_changes)
+    assert a.sync() == SyncResult(n_pulled_changes=0, n_pushed_changes=0)
+    assert [(name, q.since_version) for name, q in queries] == [
+        ("a", sent),
+        ("b", received),
+    ]
+
+
+def test_changed_rows(a: CrSqliteSyncStore, b: CrSqliteSyncStore):
+    insert_items(a, ["a0", "a1"])
+    version, rows = a.get_changed_rows(-1)
+    assert rows == {("item", ("a0",)), ("item", ("a1",))}
+
+    insert_items(b, ["b0"])
+    a.apply_changes(b.get_changes(ChangesQuery(from_site_id=b.get_site_id())))
+    with a.engine.connect() as c:
+        c.execute(text("UPDATE item SET v = 'w' WHERE id = 'a1'"))
+        c.commit()
+    assert a.get_changed_rows(version)[1] == {("item", ("b0",)), ("item", ("a1",))}
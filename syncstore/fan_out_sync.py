@@ -0,0 +1,159 @@
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import Hashable
+
+from .syncstore import SyncResult
+from .versioned_changes_syncstore import (
+    Changes,
+    ChangesQuery,
+    Tables,
+    VersionedChangesSyncStore,
+    VersionVector,
+)
+
+logger = logging.getLogger(__name__)
+
+# sync of a store with several remotes at once (e.g. a primary and a backup hub),
+# the syncs with the remotes run concurrently, each one on a thread of a pool
+
+
+@dataclass
+class FanOutSyncResult(SyncResult):
+    # totals over the successful syncs, which are also listed per remote (name)
+    results: dict[str, SyncResult] = field(default_factory=dict, compare=False)
+    errors: dict[str, Exception] = field(default_factory=dict, compare=False)
+
+
+def changes_query_key(changes_query: ChangesQuery) -> Hashable:
+    return tuple(
+        tuple(sorted(v.items())) if isinstance(v, dict) else v
+        for v in vars(changes_query).values()
+    )
+
+
+@dataclass
+class SharedLocalSyncStore(VersionedChangesSyncStore):
+    # the local store, as seen by the concurrent syncs of one fan-out round:
+    # reads not depending on the remote (site_id, version vector, equal change queries,
+    # e.g. the push of own changes to hubs which received the same ones before)
+    # are done once for all remotes, writes are serialized (sqlite has a single writer);
+    # changes pulled from one remote are relayed to the others by the next round
+
+    store: VersionedChangesSyncStore
+    write_lock: Lock = field(default_factory=Lock, init=False, repr=False)
+    reads_lock: Lock = field(default_factory=Lock, init=False, repr=False)
+    reads: dict[Hashable, Future] = field(default_factory=dict, init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        # state per remote is kept by the local store, across rounds
+        self.remote_site_ids = self.store.remote_site_ids
+        self.remote_version_vectors = self.store.remote_version_vectors
+        self.changes_page_size = self.store.changes_page_size
+        self.push_chunk_size = self.store.push_chunk_size
+
+    def shared_read(self, key: Hashable, read, *args):
+        # the first caller reads, concurrent and later callers get its result
+        with self.reads_lock:
+            future = self.reads.get(key)
+            is_reader = future is None
+            if future is None:
+                future = self.reads[key] = Future()
+        if is_reader:
+            try:
+                future.set_result(read(*args))
+            except Exception as e:
+                future.set_exception(e)
+        return future.result()
+
+    def setup_table_change_tracking(self, tables: Tables) -> None:
+        with self.write_lock:
+            self.store.setup_table_change_tracking(tables)
+
+    def get_site_id(self) -> str:
+        return self.shared_read("site_id", self.store.get_site_id)
+
+    def get_version_vector(self) -> VersionVector | None:
+        return self.shared_read("version_vector", self.store.get_version_vector)
+
+    def get_current_version(self) -> int | None:
+        return self.store.get_current_version()
+
+    def get_changes(self, changes_query: ChangesQuery) -> Changes:
+        key = ("changes", changes_query_key(changes_query))
+        return self.shared_read(key, self.store.get_changes, changes_query)
+
+    def get_last_received_version(self, from_site_id: str) -> int:
+        # may insert the initial version of a new peer
+        with self.write_lock:
+            return self.store.get_last_received_version(from_site_id)
+
+    def get_last_sent_version(self, to_site_id: str) -> int | None:
+        return self.store.get_last_sent_version(to_site_id)
+
+    def set_last_sent_version(self, to_site_id: str, version: int) -> None:
+        with self.write_lock:
+            self.store.set_last_sent_version(to_site_id, version)
+
+    def get_vector_sync_versions(self, peer_site_id: str) -> tuple[int, int]:
+        return self.store.get_vector_sync_versions(peer_site_id)
+
+    def set_vector_sync_sent_version(self, peer_site_id: str, version: int) -> None:
+        with self.write_lock:
+            self.store.set_vector_sync_sent_version(peer_site_id, version)
+
+    def apply_changes(self, changes: Changes) -> None:
+        with self.write_lock:
+            self.store.apply_changes(changes)
+
+    def sync(self) -> SyncResult:
+        raise NotImplementedError("synced by FanOutSync")
+
+
+@dataclass
+class FanOutSync:
+    store: VersionedChangesSyncStore
+    remotes: list[VersionedChangesSyncStore]
+    max_workers: int | None = None  # default: a thread per remote
+    executor: ThreadPoolExecutor | None = field(default=None, init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        names = [r.name for r in self.remotes]
+        if len(set(names)) != len(names):
+            # the state per remote is kept by name, see VersionedChangesSyncStore
+            raise ValueError(f"remote names must be unique: {names}")
+
+    def sync(self) -> FanOutSyncResult:
+        # a failed remote does not fail the others, raises only if all of them failed
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                max_workers=self.max_workers or len(self.remotes) or 1,
+                thread_name_prefix="fan-out-sync",
+            )
+        local = SharedLocalSyncStore(self.store.name, None, self.store)
+        futures = {
+            r.name: self.executor.submit(local.sync_remote, r) for r in self.remotes
+        }
+        result = FanOutSyncResult(n_pulled_changes=0, n_pushed_changes=0)
+        for name, future in futures.items():
+            try:
+                remote_result = future.result()
+            except Exception as e:
+                logger.warning(
+                    "sync of %s with %s failed: %s", self.store.name, name, e
+                )
+                result.errors[name] = e
+                continue
+            result.results[name] = remote_result
+            result.n_pulled_changes += remote_result.n_pulled_changes
+            result.n_pushed_changes += remote_result.n_pushed_changes
+            result.transfer_stats += remote_result.transfer_stats
+        if result.errors and not result.results:
+            raise next(iter(result.errors.values()))
+        return result
+
+    def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
@@ -0,0 +1,88 @@
+import pytest
+from sqlalchemy import text
+
+from syncstore.crsqlite_syncstore import CrSqliteSyncStore
+from syncstore.crsqlite_syncstore_test import create_store, insert_items
+from syncstore.fan_out_sync import FanOutSync, FanOutSyncResult
+from syncstore.syncstore import SyncResult
+from syncstore.versioned_changes_syncstore import Changes, ChangesQuery
+
+
+def item_ids(store: CrSqliteSyncStore) -> set[str]:
+    with store.engine.connect() as c:
+        return set(c.execute(text("SELECT id FROM item")).scalars())
+
+
+class UnreachableRemote(CrSqliteSyncStore):
+    def get_site_id(self) -> str:
+        raise ConnectionError("unreachable")
+
+
+@pytest.fixture
+def stores(clean_test_db_dir) -> list[CrSqliteSyncStore]:
+    return [create_store(name) for name in ["local", "hub1", "hub2"]]
+
+
+def test_fan_out_sync(stores: list[CrSqliteSyncStore]):
+    local, hub1, hub2 = stores
+    insert_items(local, ["l1", "l2"])
+    insert_items(hub1, ["h1"])
+    insert_items(hub2, ["h2", "h3"])
+    fan_out = FanOutSync(local, [hub1, hub2])
+
+    result = fan_out.sync()
+    assert result.results == {
+        "hub1": SyncResult(n_pulled_changes=1, n_pushed_changes=2),
+        "hub2": SyncResult(n_pulled_changes=2, n_pushed_changes=2),
+    }
+    assert (result.n_pulled_changes, result.n_pushed_changes) == (3, 4)
+    assert item_ids(local) == {"l1", "l2", "h1", "h2", "h3"}
+
+    # the changes of each hub reach the other one with the next round
+    fan_out.sync()
+    fan_out.close()
+    assert item_ids(hub1) == item_ids(hub2) == item_ids(local)
+
+
+def test_equal_local_queries_are_shared(stores: list[CrSqliteSyncStore]):
+    # without version vectors, hubs which received the same own changes get the same push
+    for store in stores:
+        store.use_version_vectors = False
+    local, hub1, hub2 = stores
+    fan_out = FanOutSync(local, [hub1, hub2])
+    insert_items(local, ["l1"])
+    fan_out.sync()
+
+    queries: list[ChangesQuery] = []
+    get_changes = local.get_changes
+
+    def recording_get_changes(query: ChangesQuery) -> Changes:
+        queries.append(query)
+        return get_changes(query)
+
+    local.get_changes = recording_get_changes  # type: ignore
+    insert_items(local, ["l2"])
+    result = fan_out.sync()
+    fan_out.close()
+    # a single push query for both hubs (pulls are queried on the hubs)
+    assert len(queries) == 1
+    assert result.n_pushed_changes == 2
+    assert item_ids(hub1) == item_ids(hub2) == {"l1", "l2"}
+
+
+def test_failed_remote_does_not_fail_the_others(stores: list[CrSqliteSyncStore]):
+    local, hub1, _ = stores
+    insert_items(hub1, ["h1"])
+    unreachable = UnreachableRemote("unreachable", None, hub1.engine)
+    fan_out = FanOutSync(local, [unreachable, hub1])
+
+    result = fan_out.sync()
+    assert isinstance(result, FanOutSyncResult)
+    assert list(result.results) == ["hub1"]
+    assert isinstance(result.errors["unreachable"], ConnectionError)
+    assert item_ids(local) == {"h1"}
+
+    with pytest.raises(ConnectionError):  # nothing synced at all
+        FanOutSync(local, [unreachable]).sync()
+    with pytest.raises(ValueError):
+        FanOutSync(local, [hub1, hub1])
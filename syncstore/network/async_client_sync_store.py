@@ -0,0 +1,297 @@
+import asyncio
+from concurrent.futures import Executor
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Iterable, TypeVar
+
+import httpx
+
+from syncstore.network.changes_codec import BINARY_CHANGES_MIMETYPE
+from syncstore.network.client_sync_store import (
+    MAX_RESPONSE_SIZE,
+    accept_changes_headers,
+    complete_changes,
+    decode_changes_body,
+    encode_changes_body,
+    response_version_vector,
+)
+from syncstore.network.server_sync_store import (
+    JSON_MIMETYPE,
+    LAST_RECEIVED_VERSION_HEADER,
+    TENANT_PATH_PREFIX,
+    LastReceivedVersionRequest,
+    LastReceivedVersionResponse,
+    PushQuery,
+    SiteInfo,
+    SyncQuery,
+    VersionVectorInfo,
+    WatchQuery,
+    WatchResponse,
+    changes_query_schema,
+    last_received_version_request_schema,
+    last_received_version_response_schema,
+    push_query_schema,
+    site_info_schema,
+    sync_query_schema,
+    version_vector_info_schema,
+    watch_query_schema,
+    watch_response_schema,
+)
+from syncstore.syncstore import SyncResult, TransferStats
+from syncstore.versioned_changes_syncstore import (
+    Changes,
+    ChangesQuery,
+    PushResponse,
+    SyncRequest,
+    SyncResponse,
+    VersionedChangesSyncStore,
+    VersionVector,
+)
+
+T = TypeVar("T")
+
+
+@dataclass
+class AsyncHttpClientVersionedChangesSyncstore:
+    # asyncio counterpart of HttpClientVersionedChangesSyncstore,
+    # providing the remote operations of a sync
+
+    name: str
+    host: str
+    port: int
+    changes_mimetype: str = BINARY_CHANGES_MIMETYPE
+    compression: str | None = "gzip"
+    compression_threshold: int = 1024
+    changes_page_size: int = 1000
+    timeout: float = 30.0  # seconds
+    max_retries: int = 3  # failed connection attempts
+    tenant: str | None = None  # key of the tenant, if the server serves several
+    max_response_size: int = MAX_RESPONSE_SIZE  # bytes, also after decompressing
+    # connection pool, may be shared by the clients of many stores syncing with the same server
+    client: httpx.AsyncClient | None = field(default=None, repr=False, compare=False)
+    transfer_stats: TransferStats = field(default_factory=TransferStats)
+    syncstore_server: str = field(init=False)
+    owns_client: bool = field(init=False)
+
+    def __post_init__(self):
+        self.syncstore_server = f"http://{self.host}:{self.port}"
+        if self.tenant is not None:
+            self.syncstore_server += TENANT_PATH_PREFIX + self.tenant
+        self.owns_client = self.client is None
+        if self.client is None:
+            self.client = create_client(self.timeout, self.max_retries)
+
+    async def aclose(self) -> None:
+        if self.owns_client and self.client is not None:
+            await self.client.aclose()
+
+    @property
+    def http(self) -> httpx.AsyncClient:
+        assert self.client is not None
+        return self.client
+
+    async def get_site_id(self) -> str:
+        self.transfer_stats.n_round_trips += 1
+        r = await self.http.get(self.syncstore_server + "/site-id")
+        assert r.status_code == 200
+        info: SiteInfo = site_info_schema.load(r.json())  # type: ignore
+        return info.site_id
+
+    async def get_last_received_version(self, from_site_id: str) -> int:
+        self.transfer_stats.n_round_trips += 1
+        r = await self.http.get(
+            self.syncstore_server + "/last-received-version",
+            params=last_received_version_request_schema.dump(
+                LastReceivedVersionRequest(from_site_id)
+            ),
+        )
+        assert r.status_code == 200
+        lrv: LastReceivedVersionResponse = last_received_version_response_schema.loads(
+            r.text
+        )  # type: ignore
+        return lrv.version
+
+    async def get_version_vector(self) -> VersionVector | None:
+        self.transfer_stats.n_round_trips += 1
+        r = await self.http.get(self.syncstore_server + "/version-vector")
+        assert r.status_code == 200
+        info: VersionVectorInfo = version_vector_info_schema.load(r.json())  # type: ignore
+        return info.version_vector
+
+    async def get_changes(self, changes_query: ChangesQuery) -> Changes:
+        self.transfer_stats.n_round_trips += 1
+        async with self.http.stream(
+            "GET",
+            self.syncstore_server + "/changes",
+            params=query_params(changes_query_schema.dump(changes_query)),
+            headers=accept_changes_headers(self.changes_mimetype),
+        ) as r:
+            assert r.status_code == 200
+            return complete_changes(await self.read_changes(r), changes_query)
+
+    async def apply_changes(self, changes: Changes) -> None:
+        r = await self.post_changes("/changes", changes)
+        await r.aclose()
+        assert r.status_code == 204
+
+    async def push_changes(
+        self, changes: Changes, pushed_since_version: int
+    ) -> PushResponse:
+        r = await self.post_changes(
+            "/push",
+            changes,
+            params=query_params(
+                push_query_schema.dump(PushQuery(pushed_since_version))
+            ),
+        )
+        await r.aclose()
+        assert r.status_code == 204
+        return PushResponse(
+            int(r.headers[LAST_RECEIVED_VERSION_HEADER]),
+            response_version_vector(r.headers),
+        )
+
+    async def exchange_changes(self, sync_request: SyncRequest) -> SyncResponse:
+        sync_query = SyncQuery(
+            **asdict(sync_request.changes_query),
+            pushed_since_version=sync_request.pushed_since_version,
+        )
+        r = await self.post_changes(
+            "/sync",
+            sync_request.changes,
+            params=query_params(sync_query_schema.dump(sync_query)),
+            headers=accept_changes_headers(self.changes_mimetype),
+        )
+        try:
+            assert r.status_code == 200
+            changes = await self.read_changes(r)
+        finally:
+            await r.aclose()
+        return SyncResponse(
+            changes,
+            int(r.headers[LAST_RECEIVED_VERSION_HEADER]),
+            response_version_vector(r.headers),
+        )
+
+    async def wait_for_changes(self, watch_query: WatchQuery) -> WatchResponse:
+        # see HttpClientVersionedChangesSyncstore.wait_for_changes
+        self.transfer_stats.n_round_trips += 1
+        r = await self.http.get(
+            self.syncstore_server + "/watch",
+            params=query_params(watch_query_schema.dump(watch_query)),
+            timeout=self.timeout + watch_query.timeout,
+        )
+        if r.status_code == 429:
+            await asyncio.sleep(float(r.headers.get("Retry-After", 1)))
+            return WatchResponse(watch_query.since_version, False)
+        assert r.status_code == 200
+        return watch_response_schema.load(r.json())  # type: ignore
+
+    async def read_changes(self, r: httpx.Response) -> Changes:
+        # read the body as sent, to account for its compressed size
+        # (up to max_response_size + 1 bytes, see decode_changes_body)
+        chunks: list[bytes] = []
+        size = 0
+        async for chunk in r.aiter_raw():
+            chunks.append(chunk)
+            size += len(chunk)
+            if size > self.max_response_size:
+                break
+        return decode_changes_body(
+            b"".join(chunks),
+            r.headers.get("Content-Type"),
+            r.headers.get("Content-Encoding"),
+            self.transfer_stats,
+            self.max_response_size,
+        )
+
+    async def post_changes(
+        self,
+        path: str,
+        changes: Changes,
+        params: dict | None = None,
+        headers: dict[str, str] | None = None,
+    ) -> httpx.Response:
+        # streamed response, to be closed by the caller
+        body, body_headers = self.changes_body(changes)
+        self.transfer_stats.n_round_trips += 1
+        request = self.http.build_request(
+            "POST",
+            self.syncstore_server + path,
+            params=params,
+            content=body,
+            headers=body_headers | (headers or {}),
+        )
+        r = await self.http.send(request, stream=True)
+        if r.status_code == 415 and self.changes_mimetype == BINARY_CHANGES_MIMETYPE:
+            # server without support for the binary format: json from now on
+            await r.aclose()
+            self.changes_mimetype = JSON_MIMETYPE
+            return await self.post_changes(path, changes, params, headers)
+        return r
+
+    def changes_body(self, changes: Changes) -> tuple[bytes, dict[str, str]]:
+        return encode_changes_body(
+            changes,
+            self.changes_mimetype,
+            self.compression,
+            self.compression_threshold,
+            self.transfer_stats,
+        )
+
+
+def query_params(params: dict) -> dict:
+    # unlike requests, httpx would send None as an empty value
+    return {k: v for k, v in params.items() if v is not None}
+
+
+def create_client(
+    timeout: float = 30.0, max_retries: int = 3, pool_size: int = 100
+) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        timeout=timeout,
+        limits=httpx.Limits(max_connections=pool_size),
+        transport=httpx.AsyncHTTPTransport(retries=max_retries),
+    )
+
+
+@dataclass
+class AsyncSync:
+    # sync of a local store with an async remote: network calls are awaited,
+    # the (blocking) sqlite work of the local store runs on the executor
+
+    store: VersionedChangesSyncStore
+    remote: AsyncHttpClientVersionedChangesSyncstore
+    executor: Executor
+
+    async def local(self, fn: Callable[..., T], *args) -> T:
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, fn, *args
+        )
+
+    async def sync(self) -> SyncResult:
+        # the calls of VersionedChangesSyncStore.sync_steps
+        steps = self.store.sync_steps(self.remote)
+        try:
+            call = next(steps)
+            while True:
+                if call.remote:
+                    result = await getattr(self.remote, call.method)(*call.args)
+                else:
+                    method = getattr(self.store, call.method)
+                    result = await self.local(method, *call.args)
+                call = steps.send(result)
+        except StopIteration as stop:
+            return stop.value
+
+
+async def sync_concurrently(
+    syncs: Iterable[AsyncSync], max_concurrency: int
+) -> list[SyncResult | BaseException]:
+    # sync all stores, at most max_concurrency at a time; failures are returned, not raised
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def sync(s: AsyncSync) -> SyncResult:
+        async with semaphore:
+            return await s.sync()
+
+    return await asyncio.gather(*(sync(s) for s in syncs), return_exceptions=True)
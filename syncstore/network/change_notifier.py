@@ -0,0 +1,25 @@
+from dataclasses import dataclass, field
+from threading import Condition
+
+# wakes up long-polling watchers of the store, instead of each one polling the database
+
+
+@dataclass
+class ChangeNotifier:
+    # counts the (potential) writes handled by the server;
+    # watchers remember the count before checking the store, then wait for it to move
+    n_writes: int = field(default=0, init=False)
+    condition: Condition = field(
+        default_factory=Condition, init=False, repr=False, compare=False
+    )
+
+    def notify(self) -> None:
+        with self.condition:
+            self.n_writes += 1
+            self.condition.notify_all()
+
+    def wait(self, n_seen_writes: int, timeout: float) -> int:
+        # returns the current count, which equals n_seen_writes on timeout
+        with self.condition:
+            self.condition.wait_for(lambda: self.n_writes != n_seen_writes, timeout)
+            return self.n_writes
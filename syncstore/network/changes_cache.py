@@ -0,0 +1,78 @@
+from collections import OrderedDict
+from dataclasses import dataclass, field, fields
+from threading import Lock
+from typing import Hashable
+
+from syncstore.versioned_changes_syncstore import ChangesQuery
+
+# encoded change sets served to many clients pulling the same range,
+# valid as long as the version of the store does not move
+
+
+@dataclass
+class ChangesCacheStats:
+    n_hits: int = 0
+    n_misses: int = 0
+    n_evictions: int = 0  # entries dropped to stay within the byte budget
+    n_invalidations: int = 0  # times the cache was cleared since the version moved
+    n_entries: int = 0
+    n_bytes: int = 0
+
+
+def changes_cache_key(mimetype: str, changes_query: ChangesQuery) -> Hashable:
+    # version range and site filter of a query (also of its subclasses, e.g. SyncQuery)
+    values = [getattr(changes_query, f.name) for f in fields(ChangesQuery)]
+    return mimetype, *(
+        tuple(sorted(v.items())) if isinstance(v, dict) else v for v in values
+    )
+
+
+@dataclass
+class ChangesCache:
+    max_bytes: int
+    version: int | None = field(default=None, init=False)
+    # encoded changes and their number
+    entries: OrderedDict[Hashable, tuple[bytes, int]] = field(
+        default_factory=OrderedDict, init=False, repr=False
+    )
+    stats: ChangesCacheStats = field(default_factory=ChangesCacheStats, init=False)
+    lock: Lock = field(default_factory=Lock, init=False, repr=False, compare=False)
+
+    def get(self, version: int, key: Hashable) -> tuple[bytes, int] | None:
+        with self.lock:
+            entry = self.entries.get(key) if self.is_current(version) else None
+            if entry is None:
+                self.stats.n_misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats.n_hits += 1
+            return entry
+
+    def put(self, version: int, key: Hashable, data: bytes, n_changes: int = 0) -> None:
+        # version must be read before the data, so that the data is at least as recent
+        if len(data) > self.max_bytes:
+            return
+        with self.lock:
+            if not self.is_current(version):
+                return  # computed before a newer version was seen
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.stats.n_bytes -= len(previous[0])
+            self.entries[key] = (data, n_changes)
+            self.stats.n_bytes += len(data)
+            while self.stats.n_bytes > self.max_bytes:
+                _, (evicted, _) = self.entries.popitem(last=False)
+                self.stats.n_bytes -= len(evicted)
+                self.stats.n_evictions += 1
+            self.stats.n_entries = len(self.entries)
+
+    def is_current(self, version: int) -> bool:
+        # newer version: all entries are outdated, older version: the caller is
+        if self.version is None or version > self.version:
+            if self.entries:
+                self.entries.clear()
+                self.stats.n_invalidations += 1
+            self.stats.n_entries = 0
+            self.stats.n_bytes = 0
+            self.version = version
+        return version == self.version
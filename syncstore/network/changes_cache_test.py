@@ -0,0 +1,46 @@
+from syncstore.network.changes_cache import ChangesCache, changes_cache_key
+from syncstore.network.server_sync_store import SyncQuery
+from syncstore.versioned_changes_syncstore import ChangesQuery
+
+SITE_ID = "00" * 16
+
+
+def key(since_version: int):
+    return changes_cache_key("mimetype", ChangesQuery(since_version, SITE_ID))
+
+
+def test_lru_eviction_within_byte_budget():
+    cache = ChangesCache(max_bytes=10)
+    cache.put(1, key(0), b"aaaa")
+    cache.put(1, key(1), b"bbbb")
+    assert cache.get(1, key(0)) == (b"aaaa", 0)  # now most recently used
+    cache.put(1, key(2), b"cccc", 3)
+    assert cache.get(1, key(1)) is None
+    assert cache.get(1, key(0)) == (b"aaaa", 0)
+    assert cache.get(1, key(2)) == (b"cccc", 3)
+    cache.put(1, key(3), b"x" * 11)  # larger than the budget
+    assert cache.get(1, key(3)) is None
+
+    stats = cache.stats
+    assert (stats.n_hits, stats.n_misses, stats.n_evictions) == (3, 2, 1)
+    assert (stats.n_entries, stats.n_bytes) == (2, 8)
+
+
+def test_invalidated_when_version_moves():
+    cache = ChangesCache(max_bytes=100)
+    cache.put(1, key(0), b"v1")
+    assert cache.get(2, key(0)) is None
+    cache.put(1, key(0), b"v1")  # computed at an outdated version
+    assert cache.get(2, key(0)) is None
+    cache.put(2, key(0), b"v2")
+    assert cache.get(2, key(0)) == (b"v2", 0)
+    assert cache.get(1, key(0)) is None  # request older than the cache
+    assert cache.stats.n_invalidations == 1
+
+
+def test_key_ignores_push_params():
+    query = ChangesQuery(5, not_from_site_id=SITE_ID, limit=100)
+    sync_query = SyncQuery(
+        5, not_from_site_id=SITE_ID, limit=100, pushed_since_version=3
+    )
+    assert changes_cache_key("m", query) == changes_cache_key("m", sync_query)
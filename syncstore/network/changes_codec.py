@@ -0,0 +1,218 @@
+from syncstore.versioned_changes_syncstore import (
+    Change,
+    Changes,
+    Value,
+    ValueType,
+    VersionVector,
+)
+
+# compact binary wire format for Changes, as alternative to the marshmallow json representation
+#
+# changes:  magic | version | from_site_id | has_more | n_changes | change*
+#           | version_vector | since_version_vector
+# change:   table-ref | pk | cid-ref | val | col_version | db_version | site_id-ref | cl | seq
+#           | origin_version
+# value:    type-byte | length | raw bytes  (bytes are sent raw instead of hex-encoded)
+# version vector: present-byte | n_entries | (site_id-ref | version)*
+# ints are zigzag varints, lengths are varints,
+# strings which typically repeat (table names, column ids, site ids) are sent once
+# and then referenced by index
+
+BINARY_CHANGES_MIMETYPE = "application/vnd.crsqlite-changes"
+
+MAGIC = b"CRC2"
+MAGIC_V1 = b"CRC1"  # without origin versions and version vectors, still decoded
+
+VALUE_TYPES: list[ValueType] = [ValueType.NONE, ValueType.STRING, ValueType.BYTES]
+VALUE_TYPE_CODES: dict[ValueType, int] = {t: i for i, t in enumerate(VALUE_TYPES)}
+
+
+class ChangesDecodeError(Exception):
+    pass
+
+
+def _write_uvarint(out: bytearray, n: int) -> None:
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _write_varint(out: bytearray, n: int) -> None:
+    _write_uvarint(out, (n << 1) if n >= 0 else ((-n << 1) - 1))
+
+
+def _write_bytes(out: bytearray, b: bytes) -> None:
+    _write_uvarint(out, len(b))
+    out += b
+
+
+def _write_ref(out: bytearray, refs: dict[str, int], s: str) -> None:
+    # index of an already sent string, or the next index followed by the string itself
+    ref = refs.get(s)
+    if ref is not None:
+        _write_uvarint(out, ref)
+        return
+    ref = len(refs)
+    refs[s] = ref
+    _write_uvarint(out, ref)
+    _write_bytes(out, s.encode())
+
+
+def _write_value(out: bytearray, v: Value) -> None:
+    out.append(VALUE_TYPE_CODES[v.value_type])
+    if ValueType.BYTES == v.value_type:
+        _write_bytes(out, bytes.fromhex(v.value))
+    elif ValueType.STRING == v.value_type:
+        _write_bytes(out, v.value.encode())
+
+
+def _write_value_ref(out: bytearray, refs: dict[str, int], v: Value) -> None:
+    out.append(VALUE_TYPE_CODES[v.value_type])
+    if ValueType.NONE != v.value_type:
+        _write_ref(out, refs, v.value)
+
+
+def _write_version_vector(
+    out: bytearray, refs: dict[str, int], vv: VersionVector | None
+) -> None:
+    if vv is None:
+        out.append(0)
+        return
+    out.append(1)
+    _write_uvarint(out, len(vv))
+    for site_id, version in vv.items():
+        _write_ref(out, refs, site_id)
+        _write_varint(out, version)
+
+
+def encode_changes(changes: Changes) -> bytes:
+    out = bytearray(MAGIC)
+    _write_varint(out, changes.version)
+    _write_bytes(out, changes.from_site_id.encode())
+    out.append(int(changes.has_more))
+    _write_uvarint(out, len(changes.changes))
+    refs: dict[str, int] = {}
+    for c in changes.changes:
+        _write_ref(out, refs, c.table)
+        _write_value(out, c.pk)
+        _write_ref(out, refs, c.cid)
+        _write_value(out, c.val)
+        _write_varint(out, c.col_version)
+        _write_varint(out, c.db_version)
+        _write_value_ref(out, refs, c.site_id)
+        _write_varint(out, c.cl)
+        _write_varint(out, c.seq)
+        _write_varint(out, -1 if c.origin_version is None else c.origin_version)
+    _write_version_vector(out, refs, changes.version_vector)
+    _write_version_vector(out, refs, changes.since_version_vector)
+    return bytes(out)
+
+
+class _Reader:
+    def __init__(self, data: bytes) -> None:
+        self.data = memoryview(data)
+        self.pos = 0
+        self.refs: list[str] = []
+
+    def uvarint(self) -> int:
+        data = self.data
+        n = 0
+        shift = 0
+        while True:
+            b = data[self.pos]
+            self.pos += 1
+            n |= (b & 0x7F) << shift
+            if b < 0x80:
+                return n
+            shift += 7
+            if shift > 63:  # longer than a 64-bit varint (10 bytes)
+                raise ChangesDecodeError("overlong varint in binary changes payload")
+
+    def varint(self) -> int:
+        n = self.uvarint()
+        return (n >> 1) if not n & 1 else -((n + 1) >> 1)
+
+    def bytes(self) -> bytes:
+        n = self.uvarint()
+        start = self.pos
+        self.pos += n
+        if self.pos > len(self.data):
+            raise IndexError()
+        return self.data[start : self.pos].tobytes()
+
+    def ref(self) -> str:
+        ref = self.uvarint()
+        if ref == len(self.refs):
+            self.refs.append(self.bytes().decode())
+        return self.refs[ref]
+
+    def value(self) -> Value:
+        value_type = VALUE_TYPES[self.data[self.pos]]
+        self.pos += 1
+        if ValueType.BYTES == value_type:
+            return Value(value_type, self.bytes().hex())
+        if ValueType.STRING == value_type:
+            return Value(value_type, self.bytes().decode())
+        return Value(value_type, "")
+
+    def value_ref(self) -> Value:
+        value_type = VALUE_TYPES[self.data[self.pos]]
+        self.pos += 1
+        if ValueType.NONE == value_type:
+            return Value(value_type, "")
+        return Value(value_type, self.ref())
+
+    def origin_version(self) -> int | None:
+        v = self.varint()
+        return None if v == -1 else v
+
+    def version_vector(self) -> VersionVector | None:
+        present = self.data[self.pos]
+        self.pos += 1
+        if not present:
+            return None
+        return {self.ref(): self.varint() for _ in range(self.uvarint())}
+
+
+def decode_changes(data: bytes) -> Changes:
+    magic = data[: len(MAGIC)]
+    if magic not in (MAGIC, MAGIC_V1):
+        raise ChangesDecodeError("not a binary changes payload")
+    v1 = magic == MAGIC_V1
+    r = _Reader(data)
+    r.pos = len(MAGIC)
+    try:
+        version = r.varint()
+        from_site_id = r.bytes().decode()
+        has_more = bool(r.data[r.pos])
+        r.pos += 1
+        changes = [
+            Change(
+                table=r.ref(),
+                pk=r.value(),
+                cid=r.ref(),
+                val=r.value(),
+                col_version=r.varint(),
+                db_version=r.varint(),
+                site_id=r.value_ref(),
+                cl=r.varint(),
+                seq=r.varint(),
+                origin_version=None if v1 else r.origin_version(),
+            )
+            for _ in range(r.uvarint())
+        ]
+        version_vector = None if v1 else r.version_vector()
+        since_version_vector = None if v1 else r.version_vector()
+    except (IndexError, UnicodeDecodeError) as e:
+        raise ChangesDecodeError("truncated or corrupt binary changes payload") from e
+    if r.pos != len(data):
+        raise ChangesDecodeError("trailing data after binary changes payload")
+    return Changes(
+        changes,
+        version,
+        from_site_id,
+        has_more=has_more,
+        version_vector=version_vector,
+        since_version_vector=since_version_vector,
+    )
@@ -0,0 +1,67 @@
+import pytest
+
+from syncstore.network.changes_codec import (
+    MAGIC,
+    ChangesDecodeError,
+    decode_changes,
+    encode_changes,
+)
+from syncstore.network.server_sync_store import changes_schema
+from syncstore.versioned_changes_syncstore import Change, Changes, Value, ValueType
+
+SITE_ID = Value(ValueType.BYTES, "7c2bcd0e45e04373849a07868dedb337")
+
+
+def test_roundtrip():
+    changes = Changes(
+        [
+            Change(
+                "todo_item",
+                Value(ValueType.BYTES, "010b026130"),
+                "content",
+                Value(ValueType.STRING, "ünïcode ✓"),
+                1,
+                2,
+                SITE_ID,
+                1,
+                0,
+            ),
+            Change(
+                "todo_item",
+                Value(ValueType.BYTES, "010b026131"),
+                "-1",
+                Value(ValueType.NONE, ""),
+                300,
+                2**40,
+                SITE_ID,
+                2,
+                1,
+                origin_version=7,
+            ),
+        ],
+        version=-1,
+        from_site_id=SITE_ID.value,
+        has_more=True,
+        version_vector={SITE_ID.value: 7, "00" * 16: 0},
+        since_version_vector={},
+    )
+    encoded = encode_changes(changes)
+    assert decode_changes(encoded) == changes
+    assert len(encoded) < len(changes_schema.dumps(changes)) / 2
+
+    empty = Changes([], 0, SITE_ID.value)
+    assert decode_changes(encode_changes(empty)) == empty
+
+
+def test_corrupt_payload():
+    encoded = encode_changes(
+        Changes([Change("t", SITE_ID, "c", SITE_ID, 1, 1, SITE_ID, 1, 0)], 1, "site")
+    )
+    with pytest.raises(ChangesDecodeError):
+        decode_changes(encoded[:-3])
+    with pytest.raises(ChangesDecodeError):
+        decode_changes(encoded + b"\x00")
+    with pytest.raises(ChangesDecodeError):
+        decode_changes(b'{"changes": []}')
+    with pytest.raises(ChangesDecodeError):
+        decode_changes(MAGIC + b"\xff" * 100_000)  # overlong varint
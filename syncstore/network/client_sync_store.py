@@ -1,29 +1,136 @@
-from dataclasses import dataclass, field
+import json
+import time
+from dataclasses import asdict, dataclass, field
+from threading import Event
+from typing import Callable
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+from syncstore.network.changes_codec import (
+    BINARY_CHANGES_MIMETYPE,
+    decode_changes,
+    encode_changes,
+)
+from syncstore.network.compression import (
+    SUPPORTED_ENCODINGS,
+    PayloadTooLargeError,
+    compress,
+    decompress,
+)
 from syncstore.network.server_sync_store import (
+    JSON_MIMETYPE,
+    LAST_RECEIVED_VERSION_HEADER,
+    TENANT_PATH_PREFIX,
+    VERSION_VECTOR_HEADER,
     LastReceivedVersionRequest,
     LastReceivedVersionResponse,
+    PushQuery,
     SiteInfo,
+    SyncQuery,
+    VersionVectorInfo,
+    WatchQuery,
+    WatchResponse,
     changes_query_schema,
     changes_schema,
     last_received_version_request_schema,
     last_received_version_response_schema,
+    parse_version_vector,
+    push_query_schema,
     site_info_schema,
+    sync_query_schema,
     tables_schema,
+    version_vector_info_schema,
+    watch_query_schema,
+    watch_response_schema,
 )
-from syncstore.syncstore import SyncResult
+from syncstore.syncstore import SyncResult, TransferStats
 from syncstore.versioned_changes_syncstore import (
     Changes,
     ChangesQuery,
+    PushResponse,
+    SyncRequest,
+    SyncResponse,
     Tables,
     VersionedChangesSyncStore,
+    VersionVector,
 )
 
+# bytes of a changes response, also after decompressing it (see max_request_size of the server)
+MAX_RESPONSE_SIZE = 64 * 1024 * 1024
+
 # TODO: generate client from openapi ?
 
 
+def accept_changes_headers(changes_mimetype: str) -> dict[str, str]:
+    accept = JSON_MIMETYPE
+    if changes_mimetype == BINARY_CHANGES_MIMETYPE:
+        accept = f"{BINARY_CHANGES_MIMETYPE}, {JSON_MIMETYPE};q=0.5"
+    return {"Accept": accept, "Accept-Encoding": ", ".join(SUPPORTED_ENCODINGS)}
+
+
+def decode_changes_body(
+    body: bytes,
+    content_type: str | None,
+    content_encoding: str | None,
+    transfer_stats: TransferStats,
+    max_size: int | None,
+) -> Changes:
+    # body: read up to max_size + 1 bytes, so that exceeding the limit can be told
+    start = time.perf_counter()
+    if max_size is not None and len(body) > max_size:
+        raise PayloadTooLargeError(f"response exceeds {max_size} bytes")
+    data = decompress(body, content_encoding, max_size)
+    transfer_stats.n_bytes_received += len(body)
+    transfer_stats.n_bytes_received_uncompressed += len(data)
+    if content_type == BINARY_CHANGES_MIMETYPE:
+        changes = decode_changes(data)
+    else:
+        changes = changes_schema.loads(data)  # type: ignore
+    transfer_stats.decode_duration += time.perf_counter() - start
+    return changes
+
+
+def complete_changes(changes: Changes, changes_query: ChangesQuery) -> Changes:
+    # without a limit, all changes of the query are expected: the server caps the page size,
+    # so rather fail than return a page which looks complete
+    if changes_query.limit is None and changes.has_more:
+        raise Exception(
+            "more changes than the server returns at once, query them with a limit"
+            " and follow has_more (see iter_changes)"
+        )
+    return changes
+
+
+def response_version_vector(headers) -> VersionVector | None:
+    value = headers.get(VERSION_VECTOR_HEADER)
+    return None if value is None else parse_version_vector(value)
+
+
+def encode_changes_body(
+    changes: Changes,
+    changes_mimetype: str,
+    compression: str | None,
+    compression_threshold: int,
+    transfer_stats: TransferStats,
+) -> tuple[bytes, dict[str, str]]:
+    start = time.perf_counter()
+    if changes_mimetype == BINARY_CHANGES_MIMETYPE:
+        data = encode_changes(changes)
+    else:
+        data = json.dumps(changes_schema.dump(changes)).encode()
+    headers = {"Content-Type": changes_mimetype}
+    body = data
+    if compression and len(data) >= compression_threshold:
+        body = compress(data, compression)
+        headers["Content-Encoding"] = compression
+    transfer_stats.n_bytes_sent += len(body)
+    transfer_stats.n_bytes_sent_uncompressed += len(data)
+    transfer_stats.encode_duration += time.perf_counter() - start
+    return body, headers
+
+
 @dataclass
 class HttpClientVersionedChangesSyncstore(VersionedChangesSyncStore):
     # proxy which implements sync-operations by forwarding calls to an http-server
@@ -31,29 +138,69 @@ class HttpClientVersionedChangesSyncstore(VersionedChangesSyncStore):
     host: str
     port: int
     syncstore_server: str = field(init=False)  # host:port, e.g. localhost:5000
+    # wire format of changes, json as fallback if the server does not support binary
+    changes_mimetype: str = field(default=BINARY_CHANGES_MIMETYPE, kw_only=True)
+    # content-encoding of pushed changes (None: uncompressed), pulled changes are negotiated
+    compression: str | None = field(default="gzip", kw_only=True)
+    compression_threshold: int = field(default=1024, kw_only=True)
+    # key of the tenant, if the server serves several (see TenantPool)
+    tenant: str | None = field(default=None, kw_only=True)
+    # keep-alive connection pool, shared by all calls
+    pool_size: int = field(default=4, kw_only=True)
+    timeout: float = field(default=30.0, kw_only=True)  # seconds (connect and read)
+    max_retries: int = field(default=3, kw_only=True)
+    # protects against a broken (or malicious) server, e.g. a small payload inflating to gigabytes
+    max_response_size: int = field(default=MAX_RESPONSE_SIZE, kw_only=True)
+    retry_backoff_factor: float = field(
+        default=0.1, kw_only=True
+    )  # seconds, doubled per retry
+    session: requests.Session = field(init=False, repr=False, compare=False)
 
     def __post_init__(self):
         self.syncstore_server = f"http://{self.host}:{self.port}"
+        if self.tenant is not None:
+            self.syncstore_server += TENANT_PATH_PREFIX + self.tenant
+        # all endpoints may be retried, as applying the same changes again is idempotent
+        retry = Retry(
+            total=self.max_retries,
+            backoff_factor=self.retry_backoff_factor,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=None,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.hooks["response"].append(self.count_round_trip)
+
+    def count_round_trip(self, r: requests.Response, *args, **kwargs) -> None:
+        self.transfer_stats.n_round_trips += 1
+
+    def close(self) -> None:
+        self.session.close()
 
     def setup_table_change_tracking(self, tables: Tables) -> None:
-        r = requests.post(
+        r = self.session.post(
             self.syncstore_server + "/setup-table-change-tracking",
             json=tables_schema.dump(tables),
+            timeout=self.timeout,
         )
         assert r.status_code == 204
 
     def get_site_id(self) -> str:
-        r = requests.get(self.syncstore_server + "/site-id")
+        r = self.session.get(self.syncstore_server + "/site-id", timeout=self.timeout)
         assert r.status_code == 200
         info: SiteInfo = site_info_schema.load(r.json())  # type: ignore
         return info.site_id
 
     def get_last_received_version(self, from_site_id: str) -> int:
-        r = requests.get(
+        r = self.session.get(
             self.syncstore_server + "/last-received-version",
             params=last_received_version_request_schema.dump(
                 LastReceivedVersionRequest(from_site_id)
             ),
+            timeout=self.timeout,
         )
         assert r.status_code == 200
         lrv: LastReceivedVersionResponse = last_received_version_response_schema.loads(
@@ -61,21 +208,138 @@ class HttpClientVersionedChangesSyncstore(VersionedChangesSyncStore):
         )  # type: ignore
         return lrv.version
 
+    def get_version_vector(self) -> VersionVector | None:
+        r = self.session.get(
+            self.syncstore_server + "/version-vector", timeout=self.timeout
+        )
+        assert r.status_code == 200
+        info: VersionVectorInfo = version_vector_info_schema.load(r.json())  # type: ignore
+        return info.version_vector
+
     def get_changes(self, changes_query: ChangesQuery) -> Changes:
-        r = requests.get(
+        with self.session.get(
             self.syncstore_server + "/changes",
             params=changes_query_schema.dump(changes_query),
+            headers=accept_changes_headers(self.changes_mimetype),
+            stream=True,
+            timeout=self.timeout,
+        ) as r:
+            assert r.status_code == 200
+            return complete_changes(self.read_changes(r), changes_query)
+
+    def apply_changes(self, changes: Changes) -> None:
+        with self.post_changes("/changes", changes) as r:
+            assert r.status_code == 204
+
+    def push_changes(self, changes: Changes, pushed_since_version: int) -> PushResponse:
+        with self.post_changes(
+            "/push",
+            changes,
+            params=push_query_schema.dump(PushQuery(pushed_since_version)),
+        ) as r:
+            assert r.status_code == 204
+        return PushResponse(
+            int(r.headers[LAST_RECEIVED_VERSION_HEADER]),
+            response_version_vector(r.headers),
+        )
+
+    def exchange_changes(self, sync_request: SyncRequest) -> SyncResponse:
+        sync_query = SyncQuery(
+            **asdict(sync_request.changes_query),
+            pushed_since_version=sync_request.pushed_since_version,
+        )
+        with self.post_changes(
+            "/sync",
+            sync_request.changes,
+            params=sync_query_schema.dump(sync_query),
+            headers=accept_changes_headers(self.changes_mimetype),
+        ) as r:
+            assert r.status_code == 200
+            changes = self.read_changes(r)
+        return SyncResponse(
+            changes,
+            int(r.headers[LAST_RECEIVED_VERSION_HEADER]),
+            response_version_vector(r.headers),
+        )
+
+    def wait_for_changes(self, watch_query: WatchQuery) -> WatchResponse:
+        # long-poll, blocks until the server has changes after since_version (or times out)
+        r = self.session.get(
+            self.syncstore_server + "/watch",
+            params=watch_query_schema.dump(watch_query),
+            timeout=self.timeout + watch_query.timeout,
         )
+        if (
+            r.status_code == 429
+        ):  # all watcher slots taken, wait as if there were no changes
+            time.sleep(float(r.headers.get("Retry-After", 1)))
+            return WatchResponse(watch_query.since_version, False)
         assert r.status_code == 200
-        return changes_schema.loads(r.text)  # type: ignore
+        return watch_response_schema.load(r.json())  # type: ignore
 
-    def apply_changes(self, changes: Changes) -> None:
-        # tbd: compress
-        r = requests.post(
-            self.syncstore_server + "/changes",
-            json=changes_schema.dump(changes),
+    def watch(
+        self,
+        on_changes: Callable[[], object],
+        not_from_site_id: str | None = None,
+        stop: Event | None = None,
+        timeout: float = 30.0,
+    ) -> None:
+        # calls on_changes (e.g. sync of the local store) whenever the server has new changes,
+        # instead of polling with sync: the first call reports all changes of the server
+        # not_from_site_id: the site_id of the local store, so that its own pushes are ignored
+        # stop: ends watching, at the latest after the current long-poll
+        since_version = -1
+        while stop is None or not stop.is_set():
+            response = self.wait_for_changes(
+                WatchQuery(since_version, not_from_site_id, timeout)
+            )
+            if response.has_changes:
+                on_changes()
+            since_version = response.version
+
+    def read_changes(self, r: requests.Response) -> Changes:
+        # read the body as sent, to account for its compressed size
+        return decode_changes_body(
+            r.raw.read(self.max_response_size + 1, decode_content=False),
+            r.headers.get("Content-Type"),
+            r.headers.get("Content-Encoding"),
+            self.transfer_stats,
+            self.max_response_size,
+        )
+
+    def post_changes(
+        self,
+        path: str,
+        changes: Changes,
+        params: dict | None = None,
+        headers: dict[str, str] | None = None,
+    ) -> requests.Response:
+        # streamed response, to be closed by the caller
+        body, body_headers = self.changes_body(changes)
+        r = self.session.post(
+            self.syncstore_server + path,
+            params=params,
+            data=body,
+            headers=body_headers | (headers or {}),
+            stream=True,
+            timeout=self.timeout,
+        )
+        if r.status_code == 415 and self.changes_mimetype == BINARY_CHANGES_MIMETYPE:
+            # server without support for the binary format: json from now on
+            r.close()
+            self.changes_mimetype = JSON_MIMETYPE
+            return self.post_changes(path, changes, params, headers)
+        return r
+
+    def changes_body(self, changes: Changes) -> tuple[bytes, dict[str, str]]:
+        return encode_changes_body(
+            changes,
+            self.changes_mimetype,
+            self.compression,
+            self.compression_threshold,
+            self.transfer_stats,
         )
-        assert r.status_code == 204
 
     def sync(self) -> SyncResult:
+        # a proxy has no local data to sync, the local store drives the sync via exchange_changes
         raise NotImplementedError()
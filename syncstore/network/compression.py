@@ -0,0 +1,62 @@
+import gzip
+import zlib
+
+# http content-encodings for change payloads, in order of preference
+SUPPORTED_ENCODINGS = ["gzip", "deflate"]
+
+IDENTITY = "identity"
+# zlib window bits of the encodings ("deflate" in http means the zlib format)
+WBITS = {"gzip": 16 + zlib.MAX_WBITS, "deflate": zlib.MAX_WBITS}
+
+
+class UnsupportedEncodingError(Exception):
+    pass
+
+
+class DecompressionError(Exception):
+    pass
+
+
+class PayloadTooLargeError(Exception):
+    pass
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=6)
+    if encoding == "deflate":
+        return zlib.compress(data, level=6)  # "deflate" in http means the zlib format
+    raise UnsupportedEncodingError(encoding)
+
+
+def decompress(data: bytes, encoding: str | None, max_size: int | None = None) -> bytes:
+    # max_size: of the decompressed data, a small payload may inflate to gigabytes
+    if not encoding or encoding == IDENTITY:
+        output = data
+    elif encoding in WBITS:
+        output = inflate(data, encoding, max_size)
+    else:
+        raise UnsupportedEncodingError(encoding)
+    if max_size is not None and len(output) > max_size:
+        raise PayloadTooLargeError(f"payload exceeds {max_size} bytes")
+    return output
+
+
+def inflate(data: bytes, encoding: str, max_size: int | None) -> bytes:
+    # incrementally, stops once max_size is exceeded
+    output = bytearray()
+    try:
+        while True:
+            decompressor = zlib.decompressobj(WBITS[encoding])
+            # one byte more than allowed tells that the limit is exceeded
+            max_length = 0 if max_size is None else max_size + 1 - len(output)
+            output += decompressor.decompress(data, max_length)
+            if max_size is not None and len(output) > max_size:
+                return bytes(output)
+            if not decompressor.eof:
+                raise DecompressionError(f"truncated {encoding} payload")
+            data = decompressor.unused_data
+            if encoding != "gzip" or not data:  # gzip: may consist of several members
+                return bytes(output)
+    except zlib.error as e:
+        raise DecompressionError(f"corrupt {encoding} payload") from e
@@ -0,0 +1,33 @@
+import pytest
+
+from syncstore.network.compression import (
+    SUPPORTED_ENCODINGS,
+    DecompressionError,
+    PayloadTooLargeError,
+    compress,
+    decompress,
+)
+
+
+@pytest.mark.parametrize("encoding", SUPPORTED_ENCODINGS)
+def test_decompress_limits_size(encoding: str):
+    data = b"x" * 100
+    assert decompress(compress(data, encoding), encoding, max_size=100) == data
+    with pytest.raises(PayloadTooLargeError):
+        decompress(compress(data, encoding), encoding, max_size=99)
+
+    # a few kilobytes inflating to 64 MiB, stopped right after the limit
+    bomb = compress(b"\0" * 64 * 1024 * 1024, encoding)
+    assert len(bomb) < 100 * 1024
+    with pytest.raises(PayloadTooLargeError):
+        decompress(bomb, encoding, max_size=1024 * 1024)
+
+    with pytest.raises(DecompressionError):
+        decompress(compress(data, encoding)[:-4], encoding)
+
+
+def test_decompress_concatenated_gzip_members():
+    data = compress(b"abc", "gzip") + compress(b"def", "gzip")
+    assert decompress(data, "gzip") == b"abcdef"
+    with pytest.raises(PayloadTooLargeError):
+        decompress(data, "gzip", max_size=5)
@@ -0,0 +1,109 @@
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from threading import Lock
+
+# request latency and change throughput of the sync server, per endpoint,
+# rendered in the prometheus text exposition format (GET /metrics)
+
+METRICS_MIMETYPE = "text/plain; version=0.0.4; charset=utf-8"
+# seconds, upper bounds of the latency histogram buckets (+Inf is implicit)
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+@dataclass
+class Histogram:
+    bucket_counts: list[int] = field(
+        default_factory=lambda: [0] * (len(DURATION_BUCKETS) + 1)
+    )
+    count: int = 0
+    sum: float = 0.0
+
+    def observe(self, value: float) -> None:
+        self.bucket_counts[bisect_left(DURATION_BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+def format_labels(labels: dict[str, str]) -> str:
+    escaped = (
+        (k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in labels.items()
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+@dataclass
+class ServerMetrics:
+    # request durations, by endpoint
+    durations: dict[str, Histogram] = field(default_factory=dict, init=False)
+    # counters, by (endpoint, status) / (endpoint, direction)
+    n_requests: dict[tuple[str, str], int] = field(default_factory=dict, init=False)
+    n_changes: dict[tuple[str, str], int] = field(default_factory=dict, init=False)
+    n_bytes: dict[tuple[str, str], int] = field(default_factory=dict, init=False)
+    lock: Lock = field(default_factory=Lock, init=False, repr=False, compare=False)
+
+    def observe_request(self, endpoint: str, status: int, duration: float) -> None:
+        with self.lock:
+            self.durations.setdefault(endpoint, Histogram()).observe(duration)
+            key = (endpoint, str(status))
+            self.n_requests[key] = self.n_requests.get(key, 0) + 1
+
+    def count_changes(self, endpoint: str, direction: str, n: int) -> None:
+        # direction: received (pushed by clients) or sent (pulled by clients)
+        with self.lock:
+            key = (endpoint, direction)
+            self.n_changes[key] = self.n_changes.get(key, 0) + n
+
+    def count_bytes(self, endpoint: str, direction: str, n: int) -> None:
+        # as transferred, i.e. after compression
+        with self.lock:
+            key = (endpoint, direction)
+            self.n_bytes[key] = self.n_bytes.get(key, 0) + n
+
+    def render(self, gauges: dict[str, tuple[str, float]] | None = None) -> str:
+        # gauges: additional name -> (help, value), e.g. of the changes cache
+        lines: list[str] = []
+
+        def counter(name: str, help: str, values: dict, label_names: tuple) -> None:
+            lines.extend([f"# HELP {name} {help}", f"# TYPE {name} counter"])
+            for key, value in sorted(values.items()):
+                lines.append(
+                    f"{name}{format_labels(dict(zip(label_names, key)))} {value}"
+                )
+
+        with self.lock:
+            name = "syncstore_request_duration_seconds"
+            lines.append(f"# HELP {name} Duration of handling a request.")
+            lines.append(f"# TYPE {name} histogram")
+            for endpoint, histogram in sorted(self.durations.items()):
+                cumulative = 0
+                bounds = [str(b) for b in DURATION_BUCKETS] + ["+Inf"]
+                for bound, n in zip(bounds, histogram.bucket_counts):
+                    cumulative += n
+                    labels = format_labels({"endpoint": endpoint, "le": bound})
+                    lines.append(f"{name}_bucket{labels} {cumulative}")
+                labels = format_labels({"endpoint": endpoint})
+                lines.append(f"{name}_sum{labels} {histogram.sum}")
+                lines.append(f"{name}_count{labels} {histogram.count}")
+            counter(
+                "syncstore_requests_total",
+                "Handled requests.",
+                self.n_requests,
+                ("endpoint", "status"),
+            )
+            counter(
+                "syncstore_changes_total",
+                "Changes received from and sent to clients.",
+                self.n_changes,
+                ("endpoint", "direction"),
+            )
+            counter(
+                "syncstore_bytes_total",
+                "Request and response body bytes, as transferred.",
+                self.n_bytes,
+                ("endpoint", "direction"),
+            )
+        for name, (help, value) in (gauges or {}).items():
+            lines.extend([f"# HELP {name} {help}", f"# TYPE {name} gauge"])
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
@@ -1,15 +1,45 @@
-from dataclasses import dataclass
-from typing import Callable
+import json
+import selectors
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from threading import BoundedSemaphore, Lock, Thread
+from typing import Callable, Iterable
 
-from apiflask import APIFlask
-from marshmallow import Schema
+from apiflask import APIFlask, abort
+from flask import Request, Response, g, request
+from marshmallow import Schema, ValidationError, fields
 from marshmallow_dataclass import class_schema
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
 
+from syncstore.network.changes_cache import (
+    ChangesCache,
+    ChangesCacheStats,
+    changes_cache_key,
+)
+from syncstore.network.changes_codec import (
+    BINARY_CHANGES_MIMETYPE,
+    ChangesDecodeError,
+    decode_changes,
+    encode_changes,
+)
+from syncstore.network.compression import (
+    SUPPORTED_ENCODINGS,
+    DecompressionError,
+    PayloadTooLargeError,
+    UnsupportedEncodingError,
+    compress,
+    decompress,
+)
+from syncstore.network.server_metrics import METRICS_MIMETYPE, ServerMetrics
+from syncstore.network.tenant_pool import InvalidTenantKeyError, Tenant, TenantPool
 from syncstore.versioned_changes_syncstore import (
     Changes,
     ChangesQuery,
     Tables,
     VersionedChangesSyncStore,
+    VersionVector,
 )
 
 
@@ -31,33 +61,392 @@ class SiteInfo:
     site_id: str
 
 
+@dataclass
+class VersionVectorInfo:
+    version_vector: VersionVector | None
+
+
+@dataclass
+class SyncQuery(ChangesQuery):
+    # query params of POST /sync: the pull, and the version after which the pushed changes (body) start
+    pushed_since_version: int = -1
+
+
+@dataclass
+class PushQuery:
+    # query params of POST /push: version after which the pushed changes (body) start
+    pushed_since_version: int = -1
+
+
+@dataclass
+class WatchQuery:
+    # query params of GET /watch: wait until there are changes after since_version
+    since_version: int = -1
+    not_from_site_id: str | None = None  # e.g. the watcher's own changes, pushed by it
+    timeout: float = 30.0  # seconds, capped by the server
+
+
+@dataclass
+class WatchResponse:
+    version: int  # current version of the store, the since_version of the next watch
+    has_changes: bool  # False on timeout
+
+
+def format_version_vector(version_vector: VersionVector) -> str:
+    # compact form for query params and headers: site_id:version,...
+    return ",".join(f"{s}:{v}" for s, v in version_vector.items())
+
+
+def parse_version_vector(value: str) -> VersionVector:
+    return {s: int(v) for s, v in (e.split(":") for e in value.split(",") if e)}
+
+
+class VersionVectorField(fields.Field):
+    # version vector as a single query param
+    def _serialize(self, value, attr, obj, **kwargs) -> str | None:
+        return None if value is None else format_version_vector(value)
+
+    def _deserialize(self, value, attr, data, **kwargs) -> VersionVector:
+        try:
+            return parse_version_vector(value)
+        except (ValueError, AttributeError) as e:
+            raise ValidationError("expected site_id:version pairs") from e
+
+
+class ChangesQuerySchema(class_schema(ChangesQuery)):  # type: ignore
+    version_vector = VersionVectorField(allow_none=True, load_default=None)
+
+
+class SyncQuerySchema(class_schema(SyncQuery)):  # type: ignore
+    version_vector = VersionVectorField(allow_none=True, load_default=None)
+
+
 changes_schema: Schema = class_schema(Changes)()
-changes_query_schema: Schema = class_schema(ChangesQuery)()
+changes_query_schema: Schema = ChangesQuerySchema()
 tables_schema: Schema = class_schema(Tables)()
 last_received_version_request_schema = class_schema(LastReceivedVersionRequest)()
 last_received_version_response_schema = class_schema(LastReceivedVersionResponse)()
 site_info_schema: Schema = class_schema(SiteInfo)()
+sync_query_schema: Schema = SyncQuerySchema()
+version_vector_info_schema: Schema = class_schema(VersionVectorInfo)()
+changes_cache_stats_schema: Schema = class_schema(ChangesCacheStats)()
+push_query_schema: Schema = class_schema(PushQuery)()
+watch_query_schema: Schema = class_schema(WatchQuery)()
+watch_response_schema: Schema = class_schema(WatchResponse)()
+
+JSON_MIMETYPE = "application/json"
+TENANT_PATH_PREFIX = "/tenants/"
+TENANT_ENVIRON_KEY = "syncstore.tenant"
+LAST_RECEIVED_VERSION_HEADER = "X-Last-Received-Version"
+VERSION_VECTOR_HEADER = "X-Version-Vector"
+
+COMPRESSED_ENDPOINTS = {"get_changes", "sync"}
+# endpoints which (may) write to the database, handled one at a time
+# (the last received version is inserted on the first request of a new peer)
+WRITE_ENDPOINTS = {
+    "setup_table_change_tracking",
+    "get_last_received_version",
+    "sync",
+    "push_changes",
+    "apply_changes",
+}
+
+
+def accepts_binary_changes(req: Request) -> bool:
+    # json unless binary is explicitly preferred
+    return (
+        req.accept_mimetypes.best_match([JSON_MIMETYPE, BINARY_CHANGES_MIMETYPE])
+        == BINARY_CHANGES_MIMETYPE
+    )
+
+
+def load_changes(req: Request) -> Changes:
+    # the size limit of the body (MAX_CONTENT_LENGTH) also applies after decompressing it
+    try:
+        data = decompress(
+            req.get_data(), req.content_encoding, max_size=req.max_content_length
+        )
+    except UnsupportedEncodingError as e:
+        abort(415, f"unsupported Content-Encoding: {e}")
+    except PayloadTooLargeError as e:
+        abort(413, str(e))
+    except DecompressionError as e:
+        abort(400, str(e))
+    if req.mimetype == BINARY_CHANGES_MIMETYPE:
+        try:
+            return decode_changes(data)
+        except ChangesDecodeError as e:
+            abort(400, str(e))
+    if req.mimetype == JSON_MIMETYPE:
+        try:
+            return changes_schema.load(json.loads(data))  # type: ignore
+        except json.JSONDecodeError as e:
+            abort(400, f"invalid json: {e}")
+        except ValidationError as e:
+            abort(422, "Validation error", detail={"json": e.messages})
+    abort(415, f"expected {JSON_MIMETYPE} or {BINARY_CHANGES_MIMETYPE}")
+
+
+class TenantPathMiddleware:
+    # /tenants/<key>/<path> is served as /<path> of the tenant with that key,
+    # so that the routes (and their endpoint names) are the same for all tenants
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    def __call__(self, environ: dict, start_response: Callable) -> Iterable[bytes]:
+        path: str = environ.get("PATH_INFO", "")
+        if path.startswith(TENANT_PATH_PREFIX):
+            key, _, rest = path[len(TENANT_PATH_PREFIX) :].partition("/")
+            environ[TENANT_ENVIRON_KEY] = key
+            environ["SCRIPT_NAME"] = (
+                environ.get("SCRIPT_NAME", "") + TENANT_PATH_PREFIX + key
+            )
+            environ["PATH_INFO"] = "/" + rest
+        return self.app(environ, start_response)
+
+
+class KeepAliveRequestHandler(WSGIRequestHandler):
+    # http/1.1 keeps connections open, so that clients can reuse them across requests
+    protocol_version = "HTTP/1.1"
+
+
+class SingleRequestHandler(KeepAliveRequestHandler):
+    # handles one request only, a kept-alive connection is then handed back to the server,
+    # so that idle connections do not occupy a worker (clients must not pipeline requests)
+    timeout = 30  # seconds, for reading a request which has started to arrive
+
+    def handle(self) -> None:
+        self.close_connection = True
+        try:
+            self.handle_one_request()
+        except (ConnectionError, socket.timeout) as e:
+            self.connection_dropped(e)
+            self.close_connection = True
+
+
+class WorkerPoolWSGIServer(BaseWSGIServer):
+    # requests are handled by a fixed pool of worker threads,
+    # instead of a new thread per connection (werkzeug's threaded=True);
+    # between requests, kept-alive connections wait in a selector until readable
+
+    multithread = True
+
+    def __init__(
+        self, host: str, port: int, app, workers: int, keep_alive_timeout: float = 10
+    ) -> None:
+        super().__init__(host, port, app, handler=SingleRequestHandler)
+        self.keep_alive_timeout = keep_alive_timeout  # seconds
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="syncstore-worker"
+        )
+        self.idle_connections = selectors.DefaultSelector()
+        self.idle_connections_lock = Lock()
+        self.closed = False
+        Thread(target=self.poll_idle_connections, daemon=True).start()
+
+    def process_request(self, request, client_address) -> None:
+        self.executor.submit(self.handle_connection, request, client_address)
+
+    def handle_connection(self, request, client_address) -> None:
+        try:
+            handler = SingleRequestHandler(request, client_address, self)
+            keep_alive = not handler.close_connection
+        except Exception:
+            self.handle_error(request, client_address)
+            keep_alive = False
+        if not keep_alive or self.closed:
+            self.shutdown_request(request)
+            return
+        with self.idle_connections_lock:
+            self.idle_connections.register(
+                request, selectors.EVENT_READ, (client_address, time.monotonic())
+            )
+
+    def poll_idle_connections(self) -> None:
+        while not self.closed:
+            for key, _ in self.idle_connections.select(timeout=0.5):
+                with self.idle_connections_lock:
+                    self.idle_connections.unregister(key.fileobj)
+                client_address, _ = key.data
+                self.executor.submit(
+                    self.handle_connection, key.fileobj, client_address
+                )
+            expired_before = time.monotonic() - self.keep_alive_timeout
+            with self.idle_connections_lock:
+                for key in list(self.idle_connections.get_map().values()):
+                    if key.data[1] < expired_before:
+                        self.idle_connections.unregister(key.fileobj)
+                        self.shutdown_request(key.fileobj)  # type: ignore
+
+    def server_close(self) -> None:
+        self.closed = True
+        super().server_close()
+        self.executor.shutdown(wait=False, cancel_futures=True)
 
 
 def run_sync_store_server(
-    syncstore: VersionedChangesSyncStore, host: str, port: int, debug=False
+    syncstore: VersionedChangesSyncStore | TenantPool,
+    host: str,
+    port: int,
+    debug=False,
+    max_changes_page_size: int = 10_000,
+    compression_threshold: int = 1024,
+    workers: int | None = None,
+    changes_cache_size: int = 64 * 1024 * 1024,
+    max_watchers: int | None = None,
+    max_watch_timeout: float = 60.0,
+    watch_poll_interval: float = 1.0,
+    max_request_size: int = 64 * 1024 * 1024,
 ):
+    # workers=None: werkzeug development server (a thread per connection),
+    # otherwise connections are served by a pool of that many worker threads
+    # changes_cache_size: byte budget for encoded change sets, 0 disables the cache
+    # max_watchers: concurrent long-polls (GET /watch), each one occupies a worker;
+    # by default half of the workers (at least one), so that the writes waking them up can
+    # still be served
+    # watch_poll_interval: seconds, to also notice writes which bypass the server
+    # max_request_size: bytes of a request body, also after decompressing it (413 beyond)
+    # syncstore: a TenantPool serves a store per tenant, at /tenants/<key>/...
+    # (changes_cache_size is then given per tenant by the pool)
     app = APIFlask(syncstore.name)
+    app.config["MAX_CONTENT_LENGTH"] = max_request_size
+    app.wsgi_app = TenantPathMiddleware(app.wsgi_app)  # type: ignore
+    tenant_pool = syncstore if isinstance(syncstore, TenantPool) else None
+    single_tenant = None
+    if isinstance(syncstore, VersionedChangesSyncStore):
+        single_tenant = Tenant("", syncstore, ChangesCache(changes_cache_size))
+    metrics = ServerMetrics()
+    if max_watchers is None:
+        max_watchers = 64 if workers is None else max(1, workers // 2)
+    watcher_slots = BoundedSemaphore(max_watchers) if max_watchers > 0 else None
+
+    def current_tenant() -> Tenant:
+        # acquired from the pool on first use within a request, released on teardown
+        if single_tenant is not None:
+            if request.environ.get(TENANT_ENVIRON_KEY) is not None:
+                abort(404, "tenants are not supported")
+            return single_tenant
+        assert tenant_pool is not None
+        tenant = g.get("tenant")
+        if tenant is None:
+            key = request.environ.get(TENANT_ENVIRON_KEY)
+            if key is None:
+                abort(404, f"expected {TENANT_PATH_PREFIX}<key>/...")
+            try:
+                tenant = g.tenant = tenant_pool.acquire(key)
+            except InvalidTenantKeyError as e:
+                abort(400, str(e))
+        return tenant
+
+    @app.before_request
+    def start_timer() -> None:
+        g.request_start = time.perf_counter()
+
+    # readers run concurrently (each on a connection of the engine's pool),
+    # writers of a tenant are serialized, so that they do not fail with "database is locked"
+    @app.before_request
+    def acquire_write_lock() -> None:
+        if request.endpoint in WRITE_ENDPOINTS:
+            tenant = current_tenant()
+            tenant.write_lock.acquire()
+            g.write_locked_tenant = tenant
+
+    @app.teardown_request
+    def release_tenant(exc: BaseException | None) -> None:
+        # registered before release_write_lock, so run after it
+        tenant = g.pop("tenant", None)
+        if tenant is not None and tenant_pool is not None:
+            tenant_pool.release(tenant)
+
+    @app.teardown_request
+    def release_write_lock(exc: BaseException | None) -> None:
+        tenant = g.pop("write_locked_tenant", None)
+        if tenant is not None:
+            tenant.write_lock.release()
+            tenant.change_notifier.notify()
+
+    def limit_page_size(changes_query: ChangesQuery) -> ChangesQuery:
+        # responses are always paginated, clients follow has_more
+        limit = min(changes_query.limit or max_changes_page_size, max_changes_page_size)
+        return replace(changes_query, limit=limit)
+
+    def encoded_changes(changes_query: ChangesQuery) -> tuple[bytes, str]:
+        # clients pulling the same range get the same bytes, until the store's version moves
+        mimetype = (
+            BINARY_CHANGES_MIMETYPE
+            if accepts_binary_changes(request)
+            else JSON_MIMETYPE
+        )
+        key = changes_cache_key(mimetype, changes_query)
+        syncstore = current_tenant().syncstore
+        changes_cache = current_tenant().changes_cache
+        version = None
+        if changes_cache.max_bytes > 0:
+            version = syncstore.get_current_version()
+        if version is not None:
+            entry = changes_cache.get(version, key)
+            if entry is not None:
+                data, n_changes = entry
+                metrics.count_changes(request.endpoint or "", "sent", n_changes)
+                return data, mimetype
+        changes = syncstore.get_changes(changes_query)
+        if mimetype == BINARY_CHANGES_MIMETYPE:
+            data = encode_changes(changes)
+        else:
+            data = app.json.dumps(changes_schema.dump(changes)).encode()
+        n_changes = len(changes.changes)
+        if version is not None:
+            changes_cache.put(version, key, data, n_changes)
+        metrics.count_changes(request.endpoint or "", "sent", n_changes)
+        return data, mimetype
+
+    def received_changes() -> Changes:
+        changes = load_changes(request)
+        metrics.count_changes(request.endpoint or "", "received", len(changes.changes))
+        return changes
+
+    @app.after_request
+    def observe_request(response: Response) -> Response:
+        # registered before compress_changes, so run after it: bytes as transferred
+        endpoint = request.endpoint or "unknown"
+        duration = time.perf_counter() - g.get("request_start", time.perf_counter())
+        metrics.observe_request(endpoint, response.status_code, duration)
+        if request.content_length:
+            metrics.count_bytes(endpoint, "received", request.content_length)
+        if response.content_length:
+            metrics.count_bytes(endpoint, "sent", response.content_length)
+        return response
+
+    @app.after_request
+    def compress_changes(response: Response) -> Response:
+        # only change payloads are compressed, and only if large enough to be worth it
+        if request.endpoint not in COMPRESSED_ENDPOINTS or response.status_code != 200:
+            return response
+        encoding = request.accept_encodings.best_match(SUPPORTED_ENCODINGS)
+        if encoding is None or response.content_length is None:
+            return response
+        if response.content_length < compression_threshold:
+            return response
+        response.set_data(compress(response.get_data(), encoding))
+        response.headers["Content-Encoding"] = encoding
+        response.vary.add("Accept-Encoding")
+        return response
 
     @app.get("/")
     def index() -> str:
-        return f"syncstore: {syncstore.name}"
+        return f"syncstore: {app.name}"
 
     @app.post("/setup-table-change-tracking")
     @app.input(tables_schema, arg_name="tables")  # type: ignore
     @app.output({}, status_code=204)
     def setup_table_change_tracking(tables: Tables) -> None:
-        syncstore.setup_table_change_tracking(tables)
+        current_tenant().syncstore.setup_table_change_tracking(tables)
 
     @app.get("/site-id")
     @app.output(site_info_schema)  # type: ignore
     def get_site_id() -> SiteInfo:
-        return SiteInfo(syncstore.get_site_id())
+        return SiteInfo(current_tenant().syncstore.get_site_id())
 
     @app.get("/last-received-version")
     @app.input(last_received_version_request_schema, location="query")  # type: ignore
@@ -65,33 +454,180 @@ def run_sync_store_server(
     def get_last_received_version(
         query_data: LastReceivedVersionRequest,
     ) -> LastReceivedVersionResponse:
+        syncstore = current_tenant().syncstore
         v = syncstore.get_last_received_version(query_data.from_site_id)
         return LastReceivedVersionResponse(v)
 
+    @app.get("/version-vector")
+    @app.output(version_vector_info_schema)  # type: ignore
+    def get_version_vector() -> VersionVectorInfo:
+        return VersionVectorInfo(current_tenant().syncstore.get_version_vector())
+
     @app.get("/changes")
     @app.input(changes_query_schema, location="query")  # type: ignore
     @app.output(changes_schema, status_code=200)  # type: ignore
-    def get_changes(query_data: ChangesQuery) -> Changes:  # tbd: compress
-        changes = syncstore.get_changes(query_data)
-        return changes
+    def get_changes(query_data: ChangesQuery) -> Response:
+        data, mimetype = encoded_changes(limit_page_size(query_data))
+        return Response(data, mimetype=mimetype)
+
+    def version_headers(last_received_version: int) -> dict[str, str]:
+        headers = {LAST_RECEIVED_VERSION_HEADER: str(last_received_version)}
+        version_vector = current_tenant().syncstore.get_version_vector()
+        if version_vector is not None:
+            headers[VERSION_VECTOR_HEADER] = format_version_vector(version_vector)
+        return headers
+
+    @app.post("/sync")
+    @app.input(sync_query_schema, location="query")  # type: ignore
+    @app.output(changes_schema, status_code=200)  # type: ignore
+    def sync(query_data: SyncQuery) -> Response:
+        # single round trip: body holds the pushed changes, response the pulled ones (first page)
+        # (see VersionedChangesSyncStore.exchange_changes, with the pull served from the cache)
+        syncstore = current_tenant().syncstore
+        pushed_changes = received_changes()
+        data, mimetype = encoded_changes(limit_page_size(query_data))
+        last_received_version = syncstore.receive_changes(
+            pushed_changes, query_data.pushed_since_version
+        )
+        return Response(
+            data, mimetype=mimetype, headers=version_headers(last_received_version)
+        )
+
+    @app.post("/push")
+    @app.input(push_query_schema, location="query")  # type: ignore
+    @app.output({}, status_code=204)
+    def push_changes(query_data: PushQuery) -> Response:
+        # a chunk of a large push, applied and acknowledged on its own (see sync_steps),
+        # the versions after applying it are returned as headers, as by POST /sync
+        last_received_version = current_tenant().syncstore.receive_changes(
+            received_changes(), query_data.pushed_since_version
+        )
+        return Response(status=204, headers=version_headers(last_received_version))
+
+    @app.get("/watch")
+    @app.input(watch_query_schema, location="query")  # type: ignore
+    @app.output(watch_response_schema)  # type: ignore
+    def watch(query_data: WatchQuery) -> WatchResponse:
+        # long-poll: returns as soon as there are changes after since_version, or on timeout
+        if watcher_slots is None or not watcher_slots.acquire(blocking=False):
+            abort(429, "too many watchers", headers={"Retry-After": "1"})
+        try:
+            return wait_for_changes(current_tenant(), query_data)
+        finally:
+            watcher_slots.release()
+
+    def wait_for_changes(tenant: Tenant, query: WatchQuery) -> WatchResponse:
+        syncstore, change_notifier = tenant.syncstore, tenant.change_notifier
+        deadline = time.monotonic() + min(query.timeout, max_watch_timeout)
+        since_version = query.since_version
+        while True:
+            n_writes = change_notifier.n_writes  # before reading, to not miss a write
+            version = syncstore.get_current_version()
+            if version is None:
+                abort(501, "store does not expose its version")
+            if version > since_version:
+                if query.not_from_site_id is None or syncstore.has_changes(
+                    ChangesQuery(since_version, not_from_site_id=query.not_from_site_id)
+                ):
+                    return WatchResponse(version, True)
+                since_version = version  # only changes of the watcher itself
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return WatchResponse(version, False)
+            change_notifier.wait(n_writes, min(remaining, watch_poll_interval))
+
+    @app.get("/changes-cache-stats")
+    @app.output(changes_cache_stats_schema)  # type: ignore
+    def get_changes_cache_stats() -> ChangesCacheStats:
+        changes_cache = current_tenant().changes_cache
+        with changes_cache.lock:
+            return replace(changes_cache.stats)
+
+    @app.get("/metrics")
+    @app.doc(hide=True)
+    def get_metrics() -> Response:
+        # changes cache stats: summed over the open tenants
+        if tenant_pool is not None:
+            tenants = tenant_pool.open_tenants()
+        else:
+            assert single_tenant is not None
+            tenants = [single_tenant]
+        cache_stats = ChangesCacheStats()
+        for tenant in tenants:
+            with tenant.changes_cache.lock:
+                stats = tenant.changes_cache.stats
+                cache_stats.n_hits += stats.n_hits
+                cache_stats.n_misses += stats.n_misses
+                cache_stats.n_entries += stats.n_entries
+                cache_stats.n_bytes += stats.n_bytes
+        gauges = {
+            "syncstore_changes_cache_entries": (
+                "Encoded change sets in the cache.",
+                cache_stats.n_entries,
+            ),
+            "syncstore_changes_cache_bytes": (
+                "Size of the cached change sets.",
+                cache_stats.n_bytes,
+            ),
+            "syncstore_changes_cache_hit_ratio": (
+                "Cache hits per lookup, since the start of the server.",
+                cache_stats.n_hits / max(1, cache_stats.n_hits + cache_stats.n_misses),
+            ),
+            "syncstore_watchers_max": ("Allowed concurrent watchers.", max_watchers),
+        }
+        if tenant_pool is not None:
+            gauges["syncstore_open_tenants"] = (
+                "Tenants with an open store.",
+                len(tenants),
+            )
+            gauges["syncstore_closed_tenants"] = (
+                "Tenant stores closed since the start of the server.",
+                tenant_pool.n_closed,
+            )
+        return Response(metrics.render(gauges), content_type=METRICS_MIMETYPE)
 
     @app.post("/changes")
-    @app.input(changes_schema, arg_name="changes")  # type: ignore
     @app.output({}, status_code=204)
-    def apply_changes(changes: Changes) -> None:
-        syncstore.apply_changes(changes)
+    def apply_changes() -> None:
+        # body is either json (changes_schema) or binary, depending on the Content-Type
+        current_tenant().syncstore.apply_changes(received_changes())
+
+    if tenant_pool is not None:
+        tenant_pool.start()
+    try:
+        if workers is not None:
+            server = WorkerPoolWSGIServer(host, port, app, workers)
+            try:
+                server.serve_forever()
+            finally:
+                server.server_close()
+            return
 
-    app.run(host, port, debug=debug, threaded=False, use_reloader=False)
-    # reloader can lead to running the same test debug session multiple times
+        app.run(
+            host,
+            port,
+            debug=debug,
+            threaded=True,
+            use_reloader=False,
+            request_handler=KeepAliveRequestHandler,
+        )
+        # reloader can lead to running the same test debug session multiple times
+    finally:
+        if tenant_pool is not None:
+            tenant_pool.close()
 
 
 def run_sync_store_server_callable(
-    syncstore_provider: Callable[[], VersionedChangesSyncStore],
+    syncstore_provider: Callable[[], VersionedChangesSyncStore | TenantPool],
     host: str,
     port: int,
     debug=False,
+    **server_options,
 ) -> Callable:
+    # server_options: see run_sync_store_server
     def run():
-        run_sync_store_server(syncstore_provider(), host, port, debug=debug)
+        run_sync_store_server(
+            syncstore_provider(), host, port, debug=debug, **server_options
+        )
 
     return run
@@ -0,0 +1,182 @@
+import logging
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from threading import Condition, Lock, Thread
+from typing import Callable
+
+from syncstore.network.change_notifier import ChangeNotifier
+from syncstore.network.changes_cache import ChangesCache
+from syncstore.versioned_changes_syncstore import VersionedChangesSyncStore
+
+logger = logging.getLogger(__name__)
+
+# stores of the tenants (e.g. teams or workspaces) served by one sync server,
+# each one in its own database (shard), opened on demand and closed when idle
+
+TENANT_KEY_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")  # also safe as a file name
+
+
+class InvalidTenantKeyError(ValueError):
+    pass
+
+
+@dataclass
+class Tenant:
+    # a store and the server state belonging to it
+    key: str
+    syncstore: VersionedChangesSyncStore
+    changes_cache: ChangesCache
+    change_notifier: ChangeNotifier = field(default_factory=ChangeNotifier)
+    # writers of a tenant are serialized, writers of different tenants are not
+    write_lock: Lock = field(default_factory=Lock, repr=False, compare=False)
+    n_active_requests: int = 0
+    last_used: float = field(default_factory=time.monotonic)
+
+
+@dataclass
+class TenantPool:
+    # least recently used tenants are closed once more than max_open are open,
+    # and tenants are closed after idle_timeout seconds without requests
+    # (closing a crsqlite store runs crsql_finalize on its connections);
+    # tenants with requests in flight are never closed, the pool may exceed max_open meanwhile
+    name: str
+    store_provider: Callable[[str], VersionedChangesSyncStore]  # tenant key -> store
+    max_open: int = 16
+    idle_timeout: float = 300.0
+    changes_cache_size: int = (
+        4 * 1024 * 1024
+    )  # byte budget per tenant, see ChangesCache
+    tenants: OrderedDict[str, Tenant] = field(
+        default_factory=OrderedDict, init=False, repr=False
+    )
+    n_opened: int = field(default=0, init=False)
+    n_closed: int = field(default=0, init=False)
+    # keys of the tenants being opened: a store is opened (e.g. setting up change tracking)
+    # without the condition held, concurrent first requests of the tenant wait for it
+    opening: set[str] = field(default_factory=set, init=False, repr=False)
+    condition: Condition = field(
+        default_factory=Condition, init=False, repr=False, compare=False
+    )
+    closed: bool = field(default=False, init=False)
+
+    def start(self) -> None:
+        # closes idle tenants in the background
+        Thread(target=self.run, name="tenant-pool", daemon=True).start()
+
+    def run(self) -> None:
+        with self.condition:
+            while not self.closed:
+                self.condition.wait(max(self.idle_timeout / 2, 0.1))
+                idle = self.pop_idle(time.monotonic() - self.idle_timeout)
+                if idle:
+                    self.condition.release()
+                    try:
+                        self.close_tenants(idle)
+                    finally:
+                        self.condition.acquire()
+
+    def acquire(self, key: str) -> Tenant:
+        # to be released after the request, see release
+        if not TENANT_KEY_PATTERN.fullmatch(key):
+            raise InvalidTenantKeyError(f"invalid tenant key: {key!r}")
+        with self.condition:
+            while key in self.opening:
+                # opened by a concurrent request (if that fails, this one tries again)
+                self.condition.wait()
+            if self.closed:
+                raise Exception(f"tenant pool {self.name} is closed")
+            tenant = self.tenants.get(key)
+            if tenant is None:
+                self.opening.add(key)
+            else:
+                evicted = self.start_request(tenant)
+        if tenant is None:
+            tenant, evicted = self.open(key)
+        self.close_tenants(evicted)
+        return tenant
+
+    def open(self, key: str) -> tuple[Tenant, list[Tenant]]:
+        # requests of other tenants go on meanwhile
+        try:
+            tenant = Tenant(
+                key, self.store_provider(key), ChangesCache(self.changes_cache_size)
+            )
+        except BaseException:
+            with self.condition:
+                self.opening.remove(key)
+                self.condition.notify_all()
+            raise
+        with self.condition:
+            self.opening.remove(key)
+            self.condition.notify_all()
+            closed = self.closed
+            if not closed:
+                self.tenants[key] = tenant
+                self.n_opened += 1
+                evicted = self.start_request(tenant)
+        if closed:
+            tenant.syncstore.close()
+            raise Exception(f"tenant pool {self.name} is closed")
+        logger.debug("tenant %s opened", key)
+        return tenant, evicted
+
+    def start_request(self, tenant: Tenant) -> list[Tenant]:
+        # to be called with the condition held, returns the tenants to close
+        self.tenants.move_to_end(tenant.key)
+        tenant.n_active_requests += 1
+        tenant.last_used = time.monotonic()
+        return self.pop_least_recently_used()
+
+    def release(self, tenant: Tenant) -> None:
+        with self.condition:
+            tenant.n_active_requests -= 1
+            tenant.last_used = time.monotonic()
+            evicted = self.pop_least_recently_used()
+        self.close_tenants(evicted)
+
+    def pop_least_recently_used(self) -> list[Tenant]:
+        # to be called with the condition held
+        n_excess = len(self.tenants) - self.max_open
+        evicted: list[Tenant] = []
+        for tenant in list(self.tenants.values()):
+            if n_excess <= len(evicted):
+                break
+            if tenant.n_active_requests == 0:
+                evicted.append(self.tenants.pop(tenant.key))
+        return evicted
+
+    def pop_idle(self, used_before: float) -> list[Tenant]:
+        # to be called with the condition held
+        idle = [
+            t
+            for t in self.tenants.values()
+            if t.n_active_requests == 0 and t.last_used < used_before
+        ]
+        for tenant in idle:
+            del self.tenants[tenant.key]
+        return idle
+
+    def close_tenants(self, tenants: list[Tenant]) -> None:
+        for tenant in tenants:
+            try:
+                tenant.syncstore.close()
+            except Exception:
+                logger.exception("closing tenant %s failed", tenant.key)
+            logger.debug("tenant %s closed", tenant.key)
+        if tenants:
+            with self.condition:
+                self.n_closed += len(tenants)
+
+    def open_tenants(self) -> list[Tenant]:
+        with self.condition:
+            return list(self.tenants.values())
+
+    def close(self) -> None:
+        with self.condition:
+            self.closed = True
+            tenants = list(self.tenants.values())
+            self.tenants.clear()
+            self.condition.notify_all()
+        self.close_tenants(tenants)
@@ -0,0 +1,121 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+
+import pytest
+
+from sqlite_setup import get_engine
+from syncstore.crsqlite_syncstore import CrSqliteSyncStore
+from syncstore.network.tenant_pool import InvalidTenantKeyError, TenantPool
+
+closed: list[str] = []
+
+
+class RecordingStore(CrSqliteSyncStore):
+    def close(self) -> None:
+        super().close()
+        closed.append(self.name)
+
+
+def tenant_store(key: str) -> CrSqliteSyncStore:
+    return RecordingStore(key, None, get_engine(f"./db/tenant_pool_test_{key}.db"))
+
+
+def create_pool(**options) -> TenantPool:
+    closed.clear()
+    return TenantPool("pool", tenant_store, **options)
+
+
+def test_least_recently_used_tenants_are_closed():
+    pool = create_pool(max_open=2)
+    a = pool.acquire("a")
+    assert pool.acquire("a") is a  # opened once
+    pool.release(a)
+    pool.release(a)
+    pool.release(pool.acquire("b"))
+    pool.release(pool.acquire("a"))  # b is now the least recently used
+    c = pool.acquire("c")
+    assert closed == ["b"]
+    assert [t.key for t in pool.open_tenants()] == ["a", "c"]
+
+    # tenants with requests in flight stay open, beyond max_open
+    a = pool.acquire("a")
+    d = pool.acquire("d")
+    assert closed == ["b"]
+    pool.release(c)
+    assert closed == ["b", "c"]
+    pool.release(a)
+    pool.release(d)
+    assert [t.key for t in pool.open_tenants()] == ["a", "d"]
+    assert (pool.n_opened, pool.n_closed) == (4, 2)
+
+    pool.close()
+    assert sorted(closed) == ["a", "b", "c", "d"]
+
+
+def test_idle_tenants_are_closed():
+    pool = create_pool(idle_timeout=0.2)
+    pool.start()
+    pool.release(pool.acquire("idle"))
+    busy = pool.acquire("busy")
+    for _ in range(50):
+        if closed:
+            break
+        time.sleep(0.05)
+    assert closed == ["idle"]
+    assert [t.key for t in pool.open_tenants()] == ["busy"]
+    pool.release(busy)
+    pool.close()
+
+
+def test_invalid_tenant_key():
+    pool = create_pool()
+    for key in ["", "../x", "a" * 65]:
+        with pytest.raises(InvalidTenantKeyError):
+            pool.acquire(key)
+
+
+def test_tenants_are_opened_without_blocking_others():
+    slow_opening, slow_opened = Event(), Event()
+    provided: list[str] = []
+
+    def provider(key: str) -> CrSqliteSyncStore:
+        provided.append(key)
+        if key == "slow":
+            slow_opening.set()
+            assert slow_opened.wait(5)
+        return tenant_store(key)
+
+    closed.clear()
+    pool = TenantPool("pool", provider)
+    with ThreadPoolExecutor(2) as executor:
+        slow = [executor.submit(pool.acquire, "slow") for _ in range(2)]
+        assert slow_opening.wait(5)
+        fast = pool.acquire("fast")  # while slow is being opened
+        assert not any(f.done() for f in slow)
+        slow_opened.set()
+        a, b = [f.result(5) for f in slow]
+    assert a is b and a.n_active_requests == 2
+    assert provided == ["slow", "fast"]  # opened once
+    for tenant in [a, b, fast]:
+        pool.release(tenant)
+    pool.close()
+
+
+def test_failed_opening_is_retried():
+    n_failures = [1]
+
+    def provider(key: str) -> CrSqliteSyncStore:
+        if n_failures[0]:
+            n_failures[0] -= 1
+            raise OSError("disk full")
+        return tenant_store(key)
+
+    closed.clear()
+    pool = TenantPool("pool", provider)
+    with pytest.raises(OSError):
+        pool.acquire("a")
+    pool.release(pool.acquire("a"))
+    assert pool.n_opened == 1 and not pool.opening
+    pool.close()
+    assert closed == ["a"]
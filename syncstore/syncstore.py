@@ -1,11 +1,65 @@
+import time
 from abc import ABCMeta, abstractmethod
-from dataclasses import dataclass
+from contextlib import contextmanager
+from dataclasses import dataclass, field, fields
+from typing import Iterator
+
+
+@dataclass
+class TransferStats:
+    # size of the change payloads on the wire (after compression) and before compression
+    n_bytes_sent: int = 0
+    n_bytes_sent_uncompressed: int = 0
+    n_bytes_received: int = 0
+    n_bytes_received_uncompressed: int = 0
+    n_round_trips: int = 0  # requests to the remote
+    # seconds spent on (de-)serializing and (de-)compressing change payloads
+    encode_duration: float = 0.0
+    decode_duration: float = 0.0
+
+    def __sub__(self, other: "TransferStats") -> "TransferStats":
+        return TransferStats(
+            **{
+                f.name: getattr(self, f.name) - getattr(other, f.name)
+                for f in fields(self)
+            }
+        )
+
+    def __add__(self, other: "TransferStats") -> "TransferStats":
+        return TransferStats(
+            **{
+                f.name: getattr(self, f.name) + getattr(other, f.name)
+                for f in fields(self)
+            }
+        )
 
 
 @dataclass
 class SyncResult:
     n_pulled_changes: int
     n_pushed_changes: int
+    transfer_stats: TransferStats = field(default_factory=TransferStats, compare=False)
+    # seconds per phase of the sync, see SyncPhases
+    phase_durations: dict[str, float] = field(default_factory=dict, compare=False)
+
+
+@dataclass
+class SyncPhases:
+    # accumulates the durations of the phases of a sync:
+    # local_state (site_id, versions), remote_lookup (site_id, versions of the remote),
+    # push_query (changes to push), exchange (push + first pull page, including the
+    # (de-)serialization, see TransferStats), repush, pull_pages (further pages), apply
+    durations: dict[str, float] = field(default_factory=dict)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations[name] = (
+                self.durations.get(name, 0.0) + time.perf_counter() - start
+            )
 
 
 @dataclass
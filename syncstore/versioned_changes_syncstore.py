@@ -1,8 +1,13 @@
 from abc import abstractmethod
-from dataclasses import dataclass
+from copy import copy
+from dataclasses import dataclass, field, replace
 from enum import Enum
+from typing import Any, Generator, Iterator, Protocol
 
-from .syncstore import SyncResult, SyncStore
+from .syncstore import SyncPhases, SyncResult, SyncStore, TransferStats
+
+# per origin site_id: version up to which the changes made by that site are known
+VersionVector = dict[str, int]
 
 
 class ValueType(Enum):
@@ -43,6 +48,8 @@ class Change:
     site_id: Value
     cl: int
     seq: int
+    # db_version of the change at its origin (site_id), None if unknown
+    origin_version: int | None = None
 
 
 @dataclass
@@ -50,6 +57,11 @@ class Changes:
     changes: list[Change]  # list of all changes
     version: int  # version at which these changes were created
     from_site_id: str  # site_id which created these changes
+    has_more: bool = False  # paginated query: more changes follow after the last one
+    # origin versions the receiver knows completely after applying these changes,
+    # provided it already knew since_version_vector (the version vector of the query)
+    version_vector: VersionVector | None = None
+    since_version_vector: VersionVector | None = None
 
 
 @dataclass
@@ -57,6 +69,67 @@ class ChangesQuery:
     since_version: int = -1
     from_site_id: str | None = None
     not_from_site_id: str | None = None
+    # keyset cursor: only changes after (since_version, since_seq), if set
+    since_seq: int | None = None
+    # max. number of changes per page (rows sharing the (db_version, seq) of the last change are never split)
+    limit: int | None = None
+    # only changes not known to the requester, of any origin (instead of the site_id params);
+    # the requester must already have all changes up to since_version (see get_vector_sync_versions)
+    version_vector: VersionVector | None = None
+
+    def next_page(self, changes: Changes) -> "ChangesQuery":
+        # query to resume after the last change of the given page
+        last = changes.changes[-1]
+        return replace(self, since_version=last.db_version, since_seq=last.seq)
+
+
+@dataclass
+class SyncRequest:
+    # push of the requester's changes and pull of the changes it has not received yet, at once
+    changes: Changes  # pushed changes
+    pushed_since_version: int  # version after which the pushed changes start
+    changes_query: ChangesQuery  # pulled changes
+
+
+@dataclass
+class SyncResponse:
+    changes: Changes  # pulled changes (first page, if paginated)
+    last_received_version: (
+        int  # version up to which the requester's changes were received
+    )
+    # of the remote, after receiving the pushed changes (None: version vectors not supported)
+    version_vector: VersionVector | None = None
+
+
+@dataclass
+class PushResponse:
+    # versions of the remote after applying pushed changes, see SyncResponse
+    last_received_version: int
+    version_vector: VersionVector | None = None
+
+
+@dataclass
+class SyncCall:
+    # a call of a sync to the local store or to the remote, see sync_steps
+    method: str
+    args: tuple = ()
+    remote: bool = False
+
+
+def local_call(method: str, *args) -> SyncCall:
+    return SyncCall(method, args)
+
+
+def remote_call(method: str, *args) -> SyncCall:
+    return SyncCall(method, args, remote=True)
+
+
+class SyncRemote(Protocol):
+    # what a sync accesses of its remote directly, besides the calls it makes:
+    # a VersionedChangesSyncStore, or e.g. an async http client
+    name: str
+    changes_page_size: int
+    transfer_stats: TransferStats
 
 
 @dataclass
@@ -72,6 +145,17 @@ class VersionedChangesSyncStore(SyncStore):
     """
 
     remote_syncstore: "VersionedChangesSyncStore | None"
+    changes_page_size: int = field(default=1000, kw_only=True)
+    # max. number of changes per pushed chunk, None: a single push
+    push_chunk_size: int | None = field(default=10_000, kw_only=True)
+    # bytes transferred by a (remote) store, accumulated over all calls
+    transfer_stats: TransferStats = field(default_factory=TransferStats, kw_only=True)
+    # per remote (name): its site_id, looked up on the first sync with it
+    remote_site_ids: dict[str, str] = field(default_factory=dict, init=False)
+    # per remote (name): its version vector as of the last sync (may be outdated, pushes are filtered by it)
+    remote_version_vectors: dict[str, VersionVector] = field(
+        default_factory=dict, init=False
+    )
 
     @abstractmethod
     def setup_table_change_tracking(self, tables: Tables) -> None: ...
@@ -82,40 +166,314 @@ class VersionedChangesSyncStore(SyncStore):
     @abstractmethod
     def get_last_received_version(self, from_site_id: str) -> int: ...
 
+    # all changes of the query, or up to limit of them (then follow has_more, or walk the
+    # pages with iter_changes); a remote capping the page size raises instead of truncating
     @abstractmethod
     def get_changes(self, changes_query: ChangesQuery) -> Changes: ...
 
     @abstractmethod
     def apply_changes(self, changes: Changes) -> None: ...
 
+    def iter_changes(self, changes_query: ChangesQuery) -> Iterator[Changes]:
+        # walk the changes page by page, so that only one page is held in memory at a time
+        query = replace(
+            changes_query, limit=changes_query.limit or self.changes_page_size
+        )
+        while True:
+            changes = self.get_changes(query)
+            yield changes
+            if not (changes.has_more and changes.changes):
+                return
+            query = query.next_page(changes)
+
+    def has_changes(self, changes_query: ChangesQuery) -> bool:
+        # whether the query would return any changes
+        return bool(self.get_changes(replace(changes_query, limit=1)).changes)
+
+    def push_changes(self, changes: Changes, pushed_since_version: int) -> PushResponse:
+        # apply pushed changes on their own, e.g. a chunk of a large push (see sync_steps)
+        last_received_version = self.receive_changes(changes, pushed_since_version)
+        return PushResponse(last_received_version, self.get_version_vector())
+
+    def acknowledge_push(
+        self,
+        remote_name: str,
+        remote_site_id: str,
+        changes: Changes,
+        pushed_since_version: int,
+        ack: PushResponse,
+    ) -> bool:
+        # records the progress of a push, if the remote applied the given changes
+        if changes.version_vector is not None:
+            if not covers(ack.version_vector, changes.version_vector):
+                return False
+            self.remote_version_vectors[remote_name] = merge_version_vectors(
+                ack.version_vector or {}, changes.version_vector
+            )
+            self.set_vector_sync_sent_version(remote_site_id, changes.version)
+            return True
+        if ack.last_received_version < pushed_since_version:
+            return False
+        self.set_last_sent_version(remote_site_id, changes.version)
+        return True
+
+    def get_vector_sync_versions(self, peer_site_id: str) -> tuple[int, int]:
+        # version vector sync with a peer: the local version up to which it has all our changes,
+        # and its version up to which we have all of its changes (of any origin), -1 if unknown;
+        # the changes before them are not queried again
+        return -1, -1
+
+    def set_vector_sync_sent_version(self, peer_site_id: str, version: int) -> None:
+        pass
+
+    def get_current_version(self) -> int | None:
+        # version of the latest local change, None if unknown
+        return None
+
+    def get_version_vector(self) -> VersionVector | None:
+        # None if version vectors are not supported
+        return None
+
+    def close(self) -> None:
+        # releases held resources, e.g. database connections
+        pass
+
+    def get_last_sent_version(self, to_site_id: str) -> int | None:
+        # version up to which the remote acknowledged our changes, None if unknown
+        return None
+
+    def set_last_sent_version(self, to_site_id: str, version: int) -> None:
+        pass
+
+    def exchange_changes(self, sync_request: SyncRequest) -> SyncResponse:
+        # answer the pull and apply the pushed changes in one call (a single round trip if remote),
+        # pulling first as a separate pull followed by a push would
+        changes = self.get_changes(sync_request.changes_query)
+        last_received_version = self.receive_changes(
+            sync_request.changes, sync_request.pushed_since_version
+        )
+        return SyncResponse(changes, last_received_version, self.get_version_vector())
+
+    def receive_changes(self, changes: Changes, pushed_since_version: int) -> int:
+        # apply pushed changes, returns the last received version of their site
+        last_received_version = self.get_last_received_version(changes.from_site_id)
+        if last_received_version >= pushed_since_version:
+            # pushed changes seamlessly continue the received ones
+            self.apply_changes(changes)
+            last_received_version = changes.version
+        return last_received_version
+
     def sync(self) -> SyncResult:
         if self.remote_syncstore is None:
             raise Exception(f"no remote_syncstore specified for {self.name}")
+        return self.sync_remote(self.remote_syncstore)
+
+    def sync_remote(self, remote: "VersionedChangesSyncStore") -> SyncResult:
+        # the calls of the sync are made directly, see sync_steps
+        steps = self.sync_steps(remote)
+        try:
+            call = next(steps)
+            while True:
+                target = remote if call.remote else self
+                call = steps.send(getattr(target, call.method)(*call.args))
+        except StopIteration as stop:
+            return stop.value
 
-        site_id = self.get_site_id()
+    def sync_steps(self, remote: SyncRemote) -> Generator[SyncCall, Any, SyncResult]:
+        # the sync algorithm, independent of how its calls are made (e.g. awaited, see AsyncSync):
+        # yields the calls of the local store and of the remote, and is sent their results
+        result = yield from self.sync_once_steps(remote)
+        if (
+            result is None
+        ):  # identity of the remote changed, sync again with the new one
+            result = yield from self.sync_once_steps(remote)
+        if result is None:
+            raise Exception(
+                f"site_id of the remote {remote.name} of {self.name} changed during sync"
+            )
+        return result
 
-        # tbd: only first time, then from local changes table?
-        remote_site_id = self.remote_syncstore.get_site_id()
+    def sync_once_steps(
+        self, remote: SyncRemote
+    ) -> Generator[SyncCall, Any, SyncResult | None]:
+        transfer_stats_before = copy(remote.transfer_stats)
+        phases = SyncPhases()
+        with phases.phase("local_state"):
+            site_id = yield local_call("get_site_id")
+            version_vector = yield local_call("get_version_vector")
+
+        # only looked up on the first sync, and again if the remote turns out to have changed
+        with phases.phase("remote_lookup"):
+            remote_site_id = self.remote_site_ids.get(remote.name)
+            if remote_site_id is None:
+                remote_site_id = self.remote_site_ids[remote.name] = yield remote_call(
+                    "get_site_id"
+                )
+                self.remote_version_vectors.pop(remote.name, None)
+            remote_version_vector = None
+            if version_vector is not None:
+                remote_version_vector = self.remote_version_vectors.get(remote.name)
+                if remote_version_vector is None:
+                    remote_version_vector = yield remote_call("get_version_vector")
 
         # tbd: potential message re-ordering (-> lost changes)
 
-        # pull
-        last_received_version = self.get_last_received_version(remote_site_id)
-        remote_changes = self.remote_syncstore.get_changes(
-            ChangesQuery(since_version=last_received_version, not_from_site_id=site_id)
+        # push (first chunk) + pull (first page) in a single exchange
+        if version_vector is not None and remote_version_vector is not None:
+            # push all changes the remote does not know, also the ones relayed from other sites,
+            # and pull all changes we do not know, of any origin: both only after the versions
+            # exchanged completely before, so that a sync does not scan all changes
+            with phases.phase("local_state"):
+                sent_version, received_version = yield local_call(
+                    "get_vector_sync_versions", remote_site_id
+                )
+            pushed_since_version = -1
+            push_query = ChangesQuery(
+                sent_version,
+                version_vector=remote_version_vector,
+                limit=self.push_chunk_size,
+            )
+            pull_query = ChangesQuery(received_version, version_vector=version_vector)
+        else:
+            with phases.phase("local_state"):
+                last_sent_version = yield local_call(
+                    "get_last_sent_version", remote_site_id
+                )
+            if last_sent_version is None:  # first sync with this remote
+                with phases.phase("remote_lookup"):
+                    last_sent_version = yield remote_call(
+                        "get_last_received_version", site_id
+                    )
+            pushed_since_version = last_sent_version
+            push_query = ChangesQuery(
+                pushed_since_version, from_site_id=site_id, limit=self.push_chunk_size
+            )
+            with phases.phase("local_state"):
+                pull_query = ChangesQuery(
+                    since_version=(
+                        yield local_call("get_last_received_version", remote_site_id)
+                    ),
+                    not_from_site_id=site_id,
+                )
+        with phases.phase("push_query"):
+            changes = yield local_call("get_changes", push_query)
+        with phases.phase("exchange"):
+            response = yield remote_call(
+                "exchange_changes",
+                SyncRequest(changes, pushed_since_version, pull_query),
+            )
+        if response.changes.from_site_id != remote_site_id:
+            # e.g. remote database replaced: versions of the cached site_id do not apply
+            del self.remote_site_ids[remote.name]
+            return None
+        ack = PushResponse(response.last_received_version, response.version_vector)
+        ack, n_pushed_changes, acknowledged = yield from self.push_steps(
+            remote,
+            remote_site_id,
+            push_query,
+            changes,
+            pushed_since_version,
+            ack,
+            phases,
         )
-        self.apply_changes(remote_changes)
+        if not acknowledged:
+            # remote is behind the versions we pushed against (e.g. restored), push the gap again
+            with phases.phase("repush"):
+                if push_query.version_vector is not None:
+                    pushed_since_version = -1
+                    push_query = ChangesQuery(
+                        version_vector=ack.version_vector or {},
+                        limit=self.push_chunk_size,
+                    )
+                else:
+                    pushed_since_version = ack.last_received_version
+                    push_query = ChangesQuery(
+                        pushed_since_version,
+                        from_site_id=site_id,
+                        limit=self.push_chunk_size,
+                    )
+                changes = yield local_call("get_changes", push_query)
+                ack = yield remote_call("push_changes", changes, pushed_since_version)
+            # if still not acknowledged, the next sync pushes the changes again
+            _, n_repushed_changes, _ = yield from self.push_steps(
+                remote,
+                remote_site_id,
+                push_query,
+                changes,
+                pushed_since_version,
+                ack,
+                phases,
+            )
+            n_pushed_changes += n_repushed_changes
 
-        # push
-        remote_last_received_version = self.remote_syncstore.get_last_received_version(
-            site_id
-        )
-        changes = self.get_changes(
-            ChangesQuery(remote_last_received_version, from_site_id=site_id)
-        )
-        self.remote_syncstore.apply_changes(changes)
+        # pull, each page is applied on its own, together with the version it is complete up to
+        n_pulled_changes = 0
+        remote_changes = response.changes
+        while True:
+            with phases.phase("apply"):
+                yield local_call("apply_changes", remote_changes)
+            n_pulled_changes += len(remote_changes.changes)
+            if not (remote_changes.has_more and remote_changes.changes):
+                break
+            page_query = replace(pull_query, limit=remote.changes_page_size)
+            with phases.phase("pull_pages"):
+                remote_changes = yield remote_call(
+                    "get_changes", page_query.next_page(remote_changes)
+                )
 
         return SyncResult(
-            n_pulled_changes=len(remote_changes.changes),
-            n_pushed_changes=len(changes.changes),
+            n_pulled_changes=n_pulled_changes,
+            n_pushed_changes=n_pushed_changes,
+            transfer_stats=remote.transfer_stats - transfer_stats_before,
+            phase_durations=phases.durations,
         )
+
+    def push_steps(
+        self,
+        remote: SyncRemote,
+        remote_site_id: str,
+        push_query: ChangesQuery,
+        changes: Changes,
+        pushed_since_version: int,
+        ack: PushResponse,
+        phases: SyncPhases,
+    ) -> Generator[SyncCall, Any, tuple[PushResponse, int, bool]]:
+        # acknowledges the pushed changes (a chunk of push_query), then pushes the further chunks,
+        # each one applied and acknowledged on its own: an interrupted sync resumes after the
+        # last acknowledged chunk; returns the last acknowledgement, the number of acknowledged
+        # changes and whether all chunks were acknowledged
+        n_pushed_changes = 0
+        while True:
+            with phases.phase("local_state"):
+                acknowledged = yield local_call(
+                    "acknowledge_push",
+                    remote.name,
+                    remote_site_id,
+                    changes,
+                    pushed_since_version,
+                    ack,
+                )
+            if not acknowledged:
+                return ack, n_pushed_changes, False
+            n_pushed_changes += len(changes.changes)
+            if not (changes.has_more and changes.changes):
+                return ack, n_pushed_changes, True
+            if push_query.version_vector is None:
+                pushed_since_version = changes.version
+            with phases.phase("push_query"):
+                changes = yield local_call("get_changes", push_query.next_page(changes))
+            with phases.phase("push_chunks"):
+                ack = yield remote_call("push_changes", changes, pushed_since_version)
+
+
+def covers(version_vector: VersionVector | None, other: VersionVector | None) -> bool:
+    # whether version_vector knows at least everything known by other
+    if other is None:
+        return True
+    if version_vector is None:
+        return False
+    return all(version_vector.get(s, -1) >= v for s, v in other.items())
+
+
+def merge_version_vectors(a: VersionVector, b: VersionVector) -> VersionVector:
+    return {s: max(a.get(s, -1), b.get(s, -1)) for s in a.keys() | b.keys()}
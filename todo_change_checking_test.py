@@ -52,3 +52,85 @@ def test_on_change_hook(s: CrSqliteTodoSyncStore):
     del list_1
     assert len(s.change_checker.on_change_callbacks) == 0
     assert len(s.change_checker.value_retrieval_fns) == 0
+
+
+def test_incremental_change_checking(clean_test_db_dir):
+    engine = get_engine(db_file="./db/crsqlite_change_checker_test.db")
+    s = CrSqliteTodoSyncStore(
+        "s", engine=engine, remote_syncstore=None, incremental_change_checking=True
+    )
+    lists = [
+        TodoList(f"list_{i}", f"title_{i}", [TodoItem(f"item_{i}", "content")])
+        for i in range(5)
+    ]
+    for todo_list in lists:
+        s.save(todo_list)
+
+    loaded: list[str] = []
+    updated: list[TodoList | None] = []
+
+    def retriever(list_id: str):
+        def load() -> TodoList | None:
+            loaded.append(list_id)
+            return s.load(list_id)
+
+        return load
+
+    tracked = [s.load(f"list_{i}") for i in range(5)]
+    for t in tracked:
+        assert t is not None
+        s.track(t, lambda tl: tl.list_id, retriever(t.list_id), updated.append)
+
+    s.check_all()  # first check compares all
+    assert sorted(loaded) == [f"list_{i}" for i in range(5)] and updated == []
+
+    loaded.clear()
+    s.check_all()
+    assert loaded == []  # nothing changed, nothing loaded
+
+    # title of list_1 changed, item of list_3 deleted (only the item row changes)
+    s.save(TodoList("list_1", "updated_title", [TodoItem("item_1", "content")]))
+    s.save(TodoList("list_3", "title_3", []))
+    s.check_all()
+    assert sorted(loaded) == ["list_1", "list_3"]
+    assert sorted(u.list_id for u in updated if u is not None) == ["list_1", "list_3"]
+
+    # item of list_2 moved to list_4, found via the list it was tracked with
+    loaded.clear()
+    s.save(TodoList("list_4", "title_4", [TodoItem("item_4"), TodoItem("item_2")]))
+    s.check_all()
+    assert sorted(loaded) == ["list_2", "list_4"]
+
+    # untracked lists leave no items behind
+    tracked.clear()
+    del t  # the last one tracked
+    assert s.tracked_list_ids_by_item_id == {}
+
+
+def test_batch_change_checking(clean_test_db_dir):
+    engine = get_engine(db_file="./db/crsqlite_change_checker_test.db")
+    s = CrSqliteTodoSyncStore(
+        "s", engine=engine, remote_syncstore=None, batch_change_checking=True
+    )
+    for i in range(3):
+        s.save(TodoList(f"list_{i}", f"title_{i}", [TodoItem(f"item_{i}")]))
+    tracked = [s.load(f"list_{i}") for i in range(3)]
+    updated: list[TodoList | None] = []
+
+    def not_called() -> TodoList | None:
+        raise AssertionError("lists are reloaded by load_many")
+
+    for t in tracked:
+        assert t is not None
+        s.track(t, lambda tl: tl.list_id, not_called, updated.append)
+
+    s.check_all()
+    assert updated == []
+
+    s.save(TodoList("list_1", "updated_title", [TodoItem("item_1")]))
+    s.save(TodoList("list_2", "title_2", []))
+    s.check_all()
+    assert updated == [
+        TodoList("list_1", "updated_title", [TodoItem("item_1")]),
+        TodoList("list_2", "title_2", []),
+    ]
@@ -1,16 +1,39 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
 from multiprocessing import Process
+from threading import Event, Thread
 import time
 from typing import Callable
 
 import pytest
+import requests
 
 from crsqlite_todo_sync_store import CrSqliteTodoSyncStore as StoreImpl
 from entity_change_checking.entity_change_checker import E
 from sqlite_setup import get_engine
+from syncstore.network.async_client_sync_store import (
+    AsyncHttpClientVersionedChangesSyncstore,
+    AsyncSync,
+    create_client,
+    sync_concurrently,
+)
+from syncstore.network import server_sync_store
+from syncstore.network.changes_codec import BINARY_CHANGES_MIMETYPE
 from syncstore.network.client_sync_store import HttpClientVersionedChangesSyncstore
-from syncstore.network.server_sync_store import run_sync_store_server_callable
+from syncstore.network.compression import PayloadTooLargeError, compress
+from syncstore.network.server_sync_store import (
+    JSON_MIMETYPE,
+    run_sync_store_server,
+    run_sync_store_server_callable,
+)
+from syncstore.network.tenant_pool import TenantPool
 from syncstore.syncstore import SyncResult
-from syncstore.versioned_changes_syncstore import VersionedChangesSyncStore
+from syncstore.versioned_changes_syncstore import (
+    ChangesQuery,
+    VersionedChangesSyncStore,
+)
 from todostore.todostore import TodoItem, TodoList, TodoSyncStore
 
 TEST_DB_DIR = "./db"
@@ -21,31 +44,87 @@ PORT = 5000
 SQL_ECHO = False
 
 
+def s0_store_provider() -> VersionedChangesSyncStore:
+    store = StoreImpl(
+        "s0",
+        remote_syncstore=None,
+        engine=get_engine(db_file=f"{TEST_DB_DIR}/s0.db", echo=SQL_ECHO),
+    )
+    return store.syncstore
+
+
 @pytest.fixture
 def s0(clean_test_db_dir):  # run after cleanup
-    def store_provider() -> VersionedChangesSyncStore:
-        store = StoreImpl(
-            "s0",
-            remote_syncstore=None,
-            engine=get_engine(db_file=f"{TEST_DB_DIR}/s0.db", echo=SQL_ECHO),
-        )
-        return store.syncstore
-
-    run_server_in_separate_process(store_provider)
+    run_server_in_separate_process(s0_store_provider)
     time.sleep(0.2)  # tbd: properly wait until server started
     return "s0 server started"
 
 
+def tenant_store(key: str) -> VersionedChangesSyncStore:
+    engine = get_engine(db_file=f"{TEST_DB_DIR}/tenant_{key}.db", echo=SQL_ECHO)
+    return StoreImpl(f"tenant_{key}", engine, None).syncstore
+
+
+def tenants_provider() -> TenantPool:
+    return TenantPool("tenants", tenant_store, max_open=1)
+
+
+@pytest.fixture
+def tenants_server(clean_test_db_dir):
+    # a shard per tenant, of which only one is kept open
+    run_server_in_separate_process(tenants_provider)
+    time.sleep(0.2)
+    return "tenants server started"
+
+
+def run_json_only_server() -> None:
+    # e.g. an older server version, which does not know the binary format
+    server_sync_store.BINARY_CHANGES_MIMETYPE = "application/x-unsupported"
+    run_sync_store_server(s0_store_provider(), HOST, PORT)
+
+
+@pytest.fixture
+def s0_json_only(clean_test_db_dir):
+    global server_process
+    server_process = Process(target=run_json_only_server, daemon=True)
+    server_process.start()
+    time.sleep(0.2)
+    return "json-only s0 server started"
+
+
+@pytest.fixture
+def s0_worker_pool(clean_test_db_dir):
+    # fewer workers than concurrently syncing clients
+    run_server_in_separate_process(s0_store_provider, workers=2)
+    time.sleep(0.2)
+    return "s0 server started"
+
+
+@pytest.fixture
+def s0_small_pages(clean_test_db_dir):
+    run_server_in_separate_process(s0_store_provider, max_changes_page_size=2)
+    time.sleep(0.2)
+    return "s0 server started"
+
+
+@pytest.fixture
+def s0_single_worker(clean_test_db_dir):
+    run_server_in_separate_process(s0_store_provider, workers=1)
+    time.sleep(0.2)
+    return "s0 server started"
+
+
 server_process: Process | None = None
 
 
 def run_server_in_separate_process(
-    syncstore_provider: Callable[[], VersionedChangesSyncStore],
+    syncstore_provider: Callable[[], VersionedChangesSyncStore | TenantPool],
+    **server_options,
 ):
     global server_process
     server_process = Process(
         target=run_sync_store_server_callable(
-            syncstore_provider, HOST, PORT, debug=True
+            syncstore_provider, HOST, PORT, debug=True, **server_options
         )
     )
     server_process.daemon = True
@@ -67,8 +146,9 @@ def s1(s0: StoreImpl):
 
 @pytest.fixture
 def s2(s0):
+    # s1 exchanges changes in the binary format, s2 in json
     remote_syncstore = HttpClientVersionedChangesSyncstore(
-        "s2_remote_client_s0", None, HOST, PORT
+        "s2_remote_client_s0", None, HOST, PORT, changes_mimetype=JSON_MIMETYPE
     )
 
     return StoreImpl(
@@ -198,3 +278,395 @@ def test_sync(s1: TodoSyncStore, s2: TodoSyncStore):
 
     assert list_s1 == list_s2
     assert list_s1.todos == []
+
+
+def test_sync_compression(s1: StoreImpl, s2: StoreImpl):
+    list_s1 = TodoList("todolist_1", "title_1")
+    list_s1.todos = [TodoItem(f"item_{i}", f"content_{i}") for i in range(50)]
+    s1.save(list_s1)
+
+    # pushed in the binary format
+    sync_result = s1.sync()
+    assert sync_result == SyncResult(n_pulled_changes=0, n_pushed_changes=101)
+    sent = sync_result.transfer_stats
+    assert 0 < sent.n_bytes_sent < sent.n_bytes_sent_uncompressed
+
+    # pulled as json
+    sync_result = s2.sync()
+    assert sync_result == SyncResult(n_pulled_changes=101, n_pushed_changes=0)
+    received = sync_result.transfer_stats
+    assert 0 < received.n_bytes_received < received.n_bytes_received_uncompressed
+    assert received.n_bytes_received_uncompressed > sent.n_bytes_sent_uncompressed
+    assert s2.load("todolist_1") == s1.load("todolist_1")
+
+    # a small body inflating beyond the request size limit (64 MiB by default)
+    bomb = compress(b"\0" * (64 * 1024 * 1024 + 1), "gzip")
+    response = requests.post(
+        f"http://{HOST}:{PORT}/changes",
+        data=bomb,
+        headers={"Content-Type": JSON_MIMETYPE, "Content-Encoding": "gzip"},
+    )
+    assert response.status_code == 413
+
+
+def test_sync_metrics(s1: StoreImpl, s2: StoreImpl):
+    s1.save(TodoList("todolist_1", "title_1", [TodoItem("item_1", "content_1")]))
+    sync_result = s1.sync()
+    # site_id + last received version of the new peer, then a single exchange
+    assert sync_result.transfer_stats.n_round_trips == 3
+    assert sync_result.transfer_stats.encode_duration > 0
+    assert {"local_state", "remote_lookup", "push_query", "exchange", "apply"} <= set(
+        sync_result.phase_durations
+    )
+    assert s2.sync().n_pulled_changes == 3
+
+    response = requests.get(f"http://{HOST}:{PORT}/metrics")
+    assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+    samples = dict(
+        line.rsplit(" ", 1)
+        for line in response.text.splitlines()
+        if not line.startswith("#")
+    )
+    assert (
+        samples['syncstore_changes_total{endpoint="sync",direction="received"}'] == "3"
+    )
+    assert samples['syncstore_changes_total{endpoint="sync",direction="sent"}'] == "3"
+    assert samples['syncstore_requests_total{endpoint="sync",status="200"}'] == "2"
+    assert samples['syncstore_request_duration_seconds_count{endpoint="sync"}'] == "2"
+    assert (
+        samples['syncstore_request_duration_seconds_bucket{endpoint="sync",le="+Inf"}']
+        == "2"
+    )
+    assert int(samples['syncstore_bytes_total{endpoint="sync",direction="sent"}']) > 0
+
+
+def test_chunked_push(s1: StoreImpl, s2: StoreImpl):
+    todo_lists = [
+        TodoList(f"todolist_{i}", f"title_{i}", [TodoItem(f"item_{i}", "content")])
+        for i in range(2)
+    ]
+    for todo_list in todo_lists:
+        s1.save(todo_list)
+    s1.syncstore.push_chunk_size = 2
+    sync_result = s1.sync()
+    assert sync_result.n_pushed_changes == 6
+    # site_id + last received version of the new peer, the exchange, then 2 more chunks
+    assert sync_result.transfer_stats.n_round_trips == 5
+    assert "push_chunks" in sync_result.phase_durations
+    assert s1.sync().n_pushed_changes == 0
+
+    # same for the async client
+    s2.syncstore.push_chunk_size = 2
+    s2.save(TodoList("todolist_s2", "title_s2", [TodoItem("item_s2", "content")]))
+
+    async def sync_async() -> SyncResult:
+        async with create_client() as client:
+            remote = AsyncHttpClientVersionedChangesSyncstore(
+                "s2_async_remote", HOST, PORT, client=client
+            )
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                return await AsyncSync(s2.syncstore, remote, executor).sync()
+
+    sync_result = asyncio.run(sync_async())
+    assert sync_result.n_pushed_changes == 3
+    assert sync_result.n_pulled_changes == 6
+    assert s1.sync().n_pulled_changes == 3
+    for store in [s1, s2]:
+        for todo_list in todo_lists:
+            assert store.load(todo_list.list_id) == todo_list
+
+    samples = requests.get(f"http://{HOST}:{PORT}/metrics").text
+    assert 'syncstore_requests_total{endpoint="push_changes",status="204"}' in samples
+
+
+def test_push_falls_back_to_json(s0_json_only):
+    client = HttpClientVersionedChangesSyncstore("s1_remote", None, HOST, PORT)
+    s1 = StoreImpl(
+        "s1",
+        remote_syncstore=client,
+        engine=get_engine(db_file=f"{TEST_DB_DIR}/s1.db", echo=SQL_ECHO),
+    )
+    todo_list = TodoList("todolist_1", "title_1", [TodoItem("item_1", "content_1")])
+    s1.save(todo_list)
+    assert client.changes_mimetype == BINARY_CHANGES_MIMETYPE
+    assert s1.sync().n_pushed_changes == 3
+    assert client.changes_mimetype == JSON_MIMETYPE  # kept for the session
+
+    async_client = AsyncHttpClientVersionedChangesSyncstore("s2_remote", HOST, PORT)
+    s2 = StoreImpl(
+        "s2",
+        remote_syncstore=None,
+        engine=get_engine(db_file=f"{TEST_DB_DIR}/s2.db", echo=SQL_ECHO),
+    )
+    s2.save(TodoList("todolist_2", "title_2"))
+
+    async def sync_async() -> SyncResult:
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            result = await AsyncSync(s2.syncstore, async_client, executor).sync()
+        await async_client.aclose()
+        return result
+
+    sync_result = asyncio.run(sync_async())
+    assert (sync_result.n_pushed_changes, sync_result.n_pulled_changes) == (1, 3)
+    assert async_client.changes_mimetype == JSON_MIMETYPE
+    assert s2.load("todolist_1") == todo_list
+    assert s1.sync().n_pulled_changes == 1
+
+
+def test_changes_beyond_the_server_page_size(s0_small_pages):
+    client = HttpClientVersionedChangesSyncstore("s1_remote", None, HOST, PORT)
+    s1 = StoreImpl(
+        "s1",
+        remote_syncstore=client,
+        engine=get_engine(db_file=f"{TEST_DB_DIR}/s1.db", echo=SQL_ECHO),
+    )
+    todo_list = TodoList("todolist_1", "title_1", [TodoItem("item_1", "content_1")])
+    s1.save(todo_list)
+    assert s1.sync().n_pushed_changes == 3
+
+    # all changes are expected without a limit: not just the first page
+    query = ChangesQuery(from_site_id=s1.syncstore.get_site_id())
+    with pytest.raises(Exception, match="more changes than the server returns"):
+        client.get_changes(query)
+    assert client.get_changes(replace(query, limit=2)).has_more
+    assert sum(len(p.changes) for p in client.iter_changes(query)) == 3
+
+    async_client = AsyncHttpClientVersionedChangesSyncstore("s1_remote", HOST, PORT)
+
+    async def get_changes_async() -> None:
+        with pytest.raises(Exception, match="more changes than the server returns"):
+            await async_client.get_changes(query)
+        await async_client.aclose()
+
+    asyncio.run(get_changes_async())
+
+
+def test_response_size_is_limited(s1: StoreImpl, s0):
+    # a repetitive content inflates beyond the limit, a random one is too large as sent
+    for content in ["x" * 4096, os.urandom(2048).hex()]:
+        s1.save(TodoList("todolist_1", "title_1", [TodoItem("item_1", content)]))
+        s1.sync()
+        query = ChangesQuery(from_site_id=s1.syncstore.get_site_id(), limit=100)
+        client = HttpClientVersionedChangesSyncstore(
+            "s2_remote", None, HOST, PORT, max_response_size=1024
+        )
+        with pytest.raises(PayloadTooLargeError):
+            client.get_changes(query)
+        async_client = AsyncHttpClientVersionedChangesSyncstore(
+            "s2_remote", HOST, PORT, max_response_size=1024
+        )
+
+        async def get_changes_async() -> None:
+            with pytest.raises(PayloadTooLargeError):
+                await async_client.get_changes(query)
+            await async_client.aclose()
+
+        asyncio.run(get_changes_async())
+
+
+def test_watch_triggers_sync(s1: StoreImpl, s2: StoreImpl):
+    # s2 only syncs when the server has changes which are not its own
+    sync_results: list[SyncResult] = []
+    stop = Event()
+    watch_client = HttpClientVersionedChangesSyncstore("s2_watch", None, HOST, PORT)
+    watcher = Thread(
+        target=watch_client.watch,
+        args=(lambda: sync_results.append(s2.sync()),),
+        kwargs=dict(not_from_site_id=s2.syncstore.get_site_id(), stop=stop, timeout=1),
+    )
+    watcher.start()
+    try:
+        s1.save(TodoList("todolist_1", "title_1"))
+        s1.sync()
+        for _ in range(50):
+            if sync_results:
+                break
+            time.sleep(0.1)
+        assert sync_results == [SyncResult(n_pulled_changes=1, n_pushed_changes=0)]
+
+        s2.save(TodoList("todolist_2", "title_2"))
+        s2.sync()
+        time.sleep(0.5)
+        assert len(sync_results) == 1  # own changes do not wake up the watcher
+    finally:
+        stop.set()
+        watcher.join()
+        watch_client.close()
+    assert s2.load("todolist_1") == s1.load("todolist_1")
+
+
+def test_watch_with_a_single_worker(s0_single_worker):
+    # the only worker may be taken by a watcher (until its timeout)
+    r = requests.get(
+        f"http://{HOST}:{PORT}/watch", params={"since_version": 0, "timeout": 0.1}
+    )
+    assert r.status_code == 200
+    assert not r.json()["has_changes"]
+
+
+def test_auto_sync(s1: StoreImpl, s2: StoreImpl):
+    auto_sync = s1.start_auto_sync(debounce=0.05)
+    for i in range(5):
+        s1.save(TodoList(f"todolist_{i}", f"title_{i}"))
+    for _ in range(50):
+        if auto_sync.get_stats().n_syncs:
+            break
+        time.sleep(0.1)
+    s1.stop_auto_sync()
+    assert auto_sync.get_stats().n_synced_writes == 5
+    assert auto_sync.get_stats().n_syncs <= 2  # a single one, unless saving was slow
+
+    s2.sync()
+    for i in range(5):
+        assert s2.load(f"todolist_{i}") == TodoList(f"todolist_{i}", f"title_{i}")
+
+
+def test_cached_load_is_invalidated_by_sync(s1: StoreImpl, s0):
+    s2 = StoreImpl(
+        "s2",
+        remote_syncstore=HttpClientVersionedChangesSyncstore(
+            "s2_remote", None, HOST, PORT
+        ),
+        engine=get_engine(db_file=f"{TEST_DB_DIR}/s2.db", echo=SQL_ECHO),
+        cache_size=1024 * 1024,
+    )
+    s1.save(TodoList("todolist_1", "title_1", [TodoItem("item_1"), TodoItem("item_2")]))
+    s1.sync()
+    s2.sync()
+    assert s2.load("todolist_1") == s2.load("todolist_1") == s1.load("todolist_1")
+
+    # item deleted and content changed remotely: only item rows change
+    s1.save(TodoList("todolist_1", "title_1", [TodoItem("item_1", "changed")]))
+    s1.sync()
+    s2.sync()
+    assert s2.load("todolist_1") == s1.load("todolist_1")
+
+    # saved locally
+    s2.save(TodoList("todolist_1", "title_2"))
+    assert s2.load("todolist_1") == TodoList("todolist_1", "title_2")
+
+    stats = s2.get_cache_stats()
+    assert stats is not None
+    assert (stats.n_hits, stats.n_misses, stats.n_invalidations) == (1, 3, 2)
+    assert stats.n_entries == 1 and stats.n_bytes > 0
+
+
+def test_search_index_follows_sync(s1: StoreImpl, s0):
+    s2 = StoreImpl(
+        "s2",
+        remote_syncstore=HttpClientVersionedChangesSyncstore(
+            "s2_remote", None, HOST, PORT
+        ),
+        engine=get_engine(db_file=f"{TEST_DB_DIR}/s2.db", echo=SQL_ECHO),
+        search_index=True,
+    )
+    s1.save(TodoList("todolist_1", "groceries", [TodoItem("item_1", "buy milk")]))
+    s1.sync()
+    s2.sync()
+    assert [(h.list_id, h.item_id) for h in s2.search("milk")] == [
+        ("todolist_1", "item_1")
+    ]
+
+    s1.save(TodoList("todolist_1", "groceries", [TodoItem("item_1", "buy bread")]))
+    s1.sync()
+    s2.sync()
+    assert s2.search("milk") == []
+    assert [h.item_id for h in s2.search("bread")] == ["item_1"]
+
+
+def test_close_shuts_down_the_fan_out(clean_test_db_dir):
+    hub1, hub2 = [
+        StoreImpl(name, get_engine(db_file=f"{TEST_DB_DIR}/{name}.db"), None)
+        for name in ["hub1", "hub2"]
+    ]
+    s1 = StoreImpl(
+        "s1",
+        get_engine(db_file=f"{TEST_DB_DIR}/s1.db"),
+        hub1.syncstore,
+        additional_remotes=[hub2.syncstore],
+    )
+    s1.save(TodoList("todolist_1", "title_1"))
+    s1.start_auto_sync()
+    s1.sync()
+    assert s1.fan_out is not None and s1.fan_out.executor is not None
+
+    s1.close()
+    assert s1.fan_out.executor is None
+    assert s1.auto_sync is None
+    assert hub2.load("todolist_1") == TodoList("todolist_1", "title_1")
+
+
+def test_async_sync(s0):
+    assert_async_sync(n_stores=6, max_concurrency=3)
+
+
+def test_async_sync_worker_pool_server(s0_worker_pool):
+    # kept-alive connections of the clients must not block the 2 workers
+    assert_async_sync(n_stores=6, max_concurrency=6)
+
+
+def assert_async_sync(n_stores: int, max_concurrency: int):
+    stores = [
+        StoreImpl(
+            f"a{i}",
+            remote_syncstore=None,
+            engine=get_engine(db_file=f"{TEST_DB_DIR}/a{i}.db", echo=SQL_ECHO),
+        )
+        for i in range(n_stores)
+    ]
+    for i, store in enumerate(stores):
+        store.save(TodoList(f"list_a{i}", f"title_{i}"))
+
+    async def sync_all_twice() -> list[list[SyncResult | BaseException]]:
+        client = create_client()  # connection pool shared by all stores
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            syncs = [
+                AsyncSync(
+                    s.syncstore,
+                    AsyncHttpClientVersionedChangesSyncstore(
+                        f"{s.name}_remote", HOST, PORT, client=client
+                    ),
+                    executor,
+                )
+                for s in stores
+            ]
+            results = [await sync_concurrently(syncs, max_concurrency)]
+            results.append(await sync_concurrently(syncs, max_concurrency))
+        await client.aclose()
+        return results
+
+    first, second = asyncio.run(sync_all_twice())
+    results = [r for r in first + second if isinstance(r, SyncResult)]
+    assert len(results) == 2 * n_stores
+    # each list is pushed once, and pulled once by each of the other stores
+    assert sum(r.n_pushed_changes for r in results) == n_stores
+    assert sum(r.n_pulled_changes for r in results) == n_stores * (n_stores - 1)
+    for store in stores:
+        for i in range(n_stores):
+            assert store.load(f"list_a{i}") == TodoList(f"list_a{i}", f"title_{i}")
+
+
+def test_multi_tenant_server(tenants_server):
+    def store(name: str, tenant: str) -> StoreImpl:
+        remote = HttpClientVersionedChangesSyncstore(
+            f"{name}_remote", None, HOST, PORT, tenant=tenant
+        )
+        engine = get_engine(db_file=f"{TEST_DB_DIR}/{name}.db", echo=SQL_ECHO)
+        return StoreImpl(name, engine, remote)
+
+    a1, a2, b1 = store("a1", "team_a"), store("a2", "team_a"), store("b1", "team_b")
+    a1.save(TodoList("list_a", "title_a"))
+    b1.save(TodoList("list_b", "title_b"))
+    # alternating tenants: each request reopens the shard of its tenant
+    for s in [a1, b1, a2, b1]:
+        s.sync()
+    assert a2.load("list_a") == TodoList("list_a", "title_a")
+    assert a2.load("list_b") is None
+    assert b1.load("list_a") is None
+
+    base = f"http://{HOST}:{PORT}"
+    assert requests.get(f"{base}/site-id").status_code == 404  # tenant required
+    assert requests.get(f"{base}/tenants/a.b/site-id").status_code == 400
+    metrics = requests.get(f"{base}/metrics").text
+    assert "syncstore_open_tenants 1" in metrics
+    assert "syncstore_closed_tenants 3" in metrics
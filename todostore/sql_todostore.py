@@ -1,6 +1,16 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import Any, Iterable, Iterator
 
-from sqlalchemy import Engine, select
+from sqlalchemy import (
+    Engine,
+    Select,
+    delete,
+    func,
+    select,
+    text,
+)
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import (
     DeclarativeBase,
     Mapped,
@@ -8,9 +18,21 @@ from sqlalchemy.orm import (
     Session,
     mapped_column,
     relationship,
+    selectinload,
+)
+
+from .todostore import (
+    InvalidSearchQueryError,
+    SearchHit,
+    TodoItem,
+    TodoList,
+    TodoListFilter,
+    TodoStore,
 )
 
-from .todostore import TodoItem, TodoList, TodoStore
+
+# ids per IN (...) clause, bounding the number of sql parameters of a query
+IN_CHUNK_SIZE = 500
 
 
 class TodoBase(DeclarativeBase, MappedAsDataclass):
@@ -25,7 +47,7 @@ class PTodoItem(TodoBase):
         primary_key=True, nullable=False, server_default="default_item_id"
     )
     content: Mapped[str] = mapped_column(nullable=True)
-    list_id: Mapped[str] = mapped_column(nullable=True)
+    list_id: Mapped[str] = mapped_column(nullable=True, index=True)
 
 
 @dataclass
@@ -69,24 +91,291 @@ def from_p_todo_list(p_todo_list: PTodoList) -> TodoList:
     )
 
 
+def diff_statements(todo_list: TodoList, previous: TodoList) -> list[tuple[Any, Any]]:
+    # (statement, parameters) which turn the stored previous state into todo_list;
+    # changed rows are upserted, as they may have been deleted since (e.g. by a merge)
+    statements: list[tuple[Any, Any]] = []
+    list_id = todo_list.list_id
+    if todo_list.title != previous.title:
+        list_stmt = insert(PTodoList).values(list_id=list_id, title=todo_list.title)
+        statements.append(
+            (
+                list_stmt.on_conflict_do_update(
+                    index_elements=[PTodoList.list_id],
+                    set_={"title": list_stmt.excluded.title},
+                ),
+                None,
+            )
+        )
+    items = {i.item_id: i for i in todo_list.todos}
+    previous_items = {i.item_id: i for i in previous.todos}
+    removed = [i for i in previous_items if i not in items]
+    added = [
+        {"item_id": i.item_id, "content": i.content, "list_id": list_id}
+        for i in items.values()
+        if i.item_id not in previous_items
+    ]
+    changed = [
+        {"item_id": i.item_id, "content": i.content, "list_id": list_id}
+        for i in items.values()
+        if i.item_id in previous_items
+        and i.content != previous_items[i.item_id].content
+    ]
+    for c in range(0, len(removed), IN_CHUNK_SIZE):
+        statements.append(
+            (
+                delete(PTodoItem).where(
+                    PTodoItem.item_id.in_(removed[c : c + IN_CHUNK_SIZE])
+                    & (PTodoItem.list_id == list_id)
+                ),
+                None,
+            )
+        )
+    if added:
+        # upsert, in case the item was stored since the previous state was loaded
+        stmt = insert(PTodoItem)
+        statements.append(
+            (
+                stmt.on_conflict_do_update(
+                    index_elements=[PTodoItem.item_id],
+                    set_={"content": stmt.excluded.content, "list_id": list_id},
+                ),
+                added,
+            )
+        )
+    if changed:
+        # an item moved to another list since keeps it
+        stmt = insert(PTodoItem)
+        statements.append(
+            (
+                stmt.on_conflict_do_update(
+                    index_elements=[PTodoItem.item_id],
+                    set_={"content": stmt.excluded.content},
+                ),
+                changed,
+            )
+        )
+    return statements
+
+
+def filtered(stmt: Select, list_filter: TodoListFilter) -> Select:
+    if list_filter.title_prefix is not None:
+        prefix = list_filter.title_prefix
+        stmt = stmt.where(func.substr(PTodoList.title, 1, len(prefix)) == prefix)
+    if list_filter.min_items is not None or list_filter.max_items is not None:
+        n_items = (
+            select(func.count())
+            .where(PTodoItem.list_id == PTodoList.list_id)
+            .scalar_subquery()
+        )
+        if list_filter.min_items is not None:
+            stmt = stmt.where(n_items >= list_filter.min_items)
+        if list_filter.max_items is not None:
+            stmt = stmt.where(n_items <= list_filter.max_items)
+    return stmt
+
+
+# fts5 index of the text columns, outside of the replicated (crr) tables:
+# kept up to date by triggers, which also fire when crsqlite merges changes of other sites;
+# a single index for all of them, so that the ranks of their matches are comparable
+SEARCH_INDEX = "todo_search"
+SEARCH_INDEX_COLUMNS = {
+    "todo_list": ("list_id", "title"),
+    "todo_item": ("item_id", "content"),
+}
+
+
+def search_index_ddl() -> list[str]:
+    # the index holds its own copy of the text, and the kind (table) and primary key of its row
+    # to join on, instead of the implicit rowid of the content table, which a vacuum or a merge
+    # may change; the rowids of the index are assigned per row by {SEARCH_INDEX}_keys,
+    # so that the triggers find the entry of a row without scanning the index
+    keys = f"{SEARCH_INDEX}_keys"
+    statements = [
+        f"CREATE VIRTUAL TABLE {SEARCH_INDEX} USING fts5("
+        "kind UNINDEXED, key UNINDEXED, text)",
+        f"CREATE TABLE {keys} (id INTEGER PRIMARY KEY,"
+        " kind TEXT NOT NULL, key TEXT NOT NULL, UNIQUE (kind, key))",
+    ]
+    for table, (key, column) in SEARCH_INDEX_COLUMNS.items():
+        where = f"kind = '{table}' AND key ="
+
+        def delete(row: str) -> str:
+            return (
+                f"DELETE FROM {SEARCH_INDEX} WHERE rowid ="
+                f" (SELECT id FROM {keys} WHERE {where} {row}.{key});"
+                f" DELETE FROM {keys} WHERE {where} {row}.{key};"
+            )
+
+        def insert(row: str) -> str:
+            return (
+                f"INSERT INTO {keys} (kind, key) VALUES ('{table}', {row}.{key});"
+                f" INSERT INTO {SEARCH_INDEX} (rowid, kind, key, text)"
+                f" SELECT id, kind, key, {row}.{column}"
+                f" FROM {keys} WHERE {where} {row}.{key};"
+            )
+
+        statements += [
+            f"CREATE TRIGGER {table}_search_ai AFTER INSERT ON {table}"
+            f" BEGIN {delete('new')} {insert('new')} END",
+            f"CREATE TRIGGER {table}_search_ad AFTER DELETE ON {table}"
+            f" BEGIN {delete('old')} END",
+            f"CREATE TRIGGER {table}_search_au AFTER UPDATE OF {key}, {column} ON {table}"
+            f" BEGIN {delete('old')} {insert('new')} END",
+            # initial build from the existing rows, afterwards the triggers take over
+            f"INSERT INTO {keys} (kind, key) SELECT '{table}', {key} FROM {table}",
+            f"INSERT INTO {SEARCH_INDEX} (rowid, kind, key, text)"
+            f" SELECT k.id, k.kind, k.key, t.{column}"
+            f" FROM {table} t JOIN {keys} k ON k.kind = '{table}' AND k.key = t.{key}",
+        ]
+    return statements
+
+
+def drop_search_index_ddl() -> list[str]:
+    # also the former layouts: an index per table (over its rowids, or its primary keys)
+    statements = []
+    for table in SEARCH_INDEX_COLUMNS:
+        statements += [
+            *(f"DROP TRIGGER IF EXISTS {table}_search_{t}" for t in ["ai", "ad", "au"]),
+            f"DROP TABLE IF EXISTS {table}_search",
+            f"DROP TABLE IF EXISTS {table}_search_keys",
+        ]
+    return statements + [
+        f"DROP TABLE IF EXISTS {SEARCH_INDEX}",
+        f"DROP TABLE IF EXISTS {SEARCH_INDEX}_keys",
+    ]
+
+
+SEARCH_SQL = """
+SELECT coalesce(i.list_id, l.list_id) AS list_id, i.item_id AS item_id,
+    snippet(todo_search, 2, '[', ']', '...', 12) AS snippet, s.rank AS rank
+FROM todo_search s
+LEFT JOIN todo_item i ON s.kind = 'todo_item' AND i.item_id = s.key
+LEFT JOIN todo_list l ON s.kind = 'todo_list' AND l.list_id = s.key
+WHERE todo_search MATCH :query AND coalesce(i.list_id, l.list_id) IS NOT NULL
+ORDER BY s.rank LIMIT :limit
+"""
+
+
+def create_search_index(engine: Engine) -> None:
+    ddl = search_index_ddl()
+    with engine.begin() as c:
+        existing = c.execute(
+            text("SELECT sql FROM sqlite_master WHERE name = :name"),
+            {"name": SEARCH_INDEX},
+        ).scalar()
+        if existing == ddl[0]:
+            return
+        for statement in drop_search_index_ddl() + ddl:
+            c.execute(text(statement))
+
+
 def create_all(engine: Engine) -> None:
     TodoBase.metadata.create_all(engine)
+    # create_all skips existing tables, including the indexes added to them since
+    # (e.g. todo_item.list_id): created if not existing
+    for table in TodoBase.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
 
 
 @dataclass
 class SqlTodoStore(TodoStore):
     engine: Engine
+    # full-text search, maintained on every write of the lists and items
+    search_index: bool = field(default=False, kw_only=True)
 
     def __post_init__(self):
         create_all(self.engine)
+        if self.search_index:
+            create_search_index(self.engine)
+
+    def search(self, query: str, limit: int = 20) -> list[SearchHit]:
+        if not self.search_index:
+            raise Exception("search index is not enabled")
+        with self.engine.connect() as c:
+            try:
+                rows = c.execute(text(SEARCH_SQL), {"query": query, "limit": limit})
+            except OperationalError as e:
+                # e.g. an fts5 syntax error, unlike a locked database
+                if getattr(e.orig, "sqlite_errorname", None) == "SQLITE_ERROR":
+                    raise InvalidSearchQueryError(f"{e.orig}: {query!r}") from e
+                raise
+            return [SearchHit(*row) for row in rows]
 
     def get_tables(self) -> list[str]:
         return [PTodoItem.__tablename__, PTodoList.__tablename__]
 
-    def save(self, entity: TodoList) -> None:
-        p_todo_list = to_p_todo_list(entity)
-        with Session(self.engine) as session, session.begin():
-            session.merge(p_todo_list)
+    def save(self, entity: TodoList, previous: TodoList | None = None) -> None:
+        # previous: the list as loaded before it was modified, so that only the rows and columns
+        # which differ from it are written (instead of merging the whole list)
+        if previous is None:
+            p_todo_list = to_p_todo_list(entity)
+            with Session(self.engine) as session, session.begin():
+                session.merge(p_todo_list)
+            return
+        if previous.list_id != entity.list_id:
+            raise ValueError(
+                f"previous state of another list: {previous.list_id} != {entity.list_id}"
+            )
+        with self.engine.begin() as c:
+            for statement, params in diff_statements(entity, previous):
+                c.execute(statement, params)
+
+    def load_many(self, entity_ids: Iterable[str]) -> dict[str, TodoList]:
+        # 2 queries per chunk of ids: the lists, and their items (selectin)
+        entity_ids = list(dict.fromkeys(entity_ids))
+        todo_lists: dict[str, TodoList] = {}
+        with Session(self.engine) as session:
+            for i in range(0, len(entity_ids), IN_CHUNK_SIZE):
+                p_todo_lists = session.scalars(
+                    select(PTodoList)
+                    .where(PTodoList.list_id.in_(entity_ids[i : i + IN_CHUNK_SIZE]))
+                    .options(selectinload(PTodoList.todos))
+                )
+                for p_todo_list in p_todo_lists:
+                    todo_lists[p_todo_list.list_id] = from_p_todo_list(p_todo_list)
+        return todo_lists
+
+    def iter_lists(
+        self,
+        page_size: int = 1000,
+        after: str | None = None,
+        list_filter: TodoListFilter | None = None,
+    ) -> Iterator[TodoList]:
+        # keyset pagination on list_id, 2 queries per page (the lists, and their items)
+        while True:
+            stmt = select(PTodoList).order_by(PTodoList.list_id).limit(page_size)
+            if after is not None:
+                stmt = stmt.where(PTodoList.list_id > after)
+            if list_filter is not None:
+                stmt = filtered(stmt, list_filter)
+            with Session(self.engine) as session:
+                page = [
+                    from_p_todo_list(p)
+                    for p in session.scalars(
+                        stmt.options(selectinload(PTodoList.todos))
+                    )
+                ]
+            yield from page
+            if len(page) < page_size:
+                return
+            after = page[-1].list_id
+
+    def get_list_ids(self, rows: Iterable[tuple[str, tuple]]) -> set[str]:
+        # lists of the given (table, primary key) rows, as currently stored
+        list_ids = {pk[0] for table, pk in rows if table == PTodoList.__tablename__}
+        item_ids = [pk[0] for table, pk in rows if table == PTodoItem.__tablename__]
+        with Session(self.engine) as session:
+            for i in range(0, len(item_ids), IN_CHUNK_SIZE):
+                list_ids.update(
+                    session.scalars(
+                        select(PTodoItem.list_id)
+                        .where(PTodoItem.item_id.in_(item_ids[i : i + IN_CHUNK_SIZE]))
+                        .where(PTodoItem.list_id.is_not(None))
+                    )
+                )
+        return list_ids
 
     def load(self, entity_id: str) -> TodoList | None:
         with Session(self.engine) as session:
@@ -0,0 +1,114 @@
+import sys
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import Iterable
+
+from .todostore import TodoItem, TodoList
+
+# loaded lists, kept until they are written (saved locally, or merged by a sync)
+
+
+@dataclass
+class TodoListCacheStats:
+    n_hits: int = 0
+    n_misses: int = 0
+    n_evictions: int = 0  # entries dropped to stay within the byte budget
+    n_invalidations: int = 0  # entries dropped since their list was written
+    n_entries: int = 0
+    n_bytes: int = 0  # estimated memory of the cached lists
+
+    @property
+    def hit_ratio(self) -> float:
+        n_lookups = self.n_hits + self.n_misses
+        return self.n_hits / n_lookups if n_lookups else 0.0
+
+
+def copy_todo_list(todo_list: TodoList) -> TodoList:
+    # callers modify the lists they load, the cached ones must not change with them
+    return TodoList(
+        todo_list.list_id,
+        todo_list.title,
+        [TodoItem(i.item_id, i.content) for i in todo_list.todos],
+    )
+
+
+def estimated_size(todo_list: TodoList) -> int:
+    # objects and strings, without the (shared) interned parts
+    size = sys.getsizeof(todo_list) + sys.getsizeof(todo_list.todos)
+    size += sys.getsizeof(todo_list.list_id) + sys.getsizeof(todo_list.title)
+    for item in todo_list.todos:
+        size += sys.getsizeof(item) + sys.getsizeof(item.item_id)
+        size += sys.getsizeof(item.content)
+    return size
+
+
+@dataclass
+class TodoListCache:
+    max_bytes: int
+    # incremented by every invalidation: a list loaded before must not be put afterwards
+    generation: int = field(default=0, init=False)
+    entries: OrderedDict[str, tuple[TodoList, int]] = field(
+        default_factory=OrderedDict, init=False, repr=False
+    )
+    list_ids_by_item_id: dict[str, str] = field(
+        default_factory=dict, init=False, repr=False
+    )
+    stats: TodoListCacheStats = field(default_factory=TodoListCacheStats, init=False)
+    lock: Lock = field(default_factory=Lock, init=False, repr=False, compare=False)
+
+    def get(self, list_id: str) -> TodoList | None:
+        with self.lock:
+            entry = self.entries.get(list_id)
+            if entry is None:
+                self.stats.n_misses += 1
+                return None
+            self.entries.move_to_end(list_id)
+            self.stats.n_hits += 1
+        return copy_todo_list(entry[0])
+
+    def put(self, todo_list: TodoList, generation: int) -> None:
+        # generation: as read before loading the list
+        size = estimated_size(todo_list)
+        if size > self.max_bytes:
+            return
+        todo_list = copy_todo_list(todo_list)
+        with self.lock:
+            if generation != self.generation:
+                return  # possibly loaded before a write
+            self.remove(todo_list.list_id)
+            self.entries[todo_list.list_id] = (todo_list, size)
+            for item in todo_list.todos:
+                self.list_ids_by_item_id[item.item_id] = todo_list.list_id
+            self.stats.n_bytes += size
+            while self.stats.n_bytes > self.max_bytes:
+                self.remove(next(iter(self.entries)))
+                self.stats.n_evictions += 1
+            self.stats.n_entries = len(self.entries)
+
+    def invalidate(self, list_ids: Iterable[str], item_ids: Iterable[str] = ()) -> None:
+        # the given lists, and the cached lists containing one of the given items
+        with self.lock:
+            self.generation += 1
+            list_ids = set(list_ids)
+            list_ids.update(
+                list_id
+                for item_id in item_ids
+                if (list_id := self.list_ids_by_item_id.get(item_id)) is not None
+            )
+            for list_id in list_ids:
+                if self.remove(list_id):
+                    self.stats.n_invalidations += 1
+            self.stats.n_entries = len(self.entries)
+
+    def remove(self, list_id: str) -> bool:
+        # to be called with the lock held
+        entry = self.entries.pop(list_id, None)
+        if entry is None:
+            return False
+        todo_list, size = entry
+        for item in todo_list.todos:
+            if self.list_ids_by_item_id.get(item.item_id) == list_id:
+                del self.list_ids_by_item_id[item.item_id]
+        self.stats.n_bytes -= size
+        return True
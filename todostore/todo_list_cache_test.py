@@ -0,0 +1,54 @@
+from todostore.todo_list_cache import TodoListCache, estimated_size
+from todostore.todostore import TodoItem, TodoList
+
+
+def todo_list(list_id: str, *item_ids: str) -> TodoList:
+    return TodoList(list_id, "title", [TodoItem(i, "content") for i in item_ids])
+
+
+def test_lru_eviction_within_byte_budget():
+    size = estimated_size(todo_list("l0", "i0"))
+    cache = TodoListCache(max_bytes=2 * size)
+    for list_id in ["l0", "l1"]:
+        cache.put(todo_list(list_id, list_id.replace("l", "i")), cache.generation)
+    assert cache.get("l0") is not None  # now most recently used
+    cache.put(todo_list("l2", "i2"), cache.generation)
+    assert cache.get("l1") is None
+    assert cache.get("l0") == todo_list("l0", "i0")
+
+    stats = cache.stats
+    assert (stats.n_hits, stats.n_misses, stats.n_evictions) == (2, 1, 1)
+    assert (stats.n_entries, stats.n_bytes) == (2, 2 * size)
+    assert stats.hit_ratio == 2 / 3
+
+
+def test_invalidation_by_list_and_item():
+    cache = TodoListCache(max_bytes=10_000)
+    cache.put(todo_list("l0", "i0"), cache.generation)
+    cache.put(todo_list("l1", "i1"), cache.generation)
+    cache.invalidate([], ["i1", "unknown"])  # e.g. an item deleted by a sync
+    assert cache.get("l1") is None
+    assert cache.get("l0") is not None
+    cache.invalidate(["l0"])
+    assert cache.get("l0") is None
+    assert cache.stats.n_invalidations == 2
+    assert cache.list_ids_by_item_id == {}
+
+
+def test_loaded_before_invalidation_is_not_cached():
+    cache = TodoListCache(max_bytes=10_000)
+    generation = cache.generation
+    cache.invalidate(["l0"])  # written while loading
+    cache.put(todo_list("l0"), generation)
+    assert cache.get("l0") is None
+
+
+def test_cached_lists_are_copies():
+    cache = TodoListCache(max_bytes=10_000)
+    original = todo_list("l0", "i0")
+    cache.put(original, cache.generation)
+    original.todos[0].content = "modified"
+    loaded = cache.get("l0")
+    assert loaded is not None and loaded.todos[0].content == "content"
+    loaded.title = "modified"
+    assert cache.get("l0") == todo_list("l0", "i0")
@@ -1,6 +1,6 @@
 from abc import ABCMeta, abstractmethod
 from dataclasses import dataclass, field
-from typing import Generic, TypeVar
+from typing import Generic, Iterable, Iterator, TypeVar
 
 from syncstore.syncstore import SyncStore
 
@@ -18,6 +18,11 @@ class EntityStore(Generic[T, ID], metaclass=ABCMeta):
     @abstractmethod
     def load(self, entity_id: str) -> T | None: ...
 
+    def load_many(self, entity_ids: Iterable[str]) -> dict[str, T]:
+        # entities by id, missing ones are left out
+        entities = {eid: self.load(eid) for eid in entity_ids}
+        return {eid: e for eid, e in entities.items() if e is not None}
+
     @abstractmethod
     def get_tables(self) -> list[str]: ...
 
@@ -36,7 +41,42 @@ class TodoList:
 
 
 @dataclass
-class TodoStore(EntityStore[TodoList, str]): ...
+class TodoListFilter:
+    title_prefix: str | None = None  # case-sensitive
+    min_items: int | None = None
+    max_items: int | None = None
+
+
+@dataclass
+class SearchHit:
+    list_id: str
+    item_id: str | None  # None: the title of the list matched
+    snippet: str  # matching part of the text, matches in [brackets]
+    rank: float  # lower is better
+
+
+class InvalidSearchQueryError(ValueError):
+    pass
+
+
+@dataclass
+class TodoStore(EntityStore[TodoList, str]):
+    @abstractmethod
+    def search(self, query: str, limit: int = 20) -> list[SearchHit]:
+        # full-text search over list titles and item contents (fts5 query syntax),
+        # best matches first; raises InvalidSearchQueryError for an invalid query
+        ...
+
+    @abstractmethod
+    def iter_lists(
+        self,
+        page_size: int = 1000,
+        after: str | None = None,
+        list_filter: TodoListFilter | None = None,
+    ) -> Iterator[TodoList]:
+        # all (matching) lists ordered by list_id, starting after the given list_id;
+        # loaded page by page, so that only a single page is held in memory at a time
+        ...
 
 
 @dataclass
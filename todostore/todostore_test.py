@@ -1,7 +1,15 @@
 import pytest
+from sqlalchemy import event, text
 
 from sqlite_setup import get_engine
-from todostore.todostore import TodoItem, TodoList, TodoStore
+from todostore import sql_todostore
+from todostore.todostore import (
+    InvalidSearchQueryError,
+    TodoItem,
+    TodoList,
+    TodoListFilter,
+    TodoStore,
+)
 from todostore.sql_todostore import SqlTodoStore
 
 
@@ -22,3 +30,174 @@ def test_todostore(s: TodoStore):
     assert list_1 is not None
     assert list_1.title == "title_1"
     assert list_1.todos == [TodoItem("item_1", "item_content_1")]
+
+
+def test_load_many(s: SqlTodoStore, monkeypatch):
+    lists = [
+        TodoList(
+            f"list_{i}", f"title_{i}", [TodoItem(f"item_{i}_{j}") for j in range(i)]
+        )
+        for i in range(5)
+    ]
+    for todo_list in lists:
+        s.save(todo_list)
+
+    statements: list[str] = []
+    event.listen(
+        s.engine, "before_cursor_execute", lambda *args: statements.append(args[2])
+    )
+    monkeypatch.setattr(sql_todostore, "IN_CHUNK_SIZE", 2)
+    loaded = s.load_many([f"list_{i}" for i in range(5)] + ["missing", "list_0"])
+    assert loaded == {todo_list.list_id: todo_list for todo_list in lists}
+    assert len(statements) == 2 * 3  # lists and items, per chunk of 2 ids
+
+
+def test_indexes_are_added_to_existing_tables(clean_test_db_dir):
+    engine = get_engine(db_file="./db/todostore_test_existing.db")
+    with engine.begin() as c:
+        # as created before todo_item.list_id was indexed
+        c.execute(
+            text(
+                "CREATE TABLE todo_item (item_id VARCHAR DEFAULT 'default_item_id'"
+                " NOT NULL PRIMARY KEY, content VARCHAR, list_id VARCHAR)"
+            )
+        )
+    SqlTodoStore("s", engine=engine)
+    with engine.connect() as c:
+        indexes = c.execute(text("PRAGMA index_list(todo_item)")).all()
+    assert "ix_todo_item_list_id" in [index.name for index in indexes]
+
+
+def test_save_diff(s: SqlTodoStore):
+    previous = TodoList(
+        "list_1", "title", [TodoItem(f"item_{i}", "c") for i in range(4)]
+    )
+    s.save(previous)
+    statements: list[str] = []
+    event.listen(
+        s.engine, "before_cursor_execute", lambda *args: statements.append(args[2])
+    )
+
+    modified = TodoList(
+        "list_1", "title", [TodoItem(f"item_{i}", "c") for i in range(4)]
+    )
+    modified.todos[1].content = "changed"
+    del modified.todos[2]
+    modified.todos.append(TodoItem("item_new", "new"))
+    s.save(modified, previous)
+    assert s.load("list_1") == TodoList(
+        "list_1",
+        "title",
+        [
+            TodoItem("item_0", "c"),
+            TodoItem("item_1", "changed"),
+            TodoItem("item_3", "c"),
+            TodoItem("item_new", "new"),
+        ],
+    )
+    # delete, insert of the new item, upsert of the changed one; no reads
+    assert [st.split()[0] for st in statements[:3]] == ["DELETE", "INSERT", "INSERT"]
+
+    statements.clear()
+    s.save(modified, modified)
+    assert statements == []  # nothing changed, nothing written
+
+    with pytest.raises(ValueError):
+        s.save(modified, TodoList("list_2"))
+
+
+def test_save_diff_of_concurrently_deleted_rows(s: SqlTodoStore):
+    previous = TodoList("list_1", "title", [TodoItem("item_1", "c")])
+    s.save(previous)
+    with s.engine.begin() as c:  # e.g. deleted by a merge, after previous was loaded
+        c.execute(text("DELETE FROM todo_item"))
+        c.execute(text("DELETE FROM todo_list"))
+
+    modified = TodoList("list_1", "changed", [TodoItem("item_1", "changed")])
+    s.save(modified, previous)
+    assert s.load("list_1") == modified
+
+
+def test_iter_lists(s: SqlTodoStore):
+    lists = [
+        TodoList(
+            f"list_{i:02}",
+            "shopping" if i % 2 else "work",
+            [TodoItem(f"item_{i}_{j}") for j in range(i % 4)],
+        )
+        for i in range(11)
+    ]
+    for todo_list in reversed(lists):
+        s.save(todo_list)
+
+    assert list(s.iter_lists(page_size=3)) == lists
+    assert list(s.iter_lists(page_size=11)) == lists  # full page, then an empty one
+    assert list(s.iter_lists(page_size=3, after="list_07")) == lists[8:]
+
+    list_filter = TodoListFilter(title_prefix="shop", min_items=1, max_items=2)
+    assert [t.list_id for t in s.iter_lists(2, list_filter=list_filter)] == [
+        f"list_{i:02}" for i in range(11) if i % 2 and 1 <= i % 4 <= 2
+    ]
+    assert list(s.iter_lists(list_filter=TodoListFilter(title_prefix="Shop"))) == []
+
+
+def test_search(s: SqlTodoStore):
+    s.save(TodoList("list_1", "groceries", [TodoItem("item_1", "buy fresh milk")]))
+    # enabled on an existing database: indexes the stored rows first
+    s = SqlTodoStore("s", s.engine, search_index=True)
+    s.save(TodoList("list_2", "milk tasting", [TodoItem("item_2", "oat milk")]))
+
+    hits = s.search("milk")
+    assert {(h.list_id, h.item_id) for h in hits} == {
+        ("list_1", "item_1"),
+        ("list_2", None),
+        ("list_2", "item_2"),
+    }
+    assert [h.rank for h in hits] == sorted(h.rank for h in hits)
+    (hit,) = s.search("fresh")
+    assert (hit.list_id, hit.item_id, hit.snippet) == (
+        "list_1",
+        "item_1",
+        "buy [fresh] milk",
+    )
+    assert len(s.search("milk", limit=2)) == 2
+
+    s.save(TodoList("list_1", "groceries", [TodoItem("item_1", "buy bread")]))
+    s.save(TodoList("list_2", "tasting", []))
+    assert s.search("milk") == []
+    assert [h.item_id for h in s.search("bread")] == ["item_1"]
+
+    # the implicit rowids of the content tables may change (e.g. by a vacuum)
+    with s.engine.begin() as c:
+        c.execute(text("UPDATE todo_item SET rowid = rowid + 1000"))
+        c.execute(text("UPDATE todo_list SET rowid = rowid + 1000"))
+    assert [(h.list_id, h.item_id) for h in s.search("bread")] == [("list_1", "item_1")]
+    assert [(h.list_id, h.item_id) for h in s.search("tasting")] == [("list_2", None)]
+
+
+def test_search_ranks_lists_and_items_alike(s: SqlTodoStore):
+    s = SqlTodoStore("s", s.engine, search_index=True)
+    other_items = [TodoItem(f"item_{i}", "some longer text " * i) for i in range(2, 9)]
+    s.save(TodoList("list_1", "milk", [TodoItem("item_1", "milk"), *other_items]))
+    # ranked by a single index: the same text matches the same, title or item
+    title_hit, item_hit = sorted(s.search("milk"), key=lambda h: h.item_id or "")
+    assert (title_hit.item_id, item_hit.item_id) == (None, "item_1")
+    assert title_hit.rank == item_hit.rank
+
+    for query in ['"unterminated', "AND", "nocolumn: milk"]:
+        with pytest.raises(InvalidSearchQueryError):
+            s.search(query)
+
+
+def test_search_index_replaces_rowid_index(s: SqlTodoStore):
+    s.save(TodoList("list_1", "groceries", [TodoItem("item_1", "buy fresh milk")]))
+    with s.engine.begin() as c:  # as created by former versions
+        for table, column in [("todo_list", "title"), ("todo_item", "content")]:
+            c.execute(
+                text(
+                    f"CREATE VIRTUAL TABLE {table}_search USING fts5({column},"
+                    f" content='{table}', content_rowid='rowid')"
+                )
+            )
+    s = SqlTodoStore("s", s.engine, search_index=True)
+    assert [(h.list_id, h.item_id) for h in s.search("milk")] == [("list_1", "item_1")]